@@ -22,7 +22,7 @@ SCRIPTPATH=$(dirname $(realpath $0))
 SCHEMATA=( 89dhcp.ldif )
 UPDATES=( 89dhcp.update )
 IPASERVER_PLUGINS=( dhcpv4.py dhcpv6.py dhcpcommon.py )
-UI_PLUGINS=( dhcpv4 dhcpv6 )
+UI_PLUGINS=( dhcpcommon dhcpv4 dhcpv6 )
 
 ###############################################################################
 
@@ -29,9 +29,25 @@ from .baseldap import (
     LDAPRetrieve)
 from ipalib.parameters import *
 from ipalib.plugable import Registry
+from ipalib.request import context
 from ipapython.dn import DN
 from ipapython.dnsutil import DNSName
 from netaddr import *
+from ldap import RES_SEARCH_ENTRY, SIZELIMIT_EXCEEDED
+from ldap.controls.sss import SSSRequestControl
+from ldap.filter import escape_filter_chars
+
+import binascii
+import bisect
+import datetime
+import heapq
+import logging
+import os
+import re
+import socket
+import struct
+import threading
+import time
 
 # class dhcpcommon(object):
 dhcp_version = 4
@@ -47,144 +63,2068 @@ def dhcp_get_version( version ):
     return dhcp_version
 
 
-def dhcp_modify_domainserver( dhcp_version, options, dhcpOptions):
-    if dhcp_version == 4 :
-        start_with_options = 'domain-name-servers '
-    elif dhcp_version == 6 :
-        start_with_options = 'dhcp6.name-servers '
-    
-    option_item = 'domainnameservers'
-    
-    dhcp_modify_options_ip_address( options, option_item, dhcpOptions, start_with_options )
+#######################################################################################################
+##                                general
+#######################################################################################################
+def dhcp_normalize_macaddress( macaddress ):
+    # IPA accepts HH:HH:.., HH-HH-.. and bare HHHH.. for host MAC addresses;
+    # the dhcpHost entries always use the colon separated upper case form.
+    digits = re.sub('[^0-9A-Fa-f]', '', macaddress).upper()
+    return u':'.join(digits[i:i + 2] for i in range(0, len(digits), 2))
+
+
+#######################################################################################################
+##                                parsed attribute model
+#######################################################################################################
+
+# dhcpStatements, dhcpOption, dhcpHWAddress and dhcpPermitList values are
+# parsed once into a keyword -> value map. The result is memoized on the raw
+# attribute values, so every show/mod/find of entries sharing the same values
+# reuses it. The maps are shared and must not be modified by callers.
+dhcp_parse_cache = {}
+dhcp_parse_cache_size = 8192
+
+def dhcp_parse_attribute( attr, values ):
+    key = (attr.lower(), tuple(values))
+    try:
+        return dhcp_parse_cache[key]
+    except KeyError:
+        pass
+
+    parsed = {}
+    if key[0] == 'dhcppermitlist':
+        # "allow known-clients" -> {'known-clients': 'allow'}
+        for value in key[1]:
+            (verb, sep, keyword) = value.partition(' ')
+            parsed[keyword] = verb
+    else:
+        # "default-lease-time 43200" -> {'default-lease-time': '43200'}
+        for value in key[1]:
+            (keyword, sep, rest) = value.partition(' ')
+            parsed[keyword] = rest
+
+    if len(dhcp_parse_cache) >= dhcp_parse_cache_size:
+        dhcp_parse_cache.clear()
+    dhcp_parse_cache[key] = parsed
+    return parsed
+
+def dhcp_decode_value( value ):
+    return value
+
+def dhcp_decode_unquote( value ):
+    return value.replace('"', '')
+
+def dhcp_decode_list( value ):
+    return value.split(', ')
+
+def dhcp_decode_quoted_list( value ):
+    return value.replace('"', '').split(', ')
+
+def dhcp_decode_permit( value ):
+    return {'allow': True, 'deny': False}.get(value)
 
-def dhcp_modify_domainsearch( dhcp_version, options, dhcpOptions ):
-    if dhcp_version == 4 :
-        start_with_options = 'domain-search '
-    elif dhcp_version == 6 :
-        start_with_options = 'dhcp6.domain-search '
+# Encoders turn an option value into the part of the attribute value that
+# follows (or, in dhcpPermitList, precedes) the keyword. None leaves the
+# attribute alone.
+def dhcp_encode_value( value ):
+    if value is None or value == u'':
+        return None
+    return unicode(value)
 
-    option_item = 'domainsearch'
-    if option_item in options:
-        option_value = start_with_options + ', '.join('"' + s + '"' for s in options[option_item])
-        dhcp_modify_options( option_value, dhcpOptions, start_with_options )
+def dhcp_encode_quote( value ):
+    if not value:
+        return None
+    return u'"{0}"'.format(value)
 
-def dhcp_modify_router( dhcp_version, options, dhcpOptions):
-    start_with_options = 'routers '
-    option_item = 'router'
+def dhcp_encode_list( value ):
+    if not isinstance(value, (list, tuple)):
+        value = [value] if value else []
+    if not value:
+        return None
+    return u', '.join(value)
 
-    dhcp_modify_options_ip_address( options, option_item, dhcpOptions, start_with_options )
+def dhcp_encode_quoted_list( value ):
+    if not value:
+        return None
+    return u', '.join(u'"{0}"'.format(v) for v in value)
 
-def dhcp_modify_maxleasetime( dhcp_version, options, dhcpStatements ):
-    start_with_options = 'max-lease-time '
-    option_item = 'maxleasetime'
+def dhcp_encode_permit( value ):
+    if value is None:
+        return None
+    return u'allow' if value else u'deny'
 
-    dhcp_modify_statements_value( options, option_item, dhcpStatements, start_with_options )
+# virtual attribute -> sources as (LDAP attribute, v4 keyword, v6 keyword,
+# decoder, encoder). When several sources are present the last one wins on
+# read; a *_mod writes every source that has an encoder. Sources without an
+# encoder are read-only.
+dhcp_virtual_params = {
+    'defaultleasetime': (
+        ('dhcpstatements', 'default-lease-time', 'default-lease-time', dhcp_decode_value, dhcp_encode_value),
+    ),
+    'maxleasetime': (
+        ('dhcpstatements', 'max-lease-time', 'max-lease-time', dhcp_decode_value, dhcp_encode_value),
+    ),
+    'domainname': (
+        ('dhcpstatements', 'ddns-domainname', 'ddns-domainname', dhcp_decode_unquote, dhcp_encode_quote),
+        ('dhcpoption', 'domain-name', 'domain-name', dhcp_decode_unquote, dhcp_encode_quote),
+    ),
+    'domainnameservers': (
+        ('dhcpoption', 'domain-name-servers', 'dhcp6.name-servers', dhcp_decode_list, dhcp_encode_list),
+    ),
+    'domainnameserver': (
+        ('dhcpoption', 'domain-name-servers', 'dhcp6.name-servers', dhcp_decode_list, dhcp_encode_list),
+    ),
+    'domainsearch': (
+        ('dhcpoption', 'domain-search', 'dhcp6.domain-search', dhcp_decode_quoted_list, dhcp_encode_quoted_list),
+    ),
+    'router': (
+        ('dhcpoption', 'routers', 'routers', dhcp_decode_value, dhcp_encode_list),
+    ),
+    'permitknownclients': (
+        ('dhcppermitlist', 'known-clients', 'known-clients', dhcp_decode_permit, dhcp_encode_permit),
+    ),
+    'permitunknownclients': (
+        ('dhcppermitlist', 'unknown-clients', 'unknown-clients', dhcp_decode_permit, dhcp_encode_permit),
+    ),
+    'ipaddress': (
+        ('dhcpstatements', 'fixed-address', 'fixed-address', dhcp_decode_value, None),
+    ),
+    'ipaddress6': (
+        ('dhcpstatements', 'fixed-address6', 'fixed-address6', dhcp_decode_value, None),
+    ),
+    'hostname': (
+        ('dhcpstatements', 'ddns-hostname', 'ddns-hostname', dhcp_decode_unquote, dhcp_encode_quote),
+        ('dhcpoption', 'host-name', 'host-name', dhcp_decode_unquote, dhcp_encode_quote),
+    ),
+    'macaddress': (
+        ('dhcphwaddress', 'ethernet', 'ethernet', dhcp_decode_unquote, None),
+    ),
+}
 
-def dhcp_modify_defaultleasetime( dhcp_version, options, dhcpStatements ):
-    start_with_options = 'default-lease-time '
-    option_item = 'defaultleasetime'
+# Keywords that older versions of this plugin wrote by mistake; a *_mod
+# replaces them with the right one.
+dhcp_keyword_aliases = {
+    'dddns-domainname': 'ddns-domainname',
+}
 
-    dhcp_modify_statements_value( options, option_item, dhcpStatements, start_with_options )
+def dhcp_extract_virtual_params( dhcp_version, entry_attrs, names ):
+    for name in names:
+        for (attr, keyword4, keyword6, decode, encode) in dhcp_virtual_params[name]:
+            keyword = keyword6 if dhcp_version == 6 else keyword4
+            parsed = dhcp_parse_attribute(attr, entry_attrs.get(attr, []))
+            if keyword in parsed:
+                value = decode(parsed[keyword])
+                if value is not None:
+                    entry_attrs[name] = value
+    return entry_attrs
 
-def dhcp_modify_permitknownclients( dhcp_version, options, dhcpPermitList ):
-    end_with_options = ' known-clients'
-    option_item = 'permitknownclients'
-    return dhcp_modify_permit( options, option_item, dhcpPermitList, end_with_options )
+def dhcp_value_keyword( attr, value ):
+    if attr == 'dhcppermitlist':
+        keyword = value.partition(' ')[2]
+    else:
+        keyword = value.partition(' ')[0]
+    return dhcp_keyword_aliases.get(keyword, keyword)
 
+def dhcp_format_value( attr, keyword, value ):
+    if attr == 'dhcppermitlist':
+        return u'{0} {1}'.format(value, keyword)
+    return u'{0} {1}'.format(keyword, value)
 
-def dhcp_modify_permitunknownclients( dhcp_version, options, dhcpPermitList) :
-    end_with_options = ' unknown-clients'
-    option_item = 'permitunknownclients'
+def dhcp_virtual_updates( dhcp_version, options, names ):
+    # The (attribute, keyword, value) triples the options given for names
+    # set, in order.
+    updates = []
+    for name in names:
+        if name not in options:
+            continue
+        for (attr, keyword4, keyword6, decode, encode) in dhcp_virtual_params[name]:
+            if encode is None:
+                continue
+            value = encode(options[name])
+            if value is not None:
+                updates.append((attr, keyword6 if dhcp_version == 6 else keyword4, value))
+    return updates
 
-    return dhcp_modify_permit( options, option_item, dhcpPermitList, end_with_options )
+def dhcp_apply_virtual_updates( updates, values ):
+    # Write updates into values, a map of LDAP attribute to list of values,
+    # in one pass: the position of every keyword in an attribute is indexed
+    # once, so each update replaces its value or is appended without
+    # scanning the list again.
+    positions = {}
+    for (attr, keyword, value) in updates:
+        attr_values = values.setdefault(attr, [])
+        if attr not in positions:
+            positions[attr] = {}
+            for (i, v) in enumerate(attr_values):
+                positions[attr].setdefault(dhcp_value_keyword(attr, v), i)
+        index = positions[attr]
+        formatted = dhcp_format_value(attr, keyword, value)
+        if keyword in index:
+            attr_values[index[keyword]] = formatted
+        else:
+            index[keyword] = len(attr_values)
+            attr_values.append(formatted)
+    return values
 
-def dhcp_modify_domainname( dhcp_version, options, dhcpOptions, dhcpStatements ):
-    if dhcp_version == 4 :
-        start_with_options = 'domain-name '
-        start_with_statements = 'dddns-domainname '
-    elif dhcp_version == 6 :
-        start_with_options = 'domain-name '
-        start_with_statements = 'dddns-domainname '
+def dhcp_mod_virtual_params( ldap, dn, entry_attrs, options, dhcp_version, names ):
+    # Merge the virtual options of a *_mod into entry_attrs. Attributes the
+    # options touch that are not being set are read with a single get_entry
+    # of just those attributes; nothing is read when no option was given.
+    updates = dhcp_virtual_updates(dhcp_version, options, names)
+    if not updates:
+        return entry_attrs
 
-    option_item = 'domainname'
-    if option_item in options:
-        option_value = '{0}"{1}"'.format(start_with_options, options[option_item])
-        statement_value = '{0}"{1}"'.format(start_with_statements, options[option_item])
-        dhcp_modify_options_statements( option_value, statement_value, dhcpOptions, dhcpStatements, start_with_options, start_with_statements )
+    attrs = sorted(set(attr for (attr, keyword, value) in updates))
+    missing = [attr for attr in attrs if attr not in entry_attrs]
+    entry = {}
+    if missing:
+        entry = ldap.get_entry(dn, missing)
 
-def dhcp_modify_hostname( dhcp_version, options, dhcpOptions, dhcpStatements ):
-    if dhcp_version == 4 :
-        start_with_options = 'host-name '
-        start_with_statements = 'ddns-hostname '
-    elif dhcp_version == 6 :
-        start_with_options = 'host-name '
-        start_with_statements = 'ddns-hostname '
+    values = dict(
+        (attr, list(entry_attrs.get(attr) or []) if attr in entry_attrs else list(entry.get(attr, [])))
+        for attr in attrs
+    )
+    dhcp_apply_virtual_updates(updates, values)
+    for attr in attrs:
+        entry_attrs[attr] = values[attr]
+    return entry_attrs
+
+def dhcp_virtual_source_attrs( names ):
+    attrs = set()
+    for name in names:
+        for source in dhcp_virtual_params[name]:
+            attrs.add(source[0])
+    return attrs
+
+def dhcp_find_virtual_attrs( obj, attrs_list, options ):
+    # Make a *_find fetch the raw attributes behind obj's virtual attributes.
+    if options.get('pkey_only', False) or '*' in attrs_list:
+        return
+    for attr in dhcp_virtual_source_attrs(obj.virtual_params):
+        if attr not in attrs_list:
+            attrs_list.append(attr)
+
+def dhcp_find_extract_virtual_params( obj, ldap, entries, options ):
+    # Expand the virtual attributes of a whole *_find result set and drop the
+    # raw attributes dhcp_find_virtual_attrs() only fetched for that purpose.
+    if options.get('pkey_only', False):
+        return
+    extra = set()
+    if not options.get('all', False):
+        extra = dhcp_virtual_source_attrs(obj.virtual_params)
+        extra.difference_update(obj.default_attributes)
+    for entry in entries:
+        obj.extract_virtual_params(ldap, entry.dn, entry, (), options)
+        for attr in extra:
+            if attr in entry:
+                del entry[attr]
 
-    option_item = 'domainname'
-    if option_item in options:
-        option_value = '{0}"{1}"'.format(start_with_options, options[option_item])
-        statement_value = '{0}"{1}"'.format(start_with_statements, options[option_item])
-        dhcp_modify_options_statements( option_value, statement_value, dhcpOptions, dhcpStatements, start_with_options, start_with_statements )
 
 #######################################################################################################
-##                                general
+##                                dhcpService cache
 #######################################################################################################
-def dhcp_modify_options_ip_address( options, option_item, dhcpOptions, start_with_options ):
-    if option_item in options:
-        # if isinstance(options[option_item], list) or isinstance(options[option_item], tuple):
-        if isinstance(options[option_item], list) or isinstance(options[option_item], tuple):
-            option_value = start_with_options + ', '.join( s for s in options[option_item])
-            dhcp_modify_options( option_value, dhcpOptions, start_with_options )
-        elif len(options[option_item]) > 0 :
-            option_value = '{0}{1}'.format(start_with_options, options[option_item])
-            dhcp_modify_options( option_value, dhcpOptions, start_with_options )
-
-def dhcp_modify_options( option_value, dhcpOptions, start_with_options ):
-    foundOption = False
-    for i, s in enumerate(dhcpOptions):
-        if s.startswith(start_with_options):
-            foundOption = True
-            dhcpOptions[i] = option_value
-            break
-    if not foundOption:
-        dhcpOptions.append(option_value)
-
-def dhcp_modify_options_value( options, option_item, dhcpOptions, start_with_options ):
-    if option_item in options:
-        option_value = '{0}{1}'.format(start_with_options, options[option_item])
-        dhcp_modify_options( option_value, dhcpOptions, start_with_options )
-
-def dhcp_modify_statements( statement_value, dhcpStatements, start_with_statements ):
-    foundOption = False
-    for i, s in enumerate(dhcpStatements):
-        if s.startswith(start_with_statements):
-            foundOption = True
-            dhcpStatements[i] = statement_value
+
+# Caches that live for a single request. They are kept on the ipalib request
+# context, which is cleared when the request ends, so an entry read under the
+# bind of one request is never served to another one, and nothing outlives
+# changes made through other httpd workers.
+def dhcp_request_cache( name ):
+    caches = getattr(context, 'dhcp_caches', None)
+    if caches is None:
+        caches = context.dhcp_caches = {}
+    return caches.setdefault(name, {})
+
+dhcp_service_stamp_attrs = ['modifytimestamp', 'entrycsn']
+
+def dhcp_service_stamp( entry ):
+    return tuple(
+        tuple(entry.get(attr, [])) for attr in dhcp_service_stamp_attrs
+    )
+
+# The dhcpService entries read during a request, keyed by DN. Commands that
+# consult the service several times (inherited lease times, the effective
+# options of every entry of a listing) read it once. Modifications made by
+# the request drop the entry with dhcp_service_invalidate(). Cached entries
+# are shared and must not be modified by callers.
+def dhcp_service_entry( ldap, dn ):
+    cache = dhcp_request_cache('service')
+    entry = cache.get(dn)
+    if entry is None:
+        entry = cache[dn] = ldap.get_entry(dn, ['*'] + dhcp_service_stamp_attrs)
+    return entry
+
+def dhcp_service_invalidate( dn=None ):
+    cache = dhcp_request_cache('service')
+    if dn is None:
+        cache.clear()
+    else:
+        cache.pop(dn, None)
+
+def dhcp_inherit_lease_times( ldap, service_dn, entry_attrs ):
+    # Copy default-lease-time and max-lease-time from the dhcpService entry
+    # into a new pool or group unless they were given explicitly.
+    statements = list(entry_attrs.get('dhcpstatements', []))
+    parsed = dhcp_parse_attribute('dhcpstatements', statements)
+    missing = [k for k in ('default-lease-time', 'max-lease-time') if k not in parsed]
+    if not missing:
+        return
+
+    service = dhcp_service_entry(ldap, service_dn)
+    inherited = dhcp_parse_attribute('dhcpstatements', service.get('dhcpstatements', []))
+
+    for keyword in missing:
+        if keyword in inherited:
+            statements.append(u'{0} {1}'.format(keyword, inherited[keyword]))
+
+    entry_attrs['dhcpstatements'] = statements
+
+
+#######################################################################################################
+##                                address ranges
+#######################################################################################################
+
+# Static interval tree over (first, last, item) tuples, where first and last
+# are integer addresses. The intervals are kept sorted on their first
+# address in a flat list that doubles as an implicit balanced tree (the node
+# for the slice [lo, hi) is (lo + hi) // 2); maxlast[i] is the highest last
+# address in the subtree rooted at i, which lets a query skip every subtree
+# that ends before the queried range starts.
+class DHCPIntervalTree(object):
+
+    def __init__( self, intervals ):
+        self.intervals = sorted(intervals, key=lambda interval: (interval[0], interval[1]))
+        self.maxlast = [interval[1] for interval in self.intervals]
+        self.build(0, len(self.intervals))
+
+    def build( self, lo, hi ):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        for child in (self.build(lo, mid), self.build(mid + 1, hi)):
+            if child is not None and self.maxlast[child] > self.maxlast[mid]:
+                self.maxlast[mid] = self.maxlast[child]
+        return mid
+
+    def overlapping( self, first, last ):
+        found = []
+        stack = [(0, len(self.intervals))]
+        while stack:
+            (lo, hi) = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.maxlast[mid] < first:
+                continue
+            stack.append((lo, mid))
+            interval = self.intervals[mid]
+            if interval[0] <= last:
+                if interval[1] >= first:
+                    found.append(interval)
+                stack.append((mid + 1, hi))
+        return found
+
+    def overlaps( self ):
+        # Sweep the intervals in order of their first address and keep the
+        # ones that are still open in a heap on their last address; every
+        # open interval overlaps the one being added.
+        active = []
+        for (index, interval) in enumerate(self.intervals):
+            while active and active[0][0] < interval[0]:
+                heapq.heappop(active)
+            for (last, other) in active:
+                yield (self.intervals[other], interval)
+            heapq.heappush(active, (interval[1], index))
+
+# An inclusive range of integer addresses of one IP version. The bounds are
+# plain (long) integers, so a /48 or /64 pool costs as much as a /30 one and
+# no netaddr objects are made except to print an address.
+class DHCPRange(object):
+
+    __slots__ = ('version', 'first', 'last')
+
+    def __init__( self, version, first, last ):
+        self.version = version
+        self.first = first
+        self.last = last
+
+    @classmethod
+    def parse( cls, value ):
+        # "first last" as used in dhcpRange and dhcpRange6, or a single
+        # address. The bounds are not checked to be in order.
+        parts = value.split()
+        if len(parts) not in (1, 2):
+            raise ValueError(value)
+        (first, last) = (IPAddress(parts[0]), IPAddress(parts[-1]))
+        if first.version != last.version:
+            raise ValueError(value)
+        return cls(first.version, first.value, last.value)
+
+    @classmethod
+    def network( cls, network ):
+        return cls(network.version, network.first, network.last)
+
+    def __eq__( self, other ):
+        return (
+            isinstance(other, DHCPRange) and
+            (self.version, self.first, self.last) == (other.version, other.first, other.last)
+        )
+
+    def __ne__( self, other ):
+        return not self == other
+
+    def __hash__( self ):
+        return hash((self.version, self.first, self.last))
+
+    def __repr__( self ):
+        return 'DHCPRange({0}, {1}, {2})'.format(self.version, self.first, self.last)
+
+    def __unicode__( self ):
+        return u'{0} {1}'.format(self.address(self.first), self.address(self.last))
+
+    def address( self, value ):
+        return IPAddress(value, self.version)
+
+    def size( self ):
+        return max(self.last - self.first + 1, 0)
+
+    def contains( self, other ):
+        # other is a DHCPRange or an integer address of the same version.
+        if isinstance(other, DHCPRange):
+            return (
+                other.version == self.version and
+                self.first <= other.first and other.last <= self.last
+            )
+        return self.first <= other <= self.last
+
+    def overlaps( self, other ):
+        return (
+            other.version == self.version and
+            self.first <= other.last and other.first <= self.last
+        )
+
+    def intersection( self, other ):
+        if not self.overlaps(other):
+            return None
+        return DHCPRange(self.version, max(self.first, other.first), min(self.last, other.last))
+
+    def subtract( self, others ):
+        # The parts of the range that none of others covers, lowest first.
+        # others are DHCPRanges or (first, last, ...) tuples.
+        return [
+            DHCPRange(self.version, first, last)
+            for (first, last) in dhcp_range_gaps(self.first, self.last, [
+                (other.first, other.last) if isinstance(other, DHCPRange) else other
+                for other in others
+            ])
+        ]
+
+def dhcp_range_gaps( first, last, occupied ):
+    # Yield the (first, last) blocks of [first, last] that are not covered by
+    # any of the (first, last, ...) tuples of occupied, lowest first. The
+    # cost depends on the number of occupied intervals, not on their size.
+    candidate = first
+    for interval in sorted(occupied):
+        if candidate > last:
+            return
+        if interval[0] > candidate:
+            yield (candidate, min(interval[0] - 1, last))
+        if interval[1] >= candidate:
+            candidate = interval[1] + 1
+    if candidate <= last:
+        yield (candidate, last)
+
+def dhcp_parse_range( value ):
+    range = DHCPRange.parse(value)
+    return (range.first, range.last)
+
+def dhcp_subnet_network( entry ):
+    cn = entry['cn'][0]
+    if '/' not in cn and 'dhcpnetmask' in entry:
+        return IPNetwork(u'{0}/{1}'.format(cn, entry['dhcpnetmask'][0]))
+    return IPNetwork(cn)
+
+def dhcp_fixed_address_filter( address ):
+    # Matches the hosts with address in their fixed-address list, through
+    # the substring index. Addresses that merely contain it match as well,
+    # so callers compare against dhcp_fixed_addresses().
+    return u'(dhcpstatements=fixed-address*{0}*)'.format(escape_filter_chars(address))
+
+def dhcp_fixed_addresses( entry, keyword='fixed-address' ):
+    # The addresses of the fixed-address statement of a host, which may list
+    # several; IP addresses in canonical form, host names as they are.
+    statements = dhcp_parse_attribute('dhcpstatements', entry.get('dhcpstatements', []))
+    addresses = []
+    for value in statements.get(keyword, u'').split(','):
+        value = value.strip()
+        if not value:
+            continue
+        try:
+            value = unicode(IPAddress(value))
+        except (AddrFormatError, ValueError):
+            pass
+        addresses.append(value)
+    return addresses
+
+def dhcp_address_intervals( ldap, network, service_dn ):
+    # Collect the pool ranges and fixed addresses that fall into a subnet.
+    # Hosts are not stored below their subnet, so the whole service container
+    # is read with a single subtree search and clipped to the subnet.
+    filter = (
+        u'(|'
+        u'(&(|(objectclass=dhcppool)(objectclass=dhcppool6))(|(dhcprange=*)(dhcprange6=*)))'
+        u'(&(objectclass=dhcphost)(dhcpstatements=fixed-address*))'
+        u')'
+    )
+
+    entries = []
+    try:
+        entries = ldap.get_entries(
+            service_dn,
+            ldap.SCOPE_SUBTREE,
+            filter,
+            ['dhcprange', 'dhcprange6', 'dhcpstatements']
+        )
+    except errors.NotFound:
+        pass
+
+    intervals = []
+    for entry in entries:
+        values = []
+        for attr in ('dhcprange', 'dhcprange6'):
+            values.extend(entry.get(attr, []))
+        statements = dhcp_parse_attribute('dhcpstatements', entry.get('dhcpstatements', []))
+        for keyword in ('fixed-address', 'fixed-address6'):
+            if keyword in statements:
+                values.extend(v.strip() for v in statements[keyword].split(','))
+
+        for value in values:
+            # Fixed addresses may also be host names, which are skipped.
+            try:
+                (first, last) = dhcp_parse_range(value)
+            except (AddrFormatError, ValueError):
+                continue
+            if last < network.first or first > network.last:
+                continue
+            intervals.append((first, last, (entry.dn, value)))
+
+    return intervals
+
+def dhcp_free_addresses( ldap, subnet_dn, service_dn, count ):
+    # Return up to count free addresses of a subnet, lowest first. The pool
+    # ranges, fixed addresses and routers of the subnet are merged into a
+    # sorted list of occupied intervals and the gaps between them are walked,
+    # so the cost depends on the number of reservations and not on the size
+    # of the subnet.
+    subnet = ldap.get_entry(subnet_dn, ['cn', 'dhcpnetmask', 'dhcpoption'])
+    network = dhcp_subnet_network(subnet)
+
+    occupied = [(first, last) for (first, last, item) in dhcp_address_intervals(ldap, network, service_dn)]
+    options = dhcp_parse_attribute('dhcpoption', subnet.get('dhcpoption', []))
+    for value in options.get('routers', u'').split(','):
+        try:
+            address = IPAddress(value.strip()).value
+        except (AddrFormatError, ValueError):
+            continue
+        occupied.append((address, address))
+
+    # The network address is never handed out, nor is the broadcast address
+    # of an IPv4 subnet.
+    first = network.first
+    last = network.last
+    if network.size > 2:
+        first += 1
+        if network.version == 4:
+            last -= 1
+
+    free = []
+    for (start, end) in dhcp_range_gaps(first, last, occupied):
+        end = min(end, start + count - len(free) - 1)
+        free.extend(start + offset for offset in range(end - start + 1))
+        if len(free) >= count:
             break
-    if not foundOption:
-        dhcpStatements.append(statement_value)
 
-def dhcp_modify_statements_value( options, option_item, dhcpStatements, start_with_options ):
-    if option_item in options:
-        option_value = '{0}{1}'.format(start_with_options, options[option_item])
-        dhcp_modify_statements( option_value, dhcpStatements, start_with_options )
+    return [IPAddress(address, network.version) for address in free]
+
+def dhcp_check_pool_ranges( ldap, subnet, values, service_dn, dn=None ):
+    # Check the ranges of a pool below a subnet entry: they must be in
+    # order, inside the subnet and clear of the other pools and fixed
+    # addresses of the subnet and of each other. dn is the pool itself when
+    # it exists already, whose current ranges are not in the way. Returns
+    # (message, size), where message is None when the ranges are valid and
+    # size is the number of addresses they hold.
+    network = dhcp_subnet_network(subnet)
+    scope = DHCPRange.network(network)
+    label = u'IP' if network.version == 4 else u'IPv6'
+
+    ranges = []
+    for value in values:
+        try:
+            range = DHCPRange.parse(value)
+        except (AddrFormatError, ValueError):
+            return (u'Invalid {0} range "{1}".'.format(label, value), 0)
+        if range.first > range.last:
+            return (u'First {0} must come before last {0}!'.format(label), 0)
+        for address in (range.first, range.last):
+            if range.version != scope.version or not scope.contains(address):
+                return (u'{0} is outside parent subnet {1}. Addresses in this pool must come from the range {2}-{3}.'.format(
+                    range.address(address), network.cidr, scope.address(scope.first), scope.address(scope.last)
+                ), 0)
+        ranges.append((range, value))
+
+    ranges.sort(key=lambda item: (item[0].first, item[0].last))
+    for ((range, value), (other, other_value)) in zip(ranges, ranges[1:]):
+        if range.overlaps(other):
+            return (u'Range "{0}" overlaps "{1}".'.format(value, other_value), 0)
+
+    index = DHCPIntervalTree(dhcp_address_intervals(ldap, network, service_dn))
+    for (range, value) in ranges:
+        for (other_first, other_last, (other_dn, other_value)) in index.overlapping(range.first, range.last):
+            if other_dn == dn:
+                continue
+            return (u'Range "{0}" overlaps "{1}" of {2}.'.format(value, other_value, other_dn), 0)
+
+    return (None, sum(range.size() for (range, value) in ranges))
+
+def dhcp_check_range_overlaps( ldap, dn, attr, values, service_dn ):
+    # The dhcp_check_pool_ranges() check of the add and mod callbacks of a
+    # pool, which refuse the ranges with a ValidationError on attr.
+    if not values:
+        return
+    subnet = ldap.get_entry(dn[1:], ['cn', 'dhcpnetmask'])
+    (message, size) = dhcp_check_pool_ranges(ldap, subnet, values, service_dn, dn)
+    if message is not None:
+        raise errors.ValidationError(name=attr, error=message)
+
+
+#######################################################################################################
+##                                address lookup
+#######################################################################################################
+
+def dhcp_effective_values( entries, attrs=('dhcpstatements', 'dhcpoption', 'dhcppermitlist') ):
+    # (attribute, keyword, value, dn) for every keyword in effect in entries,
+    # ordered from the outermost scope in, the way dhcpd lets an inner scope
+    # override the keywords of the scopes around it.
+    values = {}
+    for entry in entries:
+        for attr in attrs:
+            for (keyword, value) in dhcp_parse_attribute(attr, entry.get(attr, [])).items():
+                values[(attr, keyword)] = (value, entry.dn)
+    return [
+        (attr, keyword, value, dn)
+        for ((attr, keyword), (value, dn)) in sorted(values.items())
+    ]
+
+def dhcp_merge_scopes( entries ):
+    merged = {'dhcpstatements': [], 'dhcpoption': []}
+    for (attr, keyword, value, dn) in dhcp_effective_values(entries, tuple(merged)):
+        merged[attr].append(u' '.join(part for part in (keyword, value) if part))
+    return merged
+
+# Subnets hashed per prefix length on their network address, with their
+# pools sorted on their first address. A lookup masks the address with each
+# prefix length in use, longest first, and bisects the pools of the subnet
+# it finds, so its cost depends on the number of distinct prefix lengths and
+# not on the number of subnets.
+class DHCPAddressIndex(object):
+
+    def __init__(self, entries):
+        self.networks = {}
+        self.prefixes = {4: [], 6: []}
+        self.effective = {}
 
-def dhcp_modify_permit( options, option_item, dhcpPermitList, end_with_options ):
-    if option_item in options:
-        option_value = '{0}{1}'.format('allow' if options[option_item] else 'deny', end_with_options)
-        newPermitList = [p for p in dhcpPermitList if not p.endswith(end_with_options)]
-        newPermitList.append(option_value)
-        dhcpPermitList = newPermitList
-    return dhcpPermitList
+        subnets = {}
+        pools = []
+        shared = {}
+        for entry in entries:
+            classes = set(value.lower() for value in entry.get('objectclass', []))
+            if classes & set(['dhcpsubnet', 'dhcpsubnet6']):
+                subnets[entry.dn] = dict(entry=entry, network=dhcp_subnet_network(entry), pools=[], sharednetwork=None)
+            elif classes & set(['dhcppool', 'dhcppool6']):
+                pools.append(entry)
+            elif 'dhcpsharednetwork' in classes:
+                for value in entry.get('dhcpsubnetdn', []):
+                    shared[DN(value)] = entry
 
-def dhcp_modify_options_statements( option_value, statement_value, dhcpOptions, dhcpStatements, start_with_options, start_with_statements ):
+        for (dn, subnet) in subnets.items():
+            subnet['sharednetwork'] = shared.get(dn)
 
-    dhcp_modify_options( option_value, dhcpOptions, start_with_options )
-    dhcp_modify_statements( statement_value, dhcpStatements, start_with_statements )
+        for pool in pools:
+            subnet = subnets.get(pool.dn[1:])
+            if subnet is None:
+                continue
+            for value in pool.get('dhcprange', []) + pool.get('dhcprange6', []):
+                try:
+                    (first, last) = dhcp_parse_range(value)
+                except (AddrFormatError, ValueError):
+                    continue
+                subnet['pools'].append((first, last, pool, value))
+
+        # Every pool range of a version sorted on its first address, for
+        # callers that map many addresses straight to their pool.
+        self.ranges = {4: [], 6: []}
+        for subnet in subnets.values():
+            subnet['pools'].sort(key=lambda pool: pool[0])
+            subnet['firsts'] = [pool[0] for pool in subnet['pools']]
+            network = subnet['network']
+            self.networks.setdefault((network.version, network.prefixlen), {})[network.first] = subnet
+            self.ranges[network.version].extend(pool + (subnet,) for pool in subnet['pools'])
+
+        for (version, prefixlen) in self.networks:
+            self.prefixes[version].append(prefixlen)
+        for version in self.prefixes:
+            self.prefixes[version].sort(reverse=True)
+            self.ranges[version].sort(key=lambda pool: pool[0])
+
+    def lookup( self, address ):
+        # Return (subnet, pool, range) for an IPAddress, with pool and range
+        # None when the address is outside of every pool of its subnet, or
+        # None when no subnet holds it.
+        return self.lookup_value(address.version, address.value)
+
+    def lookup_value( self, version, value ):
+        bits = 32 if version == 4 else 128
+        for prefixlen in self.prefixes[version]:
+            shift = bits - prefixlen
+            subnet = self.networks[(version, prefixlen)].get(value >> shift << shift)
+            if subnet is None:
+                continue
+            i = bisect.bisect_right(subnet['firsts'], value) - 1
+            if i >= 0 and subnet['pools'][i][1] >= value:
+                (first, last, pool, range) = subnet['pools'][i]
+                return (subnet, pool, range)
+            return (subnet, None, None)
+        return None
+
+# Address indexes are kept per process, keyed by the principal of the
+# request and the dhcpService DN, so an index built under one bind is never
+# served to another. The lastusn of the root DSE, which the entry USN plugin
+# FreeIPA enables in 389 Directory Server raises on every add, modify,
+# rename and delete, tells whether the tree may have changed since an index
+# was built; checking it is one base search, and the subnets and pools are
+# only read again when it moved. Without the USN plugin an index only lives
+# for the request. Within a request an index is not checked again.
+dhcp_address_indexes = {}
+dhcp_address_indexes_size = 64
+
+dhcp_address_index_filter = (
+    u'(|(objectclass=dhcpsubnet)(objectclass=dhcpsubnet6)'
+    u'(objectclass=dhcppool)(objectclass=dhcppool6)(objectclass=dhcpsharednetwork))'
+)
+dhcp_address_index_attrs = [
+    'objectclass', 'cn', 'dhcpnetmask', 'dhcprange', 'dhcprange6', 'dhcpsubnetdn',
+    'dhcpstatements', 'dhcpoption', 'dhcppermitlist',
+]
+
+def dhcp_tree_stamp( ldap ):
+    # The lastusn values of the root DSE, one per backend unless the USN
+    # plugin counts globally, or None when the server keeps none.
+    try:
+        entry = ldap.get_entry(DN(), ['lastusn'])
+    except errors.NotFound:
+        return None
+    values = []
+    for attr in entry:
+        if attr.lower().partition(';')[0] == 'lastusn':
+            values.extend(u'{0}={1}'.format(attr.lower(), value) for value in entry[attr])
+    return tuple(sorted(values)) or None
+
+def dhcp_address_index( ldap, service_dn ):
+    cache = dhcp_request_cache('address_index')
+    index = cache.get(service_dn)
+    if index is not None:
+        return index
+
+    key = (getattr(context, 'principal', None), service_dn)
+    stamp = dhcp_tree_stamp(ldap)
+    cached = dhcp_address_indexes.get(key)
+    if stamp is not None and cached is not None and cached[1] == stamp:
+        index = cached[0]
+    else:
+        entries = dhcp_iter_entries(ldap, service_dn, ldap.SCOPE_SUBTREE, dhcp_address_index_filter, dhcp_address_index_attrs)
+        index = DHCPAddressIndex(list(entries))
+        if stamp is not None:
+            if len(dhcp_address_indexes) >= dhcp_address_indexes_size:
+                dhcp_address_indexes.clear()
+            dhcp_address_indexes[key] = (index, stamp)
+
+    cache[service_dn] = index
+    return index
+
+def dhcp_address_scope( ldap, service_dn, address ):
+    # Map an IPAddress to the subnet and pool that serve it and the options
+    # in effect there. The merged options are memoized in the index per pool
+    # and version of the dhcpService entry.
+    index = dhcp_address_index(ldap, service_dn)
+    found = index.lookup(address)
+    if found is None:
+        return None
+    (subnet, pool, range) = found
+
+    service = dhcp_service_entry(ldap, service_dn)
+    key = (subnet['entry'].dn, pool.dn if pool is not None else None, dhcp_service_stamp(service))
+    effective = index.effective.get(key)
+    if effective is None:
+        scopes = [service, subnet['sharednetwork'], subnet['entry'], pool]
+        effective = index.effective[key] = dhcp_merge_scopes([scope for scope in scopes if scope is not None])
+
+    result = dict(
+        address=unicode(address),
+        subnet=unicode(subnet['entry'].dn),
+        network=unicode(subnet['network'].cidr),
+        dhcpstatements=effective['dhcpstatements'],
+        dhcpoption=effective['dhcpoption'],
+    )
+    if subnet['sharednetwork'] is not None:
+        result['sharednetwork'] = unicode(subnet['sharednetwork'].dn)
+    if pool is not None:
+        result['pool'] = unicode(pool.dn)
+        result['range'] = unicode(range)
+        result['dhcppermitlist'] = list(pool.get('dhcppermitlist', []))
+    return result
+
+
+#######################################################################################################
+##                                leases
+#######################################################################################################
 
+# dhcpd.leases and dhcpd6.leases are journals: dhcpd appends a complete
+# lease or ia-na/ia-ta block every time a binding changes, so the last block
+# of an address is its current state. The files are read in large chunks
+# that are cut after the last complete top-level block, so the memory used
+# depends on the number of distinct addresses and not on the size of the
+# file. dhcpd writes every statement of a block on its own line with a fixed
+# indent, which lets the fields be found with plain string searches.
 
-def dhcp_remove_options( dhcpOptions, start_with_options ):
-    for i, s in enumerate(dhcpOptions):
-        if s.startswith(start_with_options):
-            dhcpOptions.pop(i)
+dhcp_lease_chunk_size = 4 * 1024 * 1024
+
+dhcp_lease_fields = ('binding state', 'ends', 'hardware ethernet', 'client-hostname', 'uid')
+
+dhcp_lease_iaaddr_re = re.compile(r'\n  iaaddr (\S+) \{(.*?)\n  \}', re.S)
+
+def dhcp_lease_block_fields( block, tokens ):
+    fields = {}
+    for (name, token, length) in tokens:
+        i = block.find(token)
+        if i >= 0:
+            i += length
+            fields[name] = block[i:block.find(';', i)]
+    return fields
+
+def dhcp_lease_tokens( indent, names ):
+    tokens = []
+    for name in names:
+        token = '\n' + indent + name + ' '
+        tokens.append((name, token, len(token)))
+    return tokens
+
+def dhcp_lease_chunks( stream, chunk_size=None ):
+    # Yield the text of a lease file in pieces that each end after a complete
+    # top-level block. A block dhcpd is still writing at the end of the file
+    # is left out, so the lengths of the pieces add up to the offset the next
+    # read has to start from.
+    if chunk_size is None:
+        chunk_size = dhcp_lease_chunk_size
+    rest = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if chunk:
+            buf = rest + chunk
+            cut = buf.rfind('\n}\n') + 3
+            if cut < 3:
+                rest = buf
+                continue
+            (buf, rest) = (buf[:cut], buf[cut:])
+        elif rest.rstrip().endswith('\n}'):
+            (buf, rest) = (rest, '')
+        else:
             break
+        yield buf
+        if not chunk:
+            break
+
+def dhcp_chunk_leases( buf, names ):
+    # Yield (address, fields) for every lease of a piece of a lease file,
+    # where fields maps those of names the lease has to their raw values.
+    # The addresses of an ia-na or ia-ta block get the identity association
+    # as 'ia'.
+    lease_tokens = dhcp_lease_tokens('  ', names)
+    iaaddr_tokens = dhcp_lease_tokens('    ', names)
+    for block in buf.split('\n}\n'):
+        brace = block.find(' {\n')
+        if brace < 0:
+            continue
+        (kind, sep, key) = block[block.rfind('\n', 0, brace) + 1:brace].partition(' ')
+        if kind == 'lease':
+            yield (key, dhcp_lease_block_fields(block, lease_tokens))
+        elif kind == 'ia-na' or kind == 'ia-ta':
+            for (address, body) in dhcp_lease_iaaddr_re.findall(block):
+                fields = dhcp_lease_block_fields(body, iaaddr_tokens)
+                fields['ia'] = key
+                yield (address, fields)
+
+def dhcp_iter_leases( stream, names=dhcp_lease_fields, chunk_size=None ):
+    # Yield (address, fields) for every lease of a lease file in file order.
+    for buf in dhcp_lease_chunks(stream, chunk_size):
+        for lease in dhcp_chunk_leases(buf, names):
+            yield lease
+
+def dhcp_lease_value( address ):
+    # The integer value of an IPv4 or IPv6 address string, without going
+    # through netaddr.
+    if ':' in address:
+        return (6, int(binascii.hexlify(socket.inet_pton(socket.AF_INET6, address)), 16))
+    return (4, struct.unpack('!I', socket.inet_aton(address))[0])
+
+# Leases in parallel lists, one slot per address, with hash indexes from
+# the address, the hardware address and the client host name to the slot.
+# The binding states and end times repeat a lot and are interned. A hardware
+# address or host name points at the slot of its latest lease; when an
+# address is leased to another client its old index entries are dropped.
+class DHCPLeaseStore(object):
+
+    def __init__( self ):
+        self.addresses = []
+        self.states = []
+        self.ends = []
+        self.macs = []
+        self.hostnames = []
+        self.by_address = {}
+        self.by_mac = {}
+        self.by_hostname = {}
+        self.interned = {}
+
+    def __len__( self ):
+        return len(self.addresses)
+
+    def intern( self, value ):
+        return self.interned.setdefault(value, value)
+
+    def add( self, address, state, ends, mac, hostname ):
+        slot = self.by_address.get(address)
+        if slot is None:
+            slot = self.by_address[address] = len(self.addresses)
+            self.addresses.append(address)
+            self.states.append(None)
+            self.ends.append(None)
+            self.macs.append(None)
+            self.hostnames.append(None)
+        else:
+            previous = self.macs[slot]
+            if previous is not None and self.by_mac.get(previous) == slot:
+                del self.by_mac[previous]
+            previous = self.hostnames[slot]
+            if previous is not None and self.by_hostname.get(previous.lower()) == slot:
+                del self.by_hostname[previous.lower()]
+
+        self.states[slot] = self.intern(state)
+        self.ends[slot] = self.intern(ends)
+        self.macs[slot] = mac
+        self.hostnames[slot] = hostname
+        if mac is not None:
+            self.by_mac[mac] = slot
+        if hostname is not None:
+            self.by_hostname[hostname.lower()] = slot
+
+    def find( self, address=None, mac=None, hostname=None ):
+        # The slots that match every given key.
+        slots = None
+        for (key, index) in ((address, self.by_address), (mac, self.by_mac), (hostname, self.by_hostname)):
+            if key is None:
+                continue
+            slot = index.get(key)
+            if slot is None or (slots is not None and slot not in slots):
+                return []
+            slots = [slot]
+        if slots is None:
+            return xrange(len(self.addresses))
+        return slots
+
+    def lease( self, slot ):
+        # A lease as returned by the lease commands.
+        result = dict(
+            address=unicode(self.addresses[slot]),
+            state=unicode(self.states[slot]),
+            ends=unicode(self.ends[slot]),
+        )
+        if self.macs[slot] is not None:
+            result['macaddress'] = unicode(self.macs[slot].upper())
+        if self.hostnames[slot] is not None:
+            result['hostname'] = self.hostnames[slot].decode('utf-8', 'replace')
+        return result
+
+def dhcp_lease_key( kind, value ):
+    # Normalize a lookup key the way DHCPLeaseStore indexes it.
+    if kind == 'mac':
+        mac = dhcp_normalize_macaddress(value)
+        if len(mac) != 17:
+            raise ValueError(value)
+        return str(mac.lower())
+    if kind == 'hostname':
+        return value.encode('utf-8').lower()
+    return str(IPAddress(value))
+
+# Per-process followers of the lease files of this server, keyed by DHCP
+# version. Only the files in dhcp_lease_files are ever followed, so there
+# are at most two of them.
+dhcp_lease_ingesters = {}
+dhcp_lease_ingesters_lock = threading.Lock()
+
+dhcp_lease_files = {
+    4: u'/var/lib/dhcpd/dhcpd.leases',
+    6: u'/var/lib/dhcpd/dhcpd6.leases',
+}
+
+# Follows a lease file the way tail -F does. The inode of the file and the
+# offset after its last complete block are remembered, and a refresh only
+# parses what dhcpd appended since into the lease store. dhcpd rewrites the
+# file from time to time by renaming dhcpd.leases.new over it, which shows
+# up as a new inode (or as a file shorter than the offset); the ingester
+# then starts over. Readers that iterate over the store must hold lock.
+class DHCPLeaseIngester(object):
+
+    def __init__( self, path ):
+        self.path = path
+        self.lock = threading.Lock()
+        self.reset(None)
+
+    def reset( self, inode ):
+        self.inode = inode
+        self.offset = 0
+        self.store = DHCPLeaseStore()
+
+    def refresh( self ):
+        with self.lock:
+            with open(self.path, 'rb') as stream:
+                stat = os.fstat(stream.fileno())
+                if stat.st_ino != self.inode or stat.st_size < self.offset:
+                    self.reset(stat.st_ino)
+                if stat.st_size == self.offset:
+                    return
+                stream.seek(self.offset)
+                add = self.store.add
+                for buf in dhcp_lease_chunks(stream):
+                    for (address, fields) in dhcp_chunk_leases(buf, dhcp_lease_fields):
+                        hostname = fields.get('client-hostname')
+                        if hostname is not None:
+                            hostname = hostname.strip('"')
+                        add(
+                            address,
+                            fields.get('binding state', 'free'),
+                            fields.get('ends', 'never'),
+                            fields.get('hardware ethernet'),
+                            hostname
+                        )
+                    self.offset += len(buf)
+
+def dhcp_lease_ingester( version ):
+    # The refreshed ingester of the lease file dhcpd keeps for version on
+    # this server. Why the file cannot be read is logged rather than told
+    # to the caller.
+    path = dhcp_lease_files[version]
+    with dhcp_lease_ingesters_lock:
+        ingester = dhcp_lease_ingesters.get(version)
+        if ingester is None or ingester.path != path:
+            ingester = dhcp_lease_ingesters[version] = DHCPLeaseIngester(path)
+    try:
+        ingester.refresh()
+    except (IOError, OSError) as e:
+        dhcp_logger.warning('cannot read %s: %s', path, e.strerror)
+        raise errors.NotFound(reason=_('no DHCP lease file can be read on this server'))
+    return ingester
+
+# Leases of servers that keep them in LDAP, as dhcpLeases entries below a
+# dhcpService. They are looked up under the bind of the request with an
+# equality filter on the keys asked for: cn is the leased address and
+# dhcpHWAddress and dhcpAssignedHostName are indexed, so a lookup only reads
+# the matching entries and a deleted lease is never returned. The entries
+# found go into a DHCPLeaseStore, which is queried like the lease file one.
+dhcp_ldap_lease_attrs = [
+    'cn', 'dhcpaddressstate', 'dhcpexpirationtime', 'dhcphwaddress', 'dhcpassignedhostname',
+]
+
+def dhcp_lease_time( value ):
+    # A dhcpExpirationTime in the "<weekday> YYYY/MM/DD HH:MM:SS" form of
+    # dhcpd.leases.
+    if not hasattr(value, 'strftime'):
+        value = datetime.datetime.strptime(value[:14], '%Y%m%d%H%M%S')
+    return value.strftime('%w %Y/%m/%d %H:%M:%S')
+
+def dhcp_ldap_lease_term( ldap, kind, key ):
+    # The filter on one key made by dhcp_lease_key().
+    if kind == 'address':
+        return ldap.make_filter_from_attr('cn', unicode(key))
+    if kind == 'mac':
+        return ldap.make_filter_from_attr('dhcphwaddress', u'ethernet {0}'.format(key))
+    return ldap.make_filter_from_attr('dhcpassignedhostname', key.decode('utf-8'))
+
+def dhcp_ldap_lease_filter( ldap, keys, criteria=() ):
+    # keys maps kinds to keys that must all match; one of the (kind, key)
+    # pairs of criteria must match as well.
+    filters = [u'(objectclass=dhcpleases)']
+    filters.extend(dhcp_ldap_lease_term(ldap, kind, key) for (kind, key) in sorted(keys.items()))
+    if criteria:
+        filters.append(ldap.combine_filters(
+            [dhcp_ldap_lease_term(ldap, kind, key) for (kind, key) in criteria],
+            ldap.MATCH_ANY
+        ))
+    return ldap.combine_filters(filters, ldap.MATCH_ALL)
+
+def dhcp_ldap_lease_store( ldap, service_dn, filter, sizelimit=0 ):
+    # Return (store, truncated) with the leases the filter matches. Values
+    # the bind cannot read are left out: a lease without a readable address
+    # is skipped, one without a readable state has state unknown.
+    store = DHCPLeaseStore()
+    try:
+        (entries, truncated) = ldap.find_entries(
+            filter=filter,
+            attrs_list=dhcp_ldap_lease_attrs,
+            base_dn=service_dn,
+            scope=ldap.SCOPE_SUBTREE,
+            size_limit=sizelimit
+        )
+    except errors.NotFound:
+        return (store, False)
+
+    for entry in entries:
+        address = entry.get('cn', [None])[0]
+        if address is None:
+            continue
+        ends = u'never'
+        expiration = entry.get('dhcpexpirationtime', [None])[0]
+        if expiration is not None:
+            ends = dhcp_lease_time(expiration)
+        mac = entry.get('dhcphwaddress', [None])[0]
+        if mac is not None:
+            mac = str(mac.split()[-1].lower())
+        hostname = entry.get('dhcpassignedhostname', [None])[0]
+        if hostname is not None:
+            hostname = hostname.encode('utf-8')
+        store.add(
+            str(address),
+            str(entry.get('dhcpaddressstate', [u'unknown'])[0].lower()),
+            str(ends),
+            mac,
+            hostname
+        )
+    return (store, truncated)
+
+def dhcp_lease_expired( ends, now ):
+    # ends is "never", "<weekday> YYYY/MM/DD HH:MM:SS" in UTC or, with
+    # db-time-format local, "epoch <seconds>". now is time.time().
+    if ends == 'never':
+        return False
+    if ends.startswith('epoch '):
+        return int(ends.split()[1]) < now
+    return ends[2:] < time.strftime('%Y/%m/%d %H:%M:%S', time.gmtime(now))
+
+def dhcp_pool_utilization( index, version, store, now=None ):
+    # Count the used, expired and abandoned addresses of every pool of an
+    # address index from the leases of a DHCPLeaseStore. Addresses whose
+    # last binding is free or backup, or that are not in any pool, are not
+    # counted. Returns {pool DN: row}.
+    if now is None:
+        now = time.time()
+
+    ranges = index.ranges[version]
+    firsts = [pool[0] for pool in ranges]
+    rows = {}
+    for (first, last, pool, range, subnet) in ranges:
+        row = rows.get(pool.dn)
+        if row is None:
+            row = rows[pool.dn] = dict(
+                pool=pool, subnet=subnet, ranges=[], size=0, used=0, expired=0, abandoned=0
+            )
+        row['ranges'].append(range)
+        row['size'] += last - first + 1
+
+    expired_now = {}
+    for (address, state, ends) in zip(store.addresses, store.states, store.ends):
+        if state in ('free', 'backup'):
+            continue
+        try:
+            (address_version, value) = dhcp_lease_value(address)
+        except (socket.error, ValueError):
+            continue
+        if address_version != version:
+            continue
+        i = bisect.bisect_right(firsts, value) - 1
+        if i < 0 or ranges[i][1] < value:
+            continue
+
+        row = rows[ranges[i][2].dn]
+        if state == 'active':
+            expired = expired_now.get(ends)
+            if expired is None:
+                expired = expired_now[ends] = dhcp_lease_expired(ends, now)
+            row['expired' if expired else 'used'] += 1
+        elif state == 'abandoned':
+            row['abandoned'] += 1
+        else:
+            # expired, released and reset bindings wait for dhcpd to free
+            # them.
+            row['expired'] += 1
+
+    for row in rows.values():
+        row['free'] = row['size'] - row['used'] - row['expired'] - row['abandoned']
+    return rows
+
+
+#######################################################################################################
+##                                effective options
+#######################################################################################################
+
+dhcp_effective_attrs = [
+    'objectclass', 'dhcpstatements', 'dhcpoption', 'dhcppermitlist',
+]
+
+def dhcp_effective_scopes( ldap, service_dn, entry ):
+    # Return the entries whose options apply to entry, outermost first: the
+    # dhcpService, the shared network and subnet, the groups and pools
+    # between the service and entry, and entry itself. Apart from the
+    # dhcpService, which comes from its cache, they are read with a single
+    # search. A host that is not stored below a subnet gets the subnet that
+    # holds its fixed address.
+    ancestors = [entry.dn[i:] for i in range(1, len(entry.dn) - len(service_dn))]
+
+    subnets = []
+    classes = set(value.lower() for value in entry.get('objectclass', []))
+    if classes & set(['dhcpsubnet', 'dhcpsubnet6']):
+        subnets.append(entry.dn)
+    elif ancestors:
+        subnets.append(ancestors[-1])
+    if 'dhcphost' in classes:
+        statements = dhcp_parse_attribute('dhcpstatements', entry.get('dhcpstatements', []))
+        for keyword in ('fixed-address', 'fixed-address6'):
+            if keyword not in statements:
+                continue
+            try:
+                address = IPAddress(statements[keyword].split(',')[0].strip())
+            except (AddrFormatError, ValueError):
+                continue
+            found = dhcp_address_index(ldap, service_dn).lookup(address)
+            if found is not None:
+                subnets.append(found[0]['entry'].dn)
+
+    filters = [ldap.make_filter_from_attr('entrydn', unicode(dn)) for dn in ancestors + subnets]
+    filters.extend(
+        ldap.combine_filters([
+            ldap.make_filter_from_attr('objectclass', 'dhcpsharednetwork'),
+            ldap.make_filter_from_attr('dhcpsubnetdn', unicode(dn)),
+        ], ldap.MATCH_ALL)
+        for dn in subnets
+    )
+
+    entries = []
+    if filters:
+        try:
+            entries = ldap.get_entries(
+                service_dn,
+                ldap.SCOPE_SUBTREE,
+                ldap.combine_filters(filters, ldap.MATCH_ANY),
+                dhcp_effective_attrs + ['dhcpsubnetdn']
+            )
+        except errors.NotFound:
+            pass
+    found = dict((e.dn, e) for e in entries)
+
+    def is_subnet(e):
+        return set(value.lower() for value in e.get('objectclass', [])) & set(['dhcpsubnet', 'dhcpsubnet6'])
+
+    chain = [found[dn] for dn in reversed(ancestors) if dn in found]
+    if not any(is_subnet(e) for e in chain) and not is_subnet(entry):
+        # The subnet of the fixed address goes around the groups of the host.
+        chain[:0] = [found[dn] for dn in subnets[-1:] if dn in found and is_subnet(found[dn])]
+
+    subnet_dns = set(e.dn for e in chain + [entry] if is_subnet(e))
+    shared = [
+        e for e in entries
+        if 'dhcpsharednetwork' in set(value.lower() for value in e.get('objectclass', []))
+        and subnet_dns & set(DN(value) for value in e.get('dhcpsubnetdn', []))
+    ]
+
+    return [dhcp_service_entry(ldap, service_dn)] + shared[:1] + chain + [entry]
+
+def dhcp_effective( ldap, service_dn, entry ):
+    # Return (scopes, values) for entry, see dhcp_effective_scopes() and
+    # dhcp_effective_values().
+    scopes = dhcp_effective_scopes(ldap, service_dn, entry)
+    return (scopes, dhcp_effective_values(scopes))
+
+def dhcp_effective_result( ldap, service_dn, entry ):
+    # The output of the *_effective commands.
+    (scopes, values) = dhcp_effective(ldap, service_dn, entry)
+    result = [
+        dict(attribute=attr, keyword=keyword, value=value, scope=unicode(dn))
+        for (attr, keyword, value, dn) in values
+    ]
+    return dict(
+        result=result,
+        count=len(result),
+        scopes=[unicode(scope.dn) for scope in scopes]
+    )
+
+
+#######################################################################################################
+##                                dhcpd.conf export
+#######################################################################################################
+
+def dhcp_iter_entries( ldap, base_dn, scope, filter, attrs_list ):
+    # Yield the entries of a search that may be larger than the size limit
+    # the server applies to a single request. ldap2 pages through it with
+    # the simple paged results control and returns all the pages at once.
+    try:
+        (entries, truncated) = ldap.find_entries(
+            filter=filter,
+            attrs_list=attrs_list,
+            base_dn=base_dn,
+            scope=scope,
+            time_limit=0,
+            size_limit=0,
+            paged_search=True
+        )
+    except errors.NotFound:
+        return
+    for entry in entries:
+        yield entry
+
+dhcp_export_attrs = [
+    'objectclass', 'cn', 'dhcpnetmask', 'dhcprange', 'dhcprange6',
+    'dhcppermitlist', 'dhcphwaddress', 'dhcpstatements', 'dhcpoption',
+    'dhcpsubnetdn',
+]
+
+dhcp_export_peer_attrs = [
+    'cn', 'dhcpfailoverprimaryserver', 'dhcpfailoversecondaryserver',
+    'dhcpfailoverprimaryport', 'dhcpfailoversecondaryport',
+    'dhcpfailoverresponsedelay', 'dhcpfailoverunackedupdates',
+    'dhcpmaxclientleadtime', 'dhcpfailoversplit', 'dhcphashbucketassignment',
+    'dhcpfailoverloadbalancetime',
+]
+
+# Object classes that are rendered, and the order in which they are rendered
+# below the dhcpService entry. Classes must be declared before the pools that
+# refer to them.
+dhcp_export_classes = ['dhcpclass', 'dhcpsharednetwork', 'dhcpsubnet', 'dhcpsubnet6', 'dhcpgroup', 'dhcphost']
+
+# Object classes whose children are rendered inside their block.
+dhcp_export_containers = set(['dhcpclass', 'dhcpsharednetwork', 'dhcpsubnet', 'dhcpsubnet6', 'dhcpgroup'])
+
+dhcp_export_children_filter = (
+    u'(|(objectclass=dhcpsubnet)(objectclass=dhcpsubnet6)(objectclass=dhcppool)'
+    u'(objectclass=dhcppool6)(objectclass=dhcpgroup)(objectclass=dhcphost))'
+)
+
+def dhcp_export_body( entry, pad ):
+    for value in entry.get('dhcprange', []):
+        yield u'{0}range {1};\n'.format(pad, value)
+    for value in entry.get('dhcprange6', []):
+        yield u'{0}range6 {1};\n'.format(pad, value)
+    for value in entry.get('dhcphwaddress', []):
+        yield u'{0}hardware {1};\n'.format(pad, value)
+    for value in entry.get('dhcppermitlist', []):
+        yield u'{0}{1};\n'.format(pad, value)
+    for value in entry.get('dhcpstatements', []):
+        yield u'{0}{1};\n'.format(pad, value)
+    for value in entry.get('dhcpoption', []):
+        yield u'{0}option {1};\n'.format(pad, value)
+
+def dhcp_export_header( entry ):
+    classes = set(value.lower() for value in entry.get('objectclass', []))
+    cn = entry['cn'][0]
+    if 'dhcpsubnet' in classes:
+        network = IPNetwork(u'{0}/{1}'.format(cn, entry['dhcpnetmask'][0]))
+        return u'subnet {0} netmask {1}'.format(network.network, network.netmask)
+    if 'dhcpsubnet6' in classes:
+        return u'subnet6 {0}'.format(IPNetwork(cn).cidr)
+    if 'dhcppool' in classes:
+        return u'pool'
+    if 'dhcppool6' in classes:
+        return u'pool6'
+    if 'dhcpgroup' in classes:
+        return u'group'
+    if 'dhcphost' in classes:
+        return u'host {0}'.format(cn)
+    if 'dhcpsharednetwork' in classes:
+        return u'shared-network "{0}"'.format(cn)
+    if 'dhcpclass' in classes:
+        return u'class "{0}"'.format(cn)
+    return None
+
+def dhcp_export_entry( ldap, entry, depth ):
+    header = dhcp_export_header(entry)
+    if header is None:
+        return
+    pad = u'    ' * depth
+
+    yield u'{0}{1} {{\n'.format(pad, header)
+    for line in dhcp_export_body(entry, pad + u'    '):
+        yield line
+
+    classes = set(value.lower() for value in entry.get('objectclass', []))
+    if 'dhcpsharednetwork' in classes:
+        # Subnets are linked to their shared network by dhcpSubnetDN rather
+        # than being stored below it.
+        for subnet_dn in entry.get('dhcpsubnetdn', []):
+            try:
+                subnet = ldap.get_entry(DN(subnet_dn), dhcp_export_attrs)
+            except errors.NotFound:
+                continue
+            for line in dhcp_export_entry(ldap, subnet, depth + 1):
+                yield line
+
+    if classes & dhcp_export_containers:
+        for child in dhcp_iter_entries(ldap, entry.dn, ldap.SCOPE_ONELEVEL, dhcp_export_children_filter, dhcp_export_attrs):
+            for line in dhcp_export_entry(ldap, child, depth + 1):
+                yield line
+
+    yield u'{0}}}\n'.format(pad)
+
+def dhcp_export_peer( peer, server=None ):
+    # A failover peer is rendered from the point of view of one server: the
+    # secondary if server names it, the primary otherwise. A peer whose
+    # servers the bind cannot read is left out; a port it cannot read is
+    # left to the default of dhcpd.
+    name = peer.get('cn', [None])[0]
+    primary = peer.get('dhcpfailoverprimaryserver', [None])[0]
+    secondary = peer.get('dhcpfailoversecondaryserver', [None])[0]
+    if name is None or primary is None or secondary is None:
+        return
+    primary_port = peer.get('dhcpfailoverprimaryport', [None])[0]
+    secondary_port = peer.get('dhcpfailoversecondaryport', [None])[0]
+    is_primary = not (server and server.lower() == secondary.lower())
+
+    if is_primary:
+        (role, address, port, peer_address, peer_port) = (u'primary', primary, primary_port, secondary, secondary_port)
+    else:
+        (role, address, port, peer_address, peer_port) = (u'secondary', secondary, secondary_port, primary, primary_port)
+
+    yield u'failover peer "{0}" {{\n'.format(name)
+    yield u'    {0};\n'.format(role)
+    yield u'    address {0};\n'.format(address)
+    if port is not None:
+        yield u'    port {0};\n'.format(port)
+    yield u'    peer address {0};\n'.format(peer_address)
+    if peer_port is not None:
+        yield u'    peer port {0};\n'.format(peer_port)
+
+    for (attr, keyword) in (
+        ('dhcpfailoverresponsedelay', u'max-response-delay'),
+        ('dhcpfailoverunackedupdates', u'max-unacked-updates'),
+        ('dhcpfailoverloadbalancetime', u'load balance max seconds'),
+    ):
+        if attr in peer:
+            yield u'    {0} {1};\n'.format(keyword, peer[attr][0])
+
+    if is_primary:
+        if 'dhcpmaxclientleadtime' in peer:
+            yield u'    mclt {0};\n'.format(peer['dhcpmaxclientleadtime'][0])
+        if 'dhcpfailoversplit' in peer:
+            yield u'    split {0};\n'.format(peer['dhcpfailoversplit'][0])
+        elif 'dhcphashbucketassignment' in peer:
+            try:
+                hba = dhcp_hba_parse(peer['dhcphashbucketassignment'][0])
+            except (TypeError, ValueError):
+                raise errors.ValidationError(
+                    name='dhcphashbucketassignment',
+                    error=_('stored value of %(peer)s is neither 32 bytes nor 64 hex digits') % dict(peer=peer.dn)
+                )
+            yield u'    hba {0};\n'.format(dhcp_hba_format(hba))
+
+    yield u'}\n'
+
+def dhcp_export_config( ldap, service_dn, dhcp_version, server=None ):
+    # Render the complete configuration below a dhcpService entry as a
+    # dhcpd.conf. This is a generator that walks the tree with one paged
+    # one-level search per container, so only the result sets of the
+    # containers being rendered are held. The export commands join the
+    # lines into a single result, which grows with the tree.
+    service = ldap.get_entry(service_dn, dhcp_export_attrs)
+
+    yield u'# dhcpd.conf generated from {0}\n'.format(service_dn)
+    yield u'# {0}\n\n'.format(time.strftime('%Y-%m-%d %H:%M:%S %Z'))
+
+    for line in dhcp_export_body(service, u''):
+        yield line
+
+    # ISC dhcpd only supports failover for IPv4.
+    if dhcp_version == 4:
+        for peer in dhcp_iter_entries(ldap, service_dn, ldap.SCOPE_ONELEVEL, u'(objectclass=dhcpfailoverpeer)', dhcp_export_peer_attrs):
+            yield u'\n'
+            for line in dhcp_export_peer(peer, server):
+                yield line
+
+    # Subnets that belong to a shared network are rendered inside it.
+    shared = set()
+    for network in dhcp_iter_entries(ldap, service_dn, ldap.SCOPE_ONELEVEL, u'(objectclass=dhcpsharednetwork)', ['dhcpsubnetdn']):
+        shared.update(DN(value) for value in network.get('dhcpsubnetdn', []))
+
+    for objectclass in dhcp_export_classes:
+        filter = u'(objectclass={0})'.format(objectclass)
+        for entry in dhcp_iter_entries(ldap, service_dn, ldap.SCOPE_ONELEVEL, filter, dhcp_export_attrs):
+            if entry.dn in shared:
+                continue
+            yield u'\n'
+            for line in dhcp_export_entry(ldap, entry, 0):
+                yield line
+
+
+#######################################################################################################
+##                                paged *_find
+#######################################################################################################
+
+# Keyset paging for the *_find commands of containers that grow large. A
+# page is the first pagesize primary keys after the cursor, in the order of
+# the server side sort control; the cursor handed back for the next page is
+# the last key of a full page.
+
+dhcp_find_page_size = 100
+
+def dhcp_find_paged( options ):
+    return options.get('cursor') is not None or options.get('pagesize') is not None
+
+def dhcp_sorted_search( ldap, base_dn, scope, filter, attrs_list, key, size ):
+    # Return (entries, truncated) for the first size entries of a search,
+    # which the server sorts on key before it applies the size limit, so
+    # only those entries are read. ldap2.find_entries() cannot pass a sort
+    # control, so the search goes through the python-ldap connection of the
+    # backend. An entry is a (dn, attrs) pair with attribute names in lower
+    # case and values decoded.
+    entries = []
+    truncated = False
+    with ldap.error_handler():
+        msgid = ldap.conn.search_ext(
+            str(base_dn), scope, filter.encode('utf-8'), attrs_list,
+            serverctrls=[SSSRequestControl(ordering_rules=[key])],
+            sizelimit=size
+        )
+        try:
+            while True:
+                (rtype, rdata, rmsgid, rctrls) = ldap.conn.result3(msgid, 0)
+                if rtype != RES_SEARCH_ENTRY:
+                    break
+                for (dn, attrs) in rdata:
+                    entries.append((DN(dn.decode('utf-8')), dict(
+                        (attr.lower(), [value.decode('utf-8') for value in values])
+                        for (attr, values) in attrs.items()
+                    )))
+        except SIZELIMIT_EXCEEDED:
+            truncated = True
+
+    dhcp_stats_record('sorted_search', [attrs for (dn, attrs) in entries])
+    return (entries, truncated)
+
+def dhcp_find_page_keys( ldap, base_dn, scope, filter, key, cursor, size ):
+    # Return the keys of the page after cursor. The server sorts the entries
+    # after the cursor on the key and stops after size of them, so a page
+    # costs the same however many entries follow it. Only the key attribute
+    # is read.
+    if cursor:
+        value = escape_filter_chars(cursor)
+        filter = ldap.combine_filters(
+            [filter, u'({0}>={1})'.format(key, value), u'(!({0}={1}))'.format(key, value)],
+            rules=ldap.MATCH_ALL
+        )
+
+    (entries, truncated) = dhcp_sorted_search(ldap, base_dn, scope, filter, [key], key, size)
+    return [attrs[key][0] for (dn, attrs) in entries if attrs.get(key)]
+
+def dhcp_find_page_filter( ldap, filter, base_dn, scope, options, key='cn' ):
+    # Narrow the filter of a *_find pre_callback to the page the cursor and
+    # pagesize options ask for. Without either the filter is left alone.
+    if not dhcp_find_paged(options):
+        return filter
+
+    keys = dhcp_find_page_keys(
+        ldap, base_dn, scope, filter, key,
+        options.get('cursor'), options.get('pagesize') or dhcp_find_page_size
+    )
+    if not keys:
+        return u'(!(objectclass=*))'
+    return ldap.combine_filters(
+        [filter, ldap.make_filter_from_attr(key, keys, rules=ldap.MATCH_ANY)],
+        rules=ldap.MATCH_ALL
+    )
+
+def dhcp_find_page_cursor( entries, options, key='cn' ):
+    # The cursor of the page that follows the entries of a *_find result,
+    # which come sorted on their primary key. None after a page that is not
+    # full; a full last page is followed by an empty one.
+    if not dhcp_find_paged(options):
+        return None
+    if not entries or len(entries) < (options.get('pagesize') or dhcp_find_page_size):
+        return None
+    return entries[-1][key][0]
+
+
+#######################################################################################################
+##                                change feed
+#######################################################################################################
+
+dhcp_change_attrs = ['objectclass', 'createtimestamp', 'modifytimestamp', 'entrycsn']
+
+def dhcp_parse_change_cursor( cursor ):
+    # A change cursor is the modifyTimestamp and entryCSN of the last change
+    # a caller has seen, "YYYYMMDDHHMMSSZ#entrycsn". Changes are ordered on
+    # that pair and a cursor excludes itself. A bare timestamp has no CSN
+    # and lists every change made in or after that second.
+    (timestamp, sep, csn) = cursor.partition(u'#')
+    return (timestamp, csn.lower())
+
+def dhcp_format_change_cursor( timestamp, csn ):
+    if not csn:
+        return timestamp
+    return u'{0}#{1}'.format(timestamp, csn)
+
+def dhcp_change_entries( ldap, base_dn, filter, attrs_list, timestamp, sizelimit ):
+    # Return (entries, bound) for the entries matching filter that were
+    # modified in or after the second timestamp, complete up to and
+    # including the second bound, or complete when bound is None. The
+    # server sorts the entries after that second on modifyTimestamp and
+    # stops after sizelimit of them, maybe in the middle of a second, so
+    # the last second is read again in full and becomes the bound. The
+    # second of timestamp is read in full as well, since a cursor points
+    # into it. The modifyTimestamp index serves all three searches.
+    def second( stamp ):
+        return ldap.combine_filters(
+            [filter, u'(modifytimestamp={0})'.format(stamp)], rules=ldap.MATCH_ALL
+        )
+
+    scope = ldap.SCOPE_SUBTREE
+    (entries, truncated) = dhcp_sorted_search(
+        ldap, base_dn, scope, second(timestamp), attrs_list, 'modifytimestamp', 0
+    )
+    later = ldap.combine_filters(
+        [filter, u'(modifytimestamp>={0})'.format(timestamp), u'(!(modifytimestamp={0}))'.format(timestamp)],
+        rules=ldap.MATCH_ALL
+    )
+    (rest, truncated) = dhcp_sorted_search(
+        ldap, base_dn, scope, later, attrs_list, 'modifytimestamp', sizelimit
+    )
+
+    bound = None
+    if truncated and rest:
+        bound = rest[-1][1]['modifytimestamp'][0]
+        rest = [(dn, attrs) for (dn, attrs) in rest if attrs['modifytimestamp'][0] != bound]
+        rest.extend(dhcp_sorted_search(
+            ldap, base_dn, scope, second(bound), attrs_list, 'modifytimestamp', 0
+        )[0])
+    return (entries + rest, bound)
+
+# Deleted entries are only found through the tombstones the replication
+# plugin keeps until they are purged, and 389 Directory Server shows
+# tombstones to Directory Manager only. Any other bind gets a feed without
+# deletes and has to find them by listing the tree again.
+dhcp_directory_manager_dn = DN(('cn', 'directory manager'))
+
+def dhcp_tombstones_visible( ldap ):
+    # Whether the bind of ldap is Directory Manager, as the LDAPI autobind
+    # of root is. IPA users and hosts never are.
+    with ldap.error_handler():
+        authzid = ldap.conn.whoami_s()
+    if not authzid or not authzid.startswith('dn:'):
+        return False
+    try:
+        return DN(authzid[3:].strip()) == dhcp_directory_manager_dn
+    except ValueError:
+        return False
+
+def dhcp_changes( ldap, base_dn, cursor, sizelimit=0, deletes=False ):
+    # Return (changes, cursor, truncated) for the entries below base_dn that
+    # were created or modified after cursor, and with deletes the ones that
+    # were deleted. Each change is a tuple (change, dn, modifytimestamp,
+    # entrycsn, objectclasses), in cursor order. With a sizelimit only that
+    # many changes are returned and the server reads little more than
+    # that; the cursor of the last one continues the listing.
+    position = dhcp_parse_change_cursor(cursor)
+    (timestamp, csn) = position
+
+    changes = []
+    bounds = []
+    (entries, bound) = dhcp_change_entries(
+        ldap, base_dn, u'(objectclass=*)', dhcp_change_attrs, timestamp, sizelimit
+    )
+    bounds.append(bound)
+    for (dn, entry) in entries:
+        modified = entry['modifytimestamp'][0]
+        created = entry.get('createtimestamp', [modified])[0]
+        change = u'add' if created >= timestamp else u'modify'
+        changes.append((change, dn, modified, entry.get('entrycsn', [None])[0], entry.get('objectclass', [])))
+
+    if deletes:
+        (entries, bound) = dhcp_change_entries(
+            ldap, base_dn, u'(objectclass=nstombstone)', dhcp_change_attrs + ['nscpentrydn'],
+            timestamp, sizelimit
+        )
+        bounds.append(bound)
+        for (dn, entry) in entries:
+            if 'nscpentrydn' not in entry:
+                continue
+            objectclasses = [value for value in entry.get('objectclass', []) if value.lower() != 'nstombstone']
+            changes.append((
+                u'delete',
+                DN(entry['nscpentrydn'][0]),
+                entry['modifytimestamp'][0],
+                entry.get('entrycsn', [None])[0],
+                objectclasses
+            ))
+
+    def key( change ):
+        return (change[2], unicode(change[3] or u'').lower())
+
+    # A change past the bound of one search may come after changes the
+    # search stopped before, so it waits for the next call.
+    bounds = [bound for bound in bounds if bound is not None]
+    changes = [
+        change for change in changes
+        if key(change) > position and (not bounds or change[2] <= min(bounds))
+    ]
+    changes.sort(key=key)
+
+    truncated = bool(bounds) or (bool(sizelimit) and len(changes) > sizelimit)
+    if sizelimit:
+        changes = changes[:sizelimit]
+    if changes:
+        cursor = dhcp_format_change_cursor(*key(changes[-1]))
+    return (changes, cursor, truncated)
+
+
+#######################################################################################################
+##                                failover load balancing
+#######################################################################################################
+
+# The load balancing of RFC 3074 as ISC dhcpd does it: a client identifier,
+# or the hardware address of a client without one, is hashed into one of
+# 256 buckets, and the hash bucket assignment (hba) bitmap says which of the
+# two peers serves a bucket. Bucket b is bit b & 7 of byte b >> 3 and set
+# buckets belong to the primary. "split N" is the hba with buckets [0, N)
+# set.
+
+# The Pearson hash table of RFC 3074, loadb_mx_tbl in dhcpd.
+dhcp_loadb_table = (
+    251, 175, 119, 215, 81, 14, 79, 191, 103, 49, 181, 143, 186, 157, 0, 232,
+    31, 32, 55, 60, 152, 58, 17, 237, 174, 70, 160, 144, 220, 90, 57, 223,
+    59, 3, 18, 140, 111, 166, 203, 196, 134, 243, 124, 95, 222, 179, 197, 65,
+    180, 48, 36, 15, 107, 46, 233, 130, 165, 30, 123, 161, 209, 23, 97, 16,
+    40, 91, 219, 61, 100, 10, 210, 109, 250, 127, 22, 138, 29, 108, 244, 67,
+    207, 9, 178, 204, 74, 98, 126, 249, 167, 116, 34, 77, 193, 200, 121, 5,
+    20, 113, 71, 35, 128, 13, 182, 94, 25, 226, 227, 199, 75, 27, 41, 245,
+    230, 224, 43, 225, 177, 26, 155, 150, 212, 142, 218, 115, 241, 73, 88, 105,
+    39, 114, 62, 255, 192, 201, 145, 214, 168, 158, 221, 148, 154, 122, 12, 84,
+    82, 163, 44, 139, 228, 236, 205, 242, 217, 11, 187, 146, 159, 64, 86, 239,
+    195, 42, 106, 198, 118, 112, 184, 172, 87, 2, 173, 117, 176, 229, 247, 253,
+    137, 185, 99, 164, 102, 147, 45, 66, 231, 52, 141, 211, 194, 206, 246, 238,
+    56, 110, 78, 248, 63, 240, 189, 93, 92, 51, 53, 183, 19, 171, 72, 50,
+    33, 104, 101, 69, 8, 252, 83, 120, 76, 135, 85, 54, 202, 125, 188, 213,
+    96, 235, 136, 208, 162, 129, 190, 132, 156, 38, 47, 1, 7, 254, 24, 4,
+    216, 131, 89, 21, 28, 133, 37, 153, 149, 80, 170, 68, 6, 169, 234, 151,
+)
+dhcp_loadb_translation = ''.join(chr(value) for value in dhcp_loadb_table)
+
+def dhcp_loadb_hash( key ):
+    # The bucket of one key, a byte string.
+    hash = len(key)
+    for octet in reversed(bytearray(key)):
+        hash = dhcp_loadb_table[hash ^ octet]
+    return hash
+
+def dhcp_xor_bytes( a, b ):
+    value = int(binascii.hexlify(a), 16) ^ int(binascii.hexlify(b), 16)
+    return binascii.unhexlify('%0*x' % (2 * len(a), value))
+
+def dhcp_loadb_buckets( macs, prefix='' ):
+    # Count the clients per bucket. macs is the concatenation of their 6
+    # byte hardware addresses and every key is prefix followed by one of
+    # them. The hash is computed a column of key bytes at a time for all
+    # clients at once, with the XOR done on a long integer and the table
+    # lookup done by str.translate, so no per-client Python code runs.
+    count = len(macs) // 6
+    if not count:
+        return [0] * 256
+    columns = [chr(octet) * count for octet in bytearray(prefix)]
+    columns.extend(macs[i::6] for i in range(6))
+    hashes = chr(len(columns)) * count
+    for column in reversed(columns):
+        hashes = dhcp_xor_bytes(hashes, column).translate(dhcp_loadb_translation)
+    return [hashes.count(chr(bucket)) for bucket in range(256)]
+
+def dhcp_loadb_macs( macs ):
+    # The concatenated 6 byte form of colon separated MAC addresses, for
+    # dhcp_loadb_buckets(). Anything else is skipped.
+    return binascii.unhexlify(''.join(mac for mac in macs if len(mac) == 17).replace(':', ''))
+
+def dhcp_hba_split( split ):
+    hba = bytearray(32)
+    for bucket in range(split):
+        hba[bucket >> 3] |= 1 << (bucket & 7)
+    return hba
+
+def dhcp_hba_parse( value ):
+    # dhcpHashBucketAssignment has Octet String syntax and ISC's LDAP
+    # backend stores the 32 raw bytes; typed in, it is 64 hex digits,
+    # optionally colon separated as in dhcpd.conf.
+    if isinstance(value, (bytes, bytearray)) and len(value) == 32:
+        return bytearray(value)
+    if isinstance(value, (bytes, bytearray)):
+        value = bytes(value).decode('ascii')
+    digits = value.replace(':', '').strip()
+    if len(digits) != 64:
+        raise ValueError(value)
+    return bytearray(binascii.unhexlify(digits))
+
+def dhcp_hba_format( hba ):
+    return u':'.join(u'{0:02x}'.format(octet) for octet in hba)
+
+def dhcp_hba_primary( hba, bucket ):
+    return bool(hba[bucket >> 3] & (1 << (bucket & 7)))
+
+def dhcp_hba_load( hba, counts ):
+    # (primary, secondary) clients of a bucket count list under an hba.
+    primary = sum(count for (bucket, count) in enumerate(counts) if dhcp_hba_primary(hba, bucket))
+    return (primary, sum(counts) - primary)
+
+def dhcp_hba_balance( counts ):
+    # An hba that splits the clients as evenly as the buckets allow: the
+    # largest buckets first, each to the peer with fewer clients so far.
+    hba = bytearray(32)
+    load = [0, 0]
+    for bucket in sorted(range(256), key=lambda bucket: (-counts[bucket], bucket)):
+        if load[0] <= load[1]:
+            hba[bucket >> 3] |= 1 << (bucket & 7)
+            load[0] += counts[bucket]
+        else:
+            load[1] += counts[bucket]
+    return hba
+
+
+#######################################################################################################
+##                                indexes
+#######################################################################################################
+
+# The attributes and index types that the searches of this plugin, and those
+# dhcpd issues with ldap-method dynamic, depend on. cn and objectclass are
+# indexed by every IPA server already. dhcp_index_check reports the ones the
+# backend lacks; the update file creates the others.
+dhcp_index_requirements = (
+    ('objectclass', 'eq', u'object class filters of every search'),
+    ('cn', 'eq', u'dhcpd server lookups, dhcphost-import'),
+    ('dhcphwaddress', 'eq', u'dhcpd host lookups by MAC address, dhcphost-import'),
+    ('dhcpclientid', 'eq', u'dhcpd host lookups by client identifier'),
+    ('dhcpclassdata', 'eq', u'dhcpd subclass lookups'),
+    ('dhcpstatements', 'sub', u'fixed-address* in overlap checks, free address searches and dhcphost-import'),
+    ('dhcprange', 'pres', u'pool ranges in overlap checks and free address searches'),
+    ('dhcprange6', 'pres', u'IPv6 pool ranges in overlap checks and free address searches'),
+    ('dhcpservicedn', 'eq', u'dhcpd server lookups'),
+    ('dhcpserverdn', 'eq', u'dhcpd service lookups'),
+    ('dhcpprimarydn', 'eq', u'dhcpd service lookups'),
+    ('dhcpsecondarydn', 'eq', u'dhcpd service lookups'),
+    ('dhcpsubnetdn', 'eq', u'shared network lookups'),
+    ('dhcphostownerdn', 'eq', u'dhcpHost lookups by IPA host'),
+    ('modifytimestamp', 'eq', u'dhcp-changes-since'),
+)
+
+def dhcp_missing_indexes( ldap, backend ):
+    base_dn = DN(
+        ('cn', 'index'), ('cn', backend),
+        ('cn', 'ldbm database'), ('cn', 'plugins'), ('cn', 'config')
+    )
+    entries = ldap.get_entries(
+        base_dn, ldap.SCOPE_ONELEVEL, u'(objectclass=nsindex)', ['cn', 'nsindextype']
+    )
+    indexes = {}
+    for entry in entries:
+        indexes[entry['cn'][0].lower()] = set(value.lower() for value in entry.get('nsindextype', []))
+
+    return [
+        (attr, index, usage) for (attr, index, usage) in dhcp_index_requirements
+        if index not in indexes.get(attr, ())
+    ]
+
+
+#######################################################################################################
+##                                instrumentation
+#######################################################################################################
+
+# Per-process counters of the commands of this plugin: calls, errors, wall
+# time and the LDAP operations made by the plugin's own code with the number
+# of bytes they returned. The reads and writes the framework does for the
+# entry a command works on are not counted. dhcp_instrument_commands() wraps
+# the execute methods and callbacks of a module's commands; callbacks get
+# their ldap argument wrapped in a DHCPLDAPCounter, execute methods wrap the
+# backend themselves with dhcp_ldap(). Each command also logs one line of
+# key=value pairs with its numbers.
+#
+# Instrumentation is off unless the IPA configuration enables it, with
+#
+#   dhcp_stats = True
+#
+# in the [global] section of /etc/ipa/server.conf. Without it commands,
+# callbacks and the backend are left as they are and dhcp_stats reports
+# nothing.
+dhcp_logger = logging.getLogger(__name__)
+
+def dhcp_stats_enabled():
+    return unicode(getattr(api.env, 'dhcp_stats', False)).lower() in (u'true', u'yes', u'1')
+
+dhcp_stats_totals = {}
+dhcp_stats_lock = threading.Lock()
+dhcp_stats_local = threading.local()
+
+def dhcp_value_size( value ):
+    if isinstance(value, bytes):
+        return len(value)
+    return len(unicode(value).encode('utf-8'))
+
+def dhcp_entry_size( entry ):
+    size = dhcp_value_size(getattr(entry, 'dn', u''))
+    for attr in entry:
+        size += len(attr) + sum(dhcp_value_size(value) for value in entry[attr])
+    return size
+
+def dhcp_stats_record( op, entries=() ):
+    stack = getattr(dhcp_stats_local, 'stack', None)
+    if not stack:
+        return
+    record = stack[-1]
+    record['ops'][op] = record['ops'].get(op, 0) + 1
+    record['bytes'] += sum(dhcp_entry_size(entry) for entry in entries)
+
+def dhcp_stats_add( name, elapsed, record, failed ):
+    with dhcp_stats_lock:
+        totals = dhcp_stats_totals.setdefault(
+            name, dict(calls=0, errors=0, seconds=0.0, max_seconds=0.0, ops={}, bytes=0)
+        )
+        totals['calls'] += 1
+        totals['errors'] += int(failed)
+        totals['seconds'] += elapsed
+        totals['max_seconds'] = max(totals['max_seconds'], elapsed)
+        totals['bytes'] += record['bytes']
+        for (op, count) in record['ops'].items():
+            totals['ops'][op] = totals['ops'].get(op, 0) + count
+
+    dhcp_logger.info(
+        'dhcp_stats command=%s seconds=%.6f failed=%s ldap_ops=%d ldap_bytes=%d%s',
+        name, elapsed, failed, sum(record['ops'].values()), record['bytes'],
+        u''.join(u' {0}={1}'.format(op, count) for (op, count) in sorted(record['ops'].items()))
+    )
+
+def dhcp_stats_call( name, func, *args, **kw ):
+    # Call func with a fresh record on top of the stack of this thread; the
+    # LDAP operations it makes are counted in that record only, so a command
+    # that calls another one doesn't count the operations of the inner
+    # command twice.
+    stack = getattr(dhcp_stats_local, 'stack', None)
+    if stack is None:
+        stack = dhcp_stats_local.stack = []
+    record = dict(ops={}, bytes=0)
+    stack.append(record)
+    start = time.time()
+    failed = True
+    try:
+        result = func(*args, **kw)
+        failed = False
+        return result
+    finally:
+        stack.pop()
+        dhcp_stats_add(name, time.time() - start, record, failed)
+
+def dhcp_stats_report( reset=False ):
+    with dhcp_stats_lock:
+        items = [(name, dict(totals, ops=dict(totals['ops']))) for (name, totals) in dhcp_stats_totals.items()]
+        if reset:
+            dhcp_stats_totals.clear()
+
+    result = []
+    for (name, totals) in sorted(items, key=lambda item: -item[1]['seconds']):
+        entry = dict(
+            command=unicode(name),
+            calls=totals['calls'],
+            errors=totals['errors'],
+            seconds=u'{0:.3f}'.format(totals['seconds']),
+            mean_ms=u'{0:.3f}'.format(totals['seconds'] * 1000 / totals['calls']),
+            max_ms=u'{0:.3f}'.format(totals['max_seconds'] * 1000),
+            ldap_ops=sum(totals['ops'].values()),
+            ldap_bytes=totals['bytes'],
+        )
+        for (op, count) in totals['ops'].items():
+            entry[op] = count
+        result.append(entry)
+    return result
+
+
+class DHCPLDAPCounter(object):
+    # Wraps an ldap2 backend and records the calls of its read and write
+    # methods; everything else is passed through.
+
+    counted_methods = set(['get_entry', 'get_entries', 'find_entries', 'add_entry', 'update_entry', 'delete_entry'])
+
+    def __init__(self, ldap):
+        self.ldap = ldap
+
+    def __getattr__(self, name):
+        method = getattr(self.ldap, name)
+        if name not in self.counted_methods:
+            return method
+
+        def counted(*args, **kw):
+            try:
+                result = method(*args, **kw)
+            except Exception:
+                dhcp_stats_record(name)
+                raise
+            if name == 'get_entry':
+                dhcp_stats_record(name, [result])
+            elif name == 'get_entries':
+                dhcp_stats_record(name, result)
+            elif name == 'find_entries':
+                dhcp_stats_record(name, result[0])
+            else:
+                dhcp_stats_record(name)
+            return result
+        return counted
+
+def dhcp_ldap( ldap ):
+    if isinstance(ldap, DHCPLDAPCounter) or not dhcp_stats_enabled():
+        return ldap
+    return DHCPLDAPCounter(ldap)
+
+def dhcp_counted_callback( callback, name=None ):
+    # Wrap a callback so that its ldap argument counts the calls made with
+    # it. Callbacks that run outside of a command of this plugin, like the
+    # ones registered on the host commands, are recorded under name.
+    if not dhcp_stats_enabled():
+        return callback
+    def wrapper(self, ldap, *args, **kw):
+        if name is not None and not getattr(dhcp_stats_local, 'stack', None):
+            return dhcp_stats_call(name, callback, self, dhcp_ldap(ldap), *args, **kw)
+        return callback(self, dhcp_ldap(ldap), *args, **kw)
+    wrapper.__name__ = callback.__name__
+    wrapper.dhcp_counted = True
+    return wrapper
+
+def dhcp_timed_execute( execute ):
+    def wrapper(self, *args, **kw):
+        return dhcp_stats_call(self.name, execute, self, *args, **kw)
+    wrapper.__name__ = execute.__name__
+    wrapper.dhcp_counted = True
+    return wrapper
+
+def dhcp_instrument_commands( namespace ):
+    # Instrument the commands defined in a plugin module; classes imported
+    # from another module are left to that module.
+    if not dhcp_stats_enabled():
+        return
+    for cls in list(namespace.values()):
+        if not isinstance(cls, type) or not issubclass(cls, Command):
+            continue
+        if cls.__module__ != namespace['__name__']:
+            continue
+
+        execute = getattr(cls, 'execute', None)
+        execute = getattr(execute, '__func__', execute)
+        if execute is not None and not getattr(execute, 'dhcp_counted', False):
+            cls.execute = dhcp_timed_execute(execute)
+
+        for attr in ('pre_callback', 'post_callback'):
+            callback = cls.__dict__.get(attr)
+            if callback is not None and not getattr(callback, 'dhcp_counted', False):
+                setattr(cls, attr, dhcp_counted_callback(callback))
@@ -36,6 +36,11 @@ from ipapython.dn import DN
 from ipapython.dnsutil import DNSName
 from netaddr import *
 
+import csv
+import io
+import json
+import re
+
 from dhcpcommon import *
 
 #### Constants ################################################################
@@ -44,6 +49,7 @@ from dhcpcommon import *
 dhcp_dn = '{0}'.format(api.env.basedn)
 service_dhcp_dn = 'cn=v4'
 container_dhcp_dn = DN(('cn', 'v4'), 'cn=dhcp')
+container_dhcpv6_dn = DN(('cn', 'v6'), 'cn=dhcp')
 register = Registry()
 
 dhcp_version = 4
@@ -83,7 +89,13 @@ class dhcpservice(LDAPObject):
 		'dhcphashbucketassignment', 'dhcpserverdn',
 		'dhcpclassesdn', 'dhcpsharednetworkdn', 'dhcplocatordn', 
 		'dhcpzonedn', 'dhcphostdn', 'dhcpmaxclientleadtime',
-		'dhcpgroupdn', 'dhcpsubnetdn', 'dhcpfailoverpeerdn'
+		'dhcpgroupdn', 'dhcpsubnetdn', 'dhcpfailoverpeerdn',
+		'dhcphostownerdn', 'createtimestamp', 'entrycsn',
+		'dhcpaddressstate', 'dhcpexpirationtime', 'dhcpassignedhostname',
+		'dhcprange6', 'dhcpfailoverprimaryserver', 'dhcpfailoversecondaryserver',
+		'dhcpfailoverprimaryport', 'dhcpfailoversecondaryport',
+		'dhcpfailoverresponsedelay', 'dhcpfailoverunackedupdates',
+		'dhcpfailoversplit', 'dhcpfailoverloadbalancetime'
             },
         },
         'System: Write DHCP Configuration': {
@@ -176,7 +188,7 @@ class dhcpservice(LDAPObject):
 
 
     def get_dn(self, *keys, **kwargs):
-        if not dhcpservice.dhcpservice_exists(self.api.Backend.ldap2):
+        if not dhcpservice.dhcpservice_exists(dhcp_ldap(self.api.Backend.ldap2)):
             raise errors.NotFound(reason=_('DHCP is not configured'))
         return DN(container_dhcp_dn, dhcp_dn)
 
@@ -184,38 +196,23 @@ class dhcpservice(LDAPObject):
     @staticmethod
     def dhcpservice_exists(ldap):
         try:
-            ldap.get_entry(DN(container_dhcp_dn, dhcp_dn), [])
+            dhcp_service_entry(ldap, DN(container_dhcp_dn, dhcp_dn))
         except errors.NotFound:
             return False
         return True
 
 
+    virtual_params = (
+        'defaultleasetime',
+        'maxleasetime',
+        'domainname',
+        'domainnameservers',
+        'domainsearch',
+    )
+
     @staticmethod
     def extract_virtual_params(ldap, dn, entry_attrs, keys, options):
-        dhcpStatements = entry_attrs.get('dhcpstatements', [])
-
-        for statement in dhcpStatements:
-            if statement.startswith('default-lease-time '):
-                (s, v) = statement.split(' ', 1)
-                entry_attrs['defaultleasetime'] = v
-            if statement.startswith('max-lease-time '):
-                (s, v) = statement.split(' ', 1)
-                entry_attrs['maxleasetime'] = v
-
-        dhcpOptions = entry_attrs.get('dhcpoption', [])
-
-        for option in dhcpOptions:
-            if option.startswith('domain-name '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['domainname'] = v.replace('"', '')
-            if option.startswith('domain-name-servers '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['domainnameservers'] = v.split(', ')
-            if option.startswith('domain-search '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['domainsearch'] = v.replace('"', '').split(', ')
-
-        return entry_attrs
+        return dhcp_extract_virtual_params(4, entry_attrs, dhcpservice.virtual_params)
 
 
 @register()
@@ -238,36 +235,193 @@ class dhcpservice_mod(LDAPUpdate):
     def pre_callback(self, ldap, dn, entry_attrs, attrs_list, *keys, **options):
         assert isinstance(dn, DN)
 
-        if 'dhcpstatements' in entry_attrs:
-            dhcpStatements = entry_attrs.get('dhcpstatements', [])
-        else:
-            entry = ldap.get_entry(dn)
-            dhcpStatements = entry.get('dhcpstatements', [])
-
-        if 'dhcpoption' in entry_attrs:
-            dhcpOptions = entry_attrs.get('dhcpoption', [])
-        else:
-            entry = ldap.get_entry(dn)
-            dhcpOptions = entry.get('dhcpoption', [])
-
-        dhcp_modify_domainname( dhcp_version, options, dhcpOptions, dhcpStatements )
-        dhcp_modify_domainserver( dhcp_version, options, dhcpOptions )
-        dhcp_modify_domainsearch( dhcp_version, options, dhcpOptions )
-        dhcp_modify_defaultleasetime( dhcp_version, options, dhcpStatements )
-        dhcp_modify_maxleasetime( dhcp_version, options, dhcpStatements )
-
-        entry_attrs['dhcpstatements'] = dhcpStatements
-        entry_attrs['dhcpoption'] = dhcpOptions
+        dhcp_mod_virtual_params(ldap, dn, entry_attrs, options, dhcp_version, self.obj.virtual_params)
 
         return dn
 
 
     def post_callback(self, ldap, dn, entry_attrs, *keys, **options):
         assert isinstance(dn, DN)
+        dhcp_service_invalidate(dn)
         entry_attrs = dhcpservice.extract_virtual_params(ldap, dn, entry_attrs, keys, options)
         return dn
 
 
+@register()
+class dhcpservice_export(Command):
+    __doc__ = _('Export the DHCP configuration as a dhcpd.conf file.')
+    has_output = (
+        Output('result', unicode, _('dhcpd.conf')),
+    )
+    container_dn = container_dhcp_dn
+    dhcp_version = 4
+
+    takes_options = (
+        Str(
+            'server?',
+            cli_name='server',
+            label=_('Server'),
+            doc=_('Host name of the DHCP server the file is for. It decides the role of the server in failover peers.')
+        ),
+    )
+
+    def execute(self, *args, **kw):
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        lines = dhcp_export_config(
+            ldap, DN(self.container_dn, dhcp_dn), self.dhcp_version, kw.get('server')
+        )
+        return dict(result=u''.join(lines))
+
+
+@register()
+class dhcp_changes_since(Command):
+    __doc__ = _('List the DHCP objects created, modified or deleted since a cursor.')
+    has_output = (
+        output.summary,
+        ListOfEntries('result'),
+        Output('count', int, _('Number of changes')),
+        Output('cursor', unicode, _('Cursor to pass to the next call')),
+        Output('truncated', bool, _('True if more changes follow the cursor')),
+        Output('deletes', bool, _('True if deleted objects are listed, which only Directory Manager can see')),
+    )
+    msg_summary = ngettext(
+        '%(count)d change',
+        '%(count)d changes', 0
+    )
+
+    takes_args = (
+        Str(
+            'cursor?',
+            cli_name='cursor',
+            label=_('Cursor'),
+            doc=_('Cursor returned by the previous call, or a GeneralizedTime (YYYYMMDDHHMMSSZ) to start from. Without it every DHCP object is listed.'),
+            pattern='^[0-9]{14}Z(#[0-9a-fA-F]+)?$',
+            pattern_errmsg=_('Must be of the form YYYYMMDDHHMMSSZ or a cursor returned by a previous call.')
+        ),
+    )
+
+    takes_options = (
+        Int(
+            'sizelimit?',
+            cli_name='sizelimit',
+            label=_('Size Limit'),
+            doc=_('Maximum number of changes returned. Pass the returned cursor to list the rest.'),
+            minvalue=1,
+            default=1000,
+            autofill=True
+        ),
+    )
+
+    def execute(self, *args, **kw):
+
+        # The cursor is the modifyTimestamp and entryCSN of the last change
+        # returned and is exclusive, so every change is listed exactly once
+        # across calls. Deletes are only listed to Directory Manager, who can
+        # read the tombstones; deletes tells the caller which feed it got.
+
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        cursor = args[0] or u'19700101000000Z'
+        deletes = dhcp_tombstones_visible(ldap)
+
+        (changes, cursor, truncated) = dhcp_changes(
+            ldap, DN(('cn', 'dhcp'), dhcp_dn), cursor, kw.get('sizelimit') or 1000, deletes
+        )
+
+        result = []
+        for (change, dn, modified, csn, objectclasses) in changes:
+            entry = dict(
+                dn=unicode(dn),
+                change=change,
+                modifytimestamp=modified,
+                objectclass=list(objectclasses)
+            )
+            if csn is not None:
+                entry['entrycsn'] = unicode(csn)
+            result.append(entry)
+
+        return dict(
+            result=result, count=len(result), cursor=cursor, truncated=truncated, deletes=deletes
+        )
+
+
+@register()
+class dhcp_index_check(Command):
+    __doc__ = _('Report DHCP search filters that are not backed by an index.')
+    has_output = output.standard_list_of_entries
+    msg_summary = ngettext(
+        '%(count)d index missing',
+        '%(count)d indexes missing', 0
+    )
+
+    takes_options = (
+        Str(
+            'backend?',
+            cli_name='backend',
+            label=_('Backend'),
+            doc=_('Directory Server backend that holds the DHCP tree.'),
+            default=u'userRoot',
+            autofill=True
+        ),
+    )
+
+    def execute(self, *args, **kw):
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        try:
+            missing = dhcp_missing_indexes(ldap, kw.get('backend') or u'userRoot')
+        except errors.NotFound:
+            raise errors.NotFound(
+                reason=_('no index configuration found for backend "%(backend)s"') % dict(
+                    backend=kw.get('backend')
+                )
+            )
+
+        result = [
+            dict(attribute=unicode(attr), index=unicode(index), usage=usage)
+            for (attr, index, usage) in missing
+        ]
+        return dict(result=result, count=len(result), truncated=False)
+
+
+@register()
+class dhcp_stats(Command):
+    __doc__ = _('Show the call counts, timings and LDAP operations of the DHCP commands run by this server process.')
+    has_output = (
+        output.summary,
+        ListOfEntries('result'),
+        Output('count', int, _('Number of commands')),
+    )
+    msg_summary = ngettext(
+        '%(count)d command',
+        '%(count)d commands', 0
+    )
+
+    takes_options = (
+        Flag(
+            'reset?',
+            cli_name='reset',
+            label=_('Reset'),
+            doc=_('Clear the counters after reading them. Requires write access to the DHCP configuration.')
+        ),
+    )
+
+    def execute(self, *args, **kw):
+
+        # The counters live in the server process that handles the request;
+        # with several httpd worker processes every one keeps its own. They
+        # are only collected when dhcp_stats is enabled in the IPA
+        # configuration.
+
+        if kw.get('reset', False):
+            ldap = self.api.Backend.ldap2
+            if not ldap.can_write(DN(container_dhcp_dn, dhcp_dn), 'dhcpstatements'):
+                raise errors.ACIError(
+                    info=_('Resetting the DHCP statistics requires write access to the DHCP configuration.')
+                )
+
+        result = dhcp_stats_report(kw.get('reset', False))
+        return dict(result=result, count=len(result))
+
+
 #### dhcpsubnet ###############################################################
 
 
@@ -363,21 +517,14 @@ class dhcpsubnet(LDAPObject):
     )
 
 
+    virtual_params = (
+        'router',
+        'domainnameserver',
+    )
+
     @staticmethod
     def extract_virtual_params(ldap, dn, entry_attrs, keys, options):
-
-        dhcpOptions = entry_attrs.get('dhcpoption', [])
-
-        for option in dhcpOptions:
-            if option.startswith('routers '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['router'] = v
-
-            elif option.startswith('domain-name-servers '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['domainnameserver'] = v.split(', ')
-
-        return entry_attrs
+        return dhcp_extract_virtual_params(4, entry_attrs, dhcpsubnet.virtual_params)
 
 
 @register()
@@ -433,6 +580,17 @@ class dhcpsubnet_find(LDAPSearch):
     )
 
 
+    def pre_callback(self, ldap, filter, attrs_list, base_dn, scope, *args, **options):
+        assert isinstance(base_dn, DN)
+        dhcp_find_virtual_attrs(self.obj, attrs_list, options)
+        return (filter, base_dn, scope)
+
+
+    def post_callback(self, ldap, entries, truncated, *args, **options):
+        dhcp_find_extract_virtual_params(self.obj, ldap, entries, options)
+        return truncated
+
+
 @register()
 class dhcpsubnet_show(LDAPRetrieve):
     __doc__ = _('Display a DHCP subnet.')
@@ -453,36 +611,7 @@ class dhcpsubnet_mod(LDAPUpdate):
     def pre_callback(self, ldap, dn, entry_attrs, attrs_list, *keys, **options):
         assert isinstance(dn, DN)
 
-        entry = ldap.get_entry(dn)
-
-        if 'dhcpstatements' in entry_attrs:
-            dhcpStatements = entry_attrs.get('dhcpstatements', [])
-        else:
-            dhcpStatements = entry.get('dhcpstatements', [])
-
-        if 'dhcpoption' in entry_attrs:
-            dhcpOptions = entry_attrs.get('dhcpoption', [])
-        else:
-            dhcpOptions = entry.get('dhcpoption', [])
-
-        if 'router' in options:
-            option = 'routers {0}'.format(options['router'])
-            foundOption = False
-            for i, s in enumerate(dhcpOptions):
-                if s.startswith('routers '):
-                    foundOption = True
-                    dhcpOptions[i] = option
-                    break
-            if not foundOption:
-                dhcpOptions.append(option)
-
-        dhcp_modify_router( dhcp_version, options, dhcpOptions )      
-        dhcp_modify_domainname( dhcp_version, options, dhcpOptions, dhcpStatements )
-        dhcp_modify_domainserver( dhcp_version, options, dhcpOptions )
-        dhcp_modify_domainsearch( dhcp_version, options, dhcpOptions )
-
-        entry_attrs['dhcpstatements'] = dhcpStatements
-        entry_attrs['dhcpoption'] = dhcpOptions
+        dhcp_mod_virtual_params(ldap, dn, entry_attrs, options, dhcp_version, self.obj.virtual_params)
 
         return dn
 
@@ -499,6 +628,307 @@ class dhcpsubnet_del(LDAPDelete):
     msg_summary = _('Deleted DHCP subnet "%(value)s"')
 
 
+@register()
+class dhcpsubnet_check_overlaps(Command):
+    __doc__ = _('Report overlapping pool ranges and fixed addresses in a DHCP subnet.')
+    has_output = output.standard_list_of_entries
+    msg_summary = ngettext(
+        '%(count)d overlap found',
+        '%(count)d overlaps found', 0
+    )
+    container_dn = container_dhcp_dn
+
+    takes_args = (
+        Str(
+            'dhcpsubnetcn',
+            cli_name='subnet',
+            label=_('Subnet'),
+            doc=_('DHCP subnet.')
+        ),
+    )
+
+    def execute(self, *args, **kw):
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        service_dn = DN(self.container_dn, dhcp_dn)
+        dn = DN(('cn', args[0]), service_dn)
+
+        network = dhcp_subnet_network(ldap.get_entry(dn, ['cn', 'dhcpnetmask']))
+        index = DHCPIntervalTree(dhcp_address_intervals(ldap, network, service_dn))
+
+        result = []
+        for (first, second) in index.overlaps():
+            (first_dn, first_value) = first[2]
+            (second_dn, second_value) = second[2]
+            result.append(dict(
+                dn=unicode(first_dn),
+                range=first_value,
+                overlapping_dn=unicode(second_dn),
+                overlapping_range=second_value
+            ))
+
+        return dict(result=result, count=len(result), truncated=False)
+
+
+@register()
+class dhcpsubnet_next_free(Command):
+    __doc__ = _('Find the next free addresses in a DHCP subnet.')
+    has_output = (
+        output.summary,
+        Output('result', (list, tuple), _('Free addresses')),
+        Output('count', int, _('Number of free addresses returned')),
+    )
+    msg_summary = ngettext(
+        '%(count)d free address',
+        '%(count)d free addresses', 0
+    )
+    container_dn = container_dhcp_dn
+
+    takes_args = (
+        Str(
+            'dhcpsubnetcn',
+            cli_name='subnet',
+            label=_('Subnet'),
+            doc=_('DHCP subnet.')
+        ),
+    )
+
+    takes_options = (
+        Int(
+            'count?',
+            cli_name='count',
+            label=_('Count'),
+            doc=_('Number of addresses to return.'),
+            minvalue=1,
+            maxvalue=4096,
+            default=1,
+            autofill=True
+        ),
+    )
+
+    def execute(self, *args, **kw):
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        service_dn = DN(self.container_dn, dhcp_dn)
+        dn = DN(('cn', args[0]), service_dn)
+
+        free = dhcp_free_addresses(ldap, dn, service_dn, kw.get('count') or 1)
+
+        result = [unicode(address) for address in free]
+        return dict(result=result, count=len(result))
+
+
+@register()
+class dhcpsubnet_effective(Command):
+    __doc__ = _('Show the statements, options and permits in effect for a DHCP subnet and the scope each comes from.')
+    has_output = (
+        output.summary,
+        ListOfEntries('result'),
+        Output('count', int, _('Number of values')),
+        Output('scopes', (list, tuple), _('Scopes, outermost first')),
+    )
+    msg_summary = ngettext(
+        '%(count)d value in effect',
+        '%(count)d values in effect', 0
+    )
+    container_dn = container_dhcp_dn
+
+    takes_args = (
+        Str(
+            'cn',
+            cli_name='subnet',
+            label=_('Subnet'),
+            doc=_('Subnet.')
+        ),
+    )
+
+    def execute(self, *args, **kw):
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        service_dn = DN(self.container_dn, dhcp_dn)
+        entry = ldap.get_entry(DN(('cn', args[0]), service_dn), dhcp_effective_attrs)
+        return dhcp_effective_result(ldap, service_dn, entry)
+
+
+@register()
+class dhcp_lookup_address(Command):
+    __doc__ = _('Show the DHCP subnet and pool that serve an IPv4 or IPv6 address, with the options in effect there.')
+    has_output = (
+        output.summary,
+        Output('result', dict, _('Subnet, pool and effective options')),
+        output.value,
+    )
+    msg_summary = _('%(value)s is served by DHCP subnet %(subnet)s')
+    container_dns = {
+        4: container_dhcp_dn,
+        6: container_dhcpv6_dn,
+    }
+
+    takes_args = (
+        Str(
+            'address',
+            cli_name='address',
+            label=_('Address'),
+            doc=_('IPv4 or IPv6 address.')
+        ),
+    )
+
+    def execute(self, *args, **kw):
+
+        # The subnets and pools are read with one search into an index that
+        # maps the address to its subnet and pool.
+
+        try:
+            address = IPAddress(args[0])
+        except (AddrFormatError, ValueError):
+            raise errors.ValidationError(name='address', error=_('must be an IPv4 or IPv6 address'))
+
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        service_dn = DN(self.container_dns[address.version], dhcp_dn)
+        result = dhcp_address_scope(ldap, service_dn, address)
+        if result is None:
+            raise errors.NotFound(
+                reason=_('no DHCP subnet holds %(address)s') % dict(address=unicode(address))
+            )
+
+        value = unicode(address)
+
+        # The current lease, when dhcpd runs on this server.
+        try:
+            store = dhcp_lease_ingester(address.version).store
+        except errors.NotFound:
+            store = None
+        if store is not None:
+            for slot in store.find(address=str(address)):
+                result['lease'] = store.lease(slot)
+
+        return dict(
+            summary=unicode(self.msg_summary % dict(value=value, subnet=result['network'])),
+            result=result,
+            value=value
+        )
+
+
+#### dhcplease ###############################################################
+
+@register()
+class dhcplease_find(Command):
+    __doc__ = _('Search for DHCP leases by MAC address, IP address or client host name.')
+    has_output = output.standard_list_of_entries
+    msg_summary = ngettext(
+        '%(count)d DHCP lease matched',
+        '%(count)d DHCP leases matched', 0
+    )
+    container_dn = container_dhcp_dn
+    dhcp_version = 4
+    lease_keys = ('address', 'mac', 'hostname')
+
+    takes_args = (
+        Str(
+            'criteria?',
+            cli_name='criteria',
+            label=_('Criteria'),
+            doc=_('MAC address, IP address or client host name.')
+        ),
+    )
+
+    takes_options = (
+        Str(
+            'macaddress?',
+            cli_name='macaddress',
+            label=_('MAC Address'),
+            doc=_('Hardware address of the client.')
+        ),
+        Str(
+            'ipaddress?',
+            cli_name='ipaddress',
+            label=_('IP Address'),
+            doc=_('Leased address.')
+        ),
+        Str(
+            'hostname?',
+            cli_name='hostname',
+            label=_('Host Name'),
+            doc=_('Host name the client sent.')
+        ),
+        StrEnum(
+            'source?',
+            cli_name='source',
+            label=_('Source'),
+            doc=_('Read the leases from the dhcpd lease file or from the dhcpLeases entries in LDAP.'),
+            values=(u'file', u'ldap'),
+            default=u'file',
+            autofill=True
+        ),
+        Int(
+            'sizelimit?',
+            cli_name='sizelimit',
+            label=_('Size Limit'),
+            doc=_('Maximum number of leases returned.'),
+            minvalue=1,
+            default=100,
+            autofill=True
+        ),
+    )
+
+    def execute(self, *args, **kw):
+
+        # The leases are looked up in a store with hash indexes on the
+        # address, the MAC address and the client host name. The lease file
+        # store is kept per process and follows the file; from LDAP only the
+        # leases matching the keys are read, with an indexed filter.
+
+        keys = {}
+        for (name, kind, error) in (
+            ('ipaddress', 'address', _('must be an IP address')),
+            ('macaddress', 'mac', _('must be a MAC address')),
+            ('hostname', 'hostname', None),
+        ):
+            if kw.get(name):
+                try:
+                    keys[kind] = dhcp_lease_key(kind, kw[name])
+                except (AddrFormatError, ValueError):
+                    raise errors.ValidationError(name=name, error=error)
+
+        # The criteria match any of the keys they can be read as.
+        criteria = []
+        if args and args[0]:
+            for kind in self.lease_keys:
+                try:
+                    criteria.append((kind, dhcp_lease_key(kind, args[0])))
+                except (AddrFormatError, ValueError):
+                    continue
+            if not criteria:
+                return dict(result=[], count=0, truncated=False)
+
+        sizelimit = kw.get('sizelimit') or 100
+        truncated = False
+        if kw.get('source') == u'ldap':
+            ldap = dhcp_ldap(self.api.Backend.ldap2)
+            (store, truncated) = dhcp_ldap_lease_store(
+                ldap,
+                DN(self.container_dn, dhcp_dn),
+                dhcp_ldap_lease_filter(ldap, keys, criteria),
+                sizelimit
+            )
+        else:
+            store = dhcp_lease_ingester(self.dhcp_version).store
+
+        slots = store.find(**keys)
+        if criteria:
+            found = set()
+            for (kind, key) in criteria:
+                found.update(store.find(**dict(keys, **{kind: key})))
+            slots = sorted(found)
+
+        sizelimit = kw.get('sizelimit') or 100
+        result = []
+        for slot in slots:
+            if len(result) >= sizelimit:
+                break
+            result.append(store.lease(slot))
+
+        truncated = truncated or len(result) < len(slots)
+        return dict(result=result, count=len(result), truncated=truncated)
+
+
 #### dhcpfailoverpeer ###############################################################
 
 @register()
@@ -638,6 +1068,140 @@ class dhcpfailoverpeer_del(LDAPDelete):
     msg_summary = _('Deleted DHCP fail over peer "%(value)s"')
 
 
+@register()
+class dhcpfailoverpeer_simulate(Command):
+    __doc__ = _('Simulate how a fail over split or hash bucket assignment divides the DHCP clients between the peers.')
+    has_output = (
+        output.summary,
+        Output('result', dict, _('Clients per peer and a balanced hash bucket assignment')),
+    )
+    msg_summary = _('%(primary)d of %(population)d clients on the primary, %(secondary)d on the secondary')
+    container_dn = container_dhcp_dn
+    dhcp_version = 4
+
+    takes_args = (
+        Str(
+            'cn?',
+            cli_name='fail_over_peer_name',
+            label=_('DHCP Fail Over Peer Name'),
+            doc=_('Fail over peer whose split or hash bucket assignment is simulated.')
+        ),
+    )
+
+    takes_options = (
+        Int(
+            'split?',
+            cli_name='split',
+            label=_('Split'),
+            doc=_('Number of hash buckets served by the primary.'),
+            minvalue=0,
+            maxvalue=256
+        ),
+        Str(
+            'hba?',
+            cli_name='hba',
+            label=_('Hash Bucket Assignment'),
+            doc=_('256 bit hash bucket assignment as 64 hex digits, optionally colon separated.')
+        ),
+        StrEnum(
+            'source?',
+            cli_name='source',
+            label=_('Source'),
+            doc=_('Take the clients from the DHCP hosts in LDAP or from the dhcpd lease file.'),
+            values=(u'hosts', u'leases'),
+            default=u'hosts',
+            autofill=True
+        ),
+        Flag(
+            'clientid?',
+            cli_name='clientid',
+            label=_('Client identifier'),
+            doc=_('Hash the client identifier the clients send (hardware type 1 followed by the MAC address) instead of the MAC address.')
+        ),
+    )
+
+    def execute(self, *args, **kw):
+
+        # The clients are hashed all at once into the 256 buckets of RFC
+        # 3074; the split and the assignments are then only sums over the
+        # bucket counts.
+
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        service_dn = DN(self.container_dn, dhcp_dn)
+
+        split = kw.get('split')
+        hba = kw.get('hba')
+        if args and args[0] and split is None and hba is None:
+            peer = ldap.get_entry(
+                DN(('cn', args[0]), service_dn),
+                ['dhcpfailoversplit', 'dhcphashbucketassignment']
+            )
+            if 'dhcphashbucketassignment' in peer:
+                try:
+                    hba = dhcp_hba_parse(peer['dhcphashbucketassignment'][0])
+                except (TypeError, ValueError):
+                    raise errors.ValidationError(
+                        name='dhcphashbucketassignment',
+                        error=_('stored value is neither 32 bytes nor 64 hex digits')
+                    )
+            elif 'dhcpfailoversplit' in peer:
+                try:
+                    split = int(peer['dhcpfailoversplit'][0])
+                except ValueError:
+                    raise errors.ValidationError(
+                        name='dhcpfailoversplit',
+                        error=_('must be an integer')
+                    )
+        if kw.get('hba') is not None:
+            try:
+                hba = dhcp_hba_parse(hba)
+            except (TypeError, ValueError):
+                raise errors.ValidationError(
+                    name='hba',
+                    error=_('must be 64 hex digits')
+                )
+        elif hba is None:
+            # dhcpd splits evenly unless told otherwise.
+            if split is None:
+                split = 128
+            hba = dhcp_hba_split(min(max(split, 0), 256))
+
+        if kw.get('source') == u'leases':
+            ingester = dhcp_lease_ingester(self.dhcp_version)
+            with ingester.lock:
+                macs = dhcp_loadb_macs(ingester.store.by_mac)
+        else:
+            filter = u'(&(objectclass=dhcphost)(dhcphwaddress=*))'
+            macs = dhcp_loadb_macs(
+                dhcp_normalize_macaddress(value.split()[-1])
+                for entry in dhcp_iter_entries(ldap, service_dn, ldap.SCOPE_SUBTREE, filter, ['dhcphwaddress'])
+                for value in entry['dhcphwaddress']
+            )
+
+        counts = dhcp_loadb_buckets(macs, '\x01' if kw.get('clientid') else '')
+        (primary, secondary) = dhcp_hba_load(hba, counts)
+        balanced = dhcp_hba_balance(counts)
+        (balanced_primary, balanced_secondary) = dhcp_hba_load(balanced, counts)
+
+        result = dict(
+            population=primary + secondary,
+            primary=primary,
+            secondary=secondary,
+            hba=dhcp_hba_format(hba),
+            recommendedhba=dhcp_hba_format(balanced),
+            recommendedprimary=balanced_primary,
+            recommendedsecondary=balanced_secondary,
+            buckets=counts,
+        )
+        if split is not None:
+            result['split'] = split
+
+        return dict(
+            summary=unicode(self.msg_summary % result),
+            result=result
+        )
+
+
 #### dhcpsharednetwork ###############################################################
 
 @register()
@@ -768,6 +1332,7 @@ class dhcppool(LDAPObject):
     label_singular = _('DHCP Pool')
 
     search_attributes = [ 'cn', 'dhcprange' ]
+    range_attribute = 'dhcprange'
 
     managed_permissions = {
         'System: Add DHCP Pools': {
@@ -862,47 +1427,19 @@ class dhcppool(LDAPObject):
     )
 
 
+    virtual_params = (
+        'permitknownclients',
+        'permitunknownclients',
+        'defaultleasetime',
+        'maxleasetime',
+        'domainname',
+        'domainnameservers',
+        'domainsearch',
+    )
+
     @staticmethod
     def extract_virtual_params(ldap, dn, entry_attrs, keys, options):
-
-        dhcpPermitList = entry_attrs.get('dhcppermitlist', [])
-
-        for item in dhcpPermitList:
-            if item.endswith(' known-clients'):
-                if item.startswith('allow '):
-                    entry_attrs['permitknownclients'] = True
-                elif item.startswith('deny '):
-                    entry_attrs['permitknownclients'] = False
-            if item.endswith(' unknown-clients'):
-                if item.startswith('allow '):
-                    entry_attrs['permitunknownclients'] = True
-                elif item.startswith('deny '):
-                    entry_attrs['permitunknownclients'] = False
-
-        dhcpStatements = entry_attrs.get('dhcpstatements', [])
-
-        for statement in dhcpStatements:
-            if statement.startswith('default-lease-time '):
-                (s, v) = statement.split(' ', 1)
-                entry_attrs['defaultleasetime'] = v
-            if statement.startswith('max-lease-time '):
-                (s, v) = statement.split(' ', 1)
-                entry_attrs['maxleasetime'] = v
-
-        dhcpOptions = entry_attrs.get('dhcpoption', [])
-
-        for option in dhcpOptions:
-            if option.startswith('domain-name '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['domainname'] = v.replace('"', '')
-            if option.startswith('domain-name-servers '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['domainnameservers'] = v.split(', ')
-            if option.startswith('domain-search '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['domainsearch'] = v.replace('"', '').split(', ')
-
-        return entry_attrs
+        return dhcp_extract_virtual_params(4, entry_attrs, dhcppool.virtual_params)
 
 
 @register()
@@ -918,69 +1455,16 @@ class dhcppool_add(LDAPCreate):
 
         entry_attrs['dhcppermitlist'] = ['allow unknown-clients', 'allow known-clients']
 
-        # If the dhcpService entry has dhcpstatements attributes that start with
-        # "default-lease-time" or "max-lease-time", grab them and copy their
-        # values into the new pool. This code could probably be a lot more
-        # efficient, but it works. The blame REALLY lies with the author of the
-        # DHCP LDAP schema for being so lazy.
-
-        hasDefaultLeaseTime = False
-        hasMaxLeaseTime = False
-
-        if 'dhcpstatements' in entry_attrs:
-            for statement in entry_attrs['dhcpstatements']:
-                if statement.startswith('default-lease-time'):
-                    hasDefaultLeaseTime = True
-                if statement.startswith('max-lease-time'):
-                    hasMaxLeaseTime = True
-
-        if hasDefaultLeaseTime and hasMaxLeaseTime:
-            return dn
-
-        config = ldap.get_entry(DN(container_dhcp_dn, dhcp_dn))
-
-        if 'dhcpStatements' in config:
-            configDHCPStatements = config['dhcpStatements']
-        else:
-            configDHCPStatements = []
-
-        defaultLeaseTime = None
-        maxLeaseTime = None
+        # Copy the lease times of the dhcpService entry into the new pool unless
+        # they were given explicitly.
 
-        for statement in configDHCPStatements:
-            if statement.startswith('default-lease-time'):
-                (s, v) = statement.split(" ")
-                defaultLeaseTime = v
-            if statement.startswith('max-lease-time'):
-                (s, v) = statement.split(" ")
-                maxLeaseTime = v
+        dhcp_inherit_lease_times(ldap, DN(self.obj.container_dn, dhcp_dn), entry_attrs)
 
-        if 'dhcpstatements' in entry_attrs:
-            entryDHCPStatements = entry_attrs['dhcpstatements']
-        else:
-            entryDHCPStatements = []
-
-        if defaultLeaseTime is not None:
-            foundStatement = False
-            for i, s in enumerate(entryDHCPStatements):
-                if s.startswith('default-lease-time'):
-                    foundStatement = True
-                    entryDHCPStatements[i] = 'default-lease-time {0}'.format(defaultLeaseTime)
-                    break
-            if foundStatement is False:
-                entryDHCPStatements.append('default-lease-time {0}'.format(defaultLeaseTime))
-
-        if maxLeaseTime is not None:
-            foundStatement = False
-            for i, s in enumerate(entryDHCPStatements):
-                if s.startswith('max-lease-time'):
-                    foundStatement = True
-                    maxDHCPStatements[i] = 'max-lease-time {0}'.format(maxLeaseTime)
-                    break
-            if foundStatement is False:
-                entryDHCPStatements.append('max-lease-time {0}'.format(maxLeaseTime))
-
-        entry_attrs['dhcpstatements'] = entryDHCPStatements
+        dhcp_check_range_overlaps(
+            ldap, dn, self.obj.range_attribute,
+            entry_attrs.get(self.obj.range_attribute, []),
+            DN(self.obj.container_dn, dhcp_dn)
+        )
 
         return dn
 
@@ -994,6 +1478,17 @@ class dhcppool_find(LDAPSearch):
     )
 
 
+    def pre_callback(self, ldap, filter, attrs_list, base_dn, scope, *args, **options):
+        assert isinstance(base_dn, DN)
+        dhcp_find_virtual_attrs(self.obj, attrs_list, options)
+        return (filter, base_dn, scope)
+
+
+    def post_callback(self, ldap, entries, truncated, *args, **options):
+        dhcp_find_extract_virtual_params(self.obj, ldap, entries, options)
+        return truncated
+
+
 @register()
 class dhcppool_show(LDAPRetrieve):
     __doc__ = _('Display a DHCP pool.')
@@ -1014,38 +1509,14 @@ class dhcppool_mod(LDAPUpdate):
     def pre_callback(self, ldap, dn, entry_attrs, attrs_list, *keys, **options):
         assert isinstance(dn, DN)
 
-        entry = ldap.get_entry(dn)
-
-
-        if 'dhcppermitlist' in entry_attrs:
-            dhcpPermitList = entry_attrs.get('dhcppermitlist', [])
-        else:
-            dhcpPermitList = entry.get('dhcppermitlist', [])
-
-        dhcpPermitList = dhcp_modify_permitknownclients( dhcp_version, options, dhcpPermitList )
-        dhcpPermitList = dhcp_modify_permitunknownclients( dhcp_version, options, dhcpPermitList )
-        
-        entry_attrs['dhcppermitlist'] = dhcpPermitList
-
-        if 'dhcpstatements' in entry_attrs:
-            dhcpStatements = entry_attrs.get('dhcpstatements', [])
-        else:
-            dhcpStatements = entry.get('dhcpstatements', [])
-
-        if 'dhcpoption' in entry_attrs:
-            dhcpOptions = entry_attrs.get('dhcpoption', [])
-        else:
-            dhcpOptions = entry.get('dhcpoption', [])
-
-        dhcp_modify_domainname( dhcp_version, options, dhcpOptions, dhcpStatements )
-        dhcp_modify_domainserver( dhcp_version, options, dhcpOptions )
-        dhcp_modify_domainsearch( dhcp_version, options, dhcpOptions )
-        dhcp_modify_defaultleasetime( dhcp_version, options, dhcpStatements )
-        dhcp_modify_maxleasetime( dhcp_version, options, dhcpStatements )
+        if self.obj.range_attribute in entry_attrs:
+            dhcp_check_range_overlaps(
+                ldap, dn, self.obj.range_attribute,
+                entry_attrs.get(self.obj.range_attribute, []),
+                DN(self.obj.container_dn, dhcp_dn)
+            )
 
-
-        entry_attrs['dhcpstatements'] = dhcpStatements
-        entry_attrs['dhcpoption'] = dhcpOptions
+        dhcp_mod_virtual_params(ldap, dn, entry_attrs, options, dhcp_version, self.obj.virtual_params)
 
         return dn
 
@@ -1067,6 +1538,7 @@ class dhcppool_is_valid(Command):
     NO_CLI = True
     has_output = output.standard_boolean
     msg_summary = _('"%(value)s"')
+    container_dn = container_dhcp_dn
 
     takes_args = (
         Str(
@@ -1088,38 +1560,80 @@ class dhcppool_is_valid(Command):
         # Run some basic sanity checks on a DHCP pool IP range to make sure it
         # fits into its parent DHCP subnet. This method looks up the parent
         # subnet given the necessary LDAP keys because that's what works best
-        # with the GUI.
+        # with the GUI. The ranges are compared as integers, so this costs the
+        # same for a /64 as for a /24.
 
         dhcpsubnetcn = args[0]
-        dhcprange = args[1][0]
+        dhcprange = args[1]
 
-        ldap = self.api.Backend.ldap2
-        dn = DN(
-            ('cn', dhcpsubnetcn),
-            container_dhcp_dn,
-            dhcp_dn
-        )
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        service_dn = DN(self.container_dn, dhcp_dn)
         try:
-            entry = ldap.get_entry(dn)
-        except:
+            entry = ldap.get_entry(DN(('cn', dhcpsubnetcn), service_dn), ['cn', 'dhcpnetmask'])
+        except errors.NotFound:
             return dict(result=False, value=u'No such subnet.')
 
-        subnetIP = IPNetwork("{0}/{1}".format(entry['cn'][0], int(entry['dhcpNetMask'][0])))
+        (message, size) = dhcp_check_pool_ranges(ldap, entry, dhcprange, service_dn)
+        if message is not None:
+            return dict(result=False, value=message)
+
+        return dict(result=True, value=u'Valid range of {0} addresses.'.format(size))
+
+
+@register()
+class dhcppool_utilization(Command):
+    __doc__ = _('Report how many addresses of each DHCP pool are in use, from the dhcpd lease file of this server.')
+    has_output = (
+        output.summary,
+        ListOfEntries('result'),
+        Output('count', int, _('Number of pools')),
+    )
+    msg_summary = ngettext(
+        '%(count)d pool',
+        '%(count)d pools', 0
+    )
+    container_dn = container_dhcp_dn
+    dhcp_version = 4
+
+    takes_args = (
+        Str(
+            'dhcpsubnetcn?',
+            cli_name='subnet',
+            label=_('Subnet'),
+            doc=_('Only report the pools of this DHCP subnet.')
+        ),
+    )
+
+    def execute(self, *args, **kw):
 
-        (rangeStart, rangeEnd) = dhcprange.split(" ")
-        rangeStartIP = IPNetwork("{0}/32".format(rangeStart))
-        rangeEndIP = IPNetwork("{0}/32".format(rangeEnd))
+        # The lease file is followed by a per-process ingester that only
+        # parses what dhcpd appended since the last call, and every lease is
+        # mapped to its pool through the ranges of the address index.
 
-        if rangeStartIP > rangeEndIP:
-            return dict(result=False, value=u'First IP must come before last IP!')
+        ingester = dhcp_lease_ingester(self.dhcp_version)
 
-        if rangeStartIP < subnetIP[0] or rangeStartIP > subnetIP[-1]:
-            return dict(result=False, value=u'{0} is outside parent subnet {1}. Addresses in this pool must come from the range {2}-{3}.'.format(rangeStartIP.ip, subnetIP.cidr, subnetIP[0], subnetIP[-1]))
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        index = dhcp_address_index(ldap, DN(self.container_dn, dhcp_dn))
+        with ingester.lock:
+            rows = dhcp_pool_utilization(index, self.dhcp_version, ingester.store)
 
-        if rangeEndIP < subnetIP[0] or rangeEndIP > subnetIP[-1]:
-            return dict(result=False, value=u'{0} is outside parent subnet {1}. Addresses in this pool must come from the range {2}-{3}.'.format(rangeEndIP.ip, subnetIP.cidr, subnetIP[0], subnetIP[-1]))
+        result = []
+        for row in sorted(rows.values(), key=lambda row: (row['subnet']['network'].first, row['pool'].dn)):
+            if args and args[0] and row['subnet']['entry']['cn'][0] != args[0]:
+                continue
+            result.append(dict(
+                dn=unicode(row['pool'].dn),
+                cn=row['pool']['cn'],
+                subnet=unicode(row['subnet']['network'].cidr),
+                dhcprange=row['ranges'],
+                size=row['size'],
+                used=row['used'],
+                free=row['free'],
+                expired=row['expired'],
+                abandoned=row['abandoned'],
+            ))
 
-        return dict(result=True, value=u'Valid IP range.')
+        return dict(result=result, count=len(result))
 
 
 #### dhcpgroup #################################################################
@@ -1259,50 +1773,20 @@ class dhcpgroup(LDAPObject):
     )
 
 
+    virtual_params = (
+        'permitknownclients',
+        'permitunknownclients',
+        'defaultleasetime',
+        'maxleasetime',
+        'domainname',
+        'domainnameservers',
+        'domainsearch',
+        'router',
+    )
+
     @staticmethod
     def extract_virtual_params(ldap, dn, entry_attrs, keys, options):
-
-        dhcpPermitList = entry_attrs.get('dhcppermitlist', [])
-
-        for item in dhcpPermitList:
-            if item.endswith(' known-clients'):
-                if item.startswith('allow '):
-                    entry_attrs['permitknownclients'] = True
-                elif item.startswith('deny '):
-                    entry_attrs['permitknownclients'] = False
-            if item.endswith(' unknown-clients'):
-                if item.startswith('allow '):
-                    entry_attrs['permitunknownclients'] = True
-                elif item.startswith('deny '):
-                    entry_attrs['permitunknownclients'] = False
-
-        dhcpStatements = entry_attrs.get('dhcpstatements', [])
-
-        for statement in dhcpStatements:
-            if statement.startswith('default-lease-time '):
-                (s, v) = statement.split(' ', 1)
-                entry_attrs['defaultleasetime'] = v
-            if statement.startswith('max-lease-time '):
-                (s, v) = statement.split(' ', 1)
-                entry_attrs['maxleasetime'] = v
-
-        dhcpOptions = entry_attrs.get('dhcpoption', [])
-
-        for option in dhcpOptions:
-            if option.startswith('domain-name '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['domainname'] = v.replace('"', '')
-            if option.startswith('domain-name-servers '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['domainnameservers'] = v.split(', ')
-            if option.startswith('domain-search '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['domainsearch'] = v.replace('"', '').split(', ')
-            if option.startswith('routers '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['router'] = v
-
-        return entry_attrs
+        return dhcp_extract_virtual_params(4, entry_attrs, dhcpgroup.virtual_params)
 
 
 @register()
@@ -1318,110 +1802,18 @@ class dhcpgroup_add(LDAPCreate):
 
         entry_attrs['dhcppermitlist'] = ['allow unknown-clients', 'allow known-clients']
 
-        # If the dhcpService entry has dhcpstatements attributes that start with
-        # "default-lease-time" or "max-lease-time", grab them and copy their
-        # values into the new group. This code could probably be a lot more
-        # efficient, but it works. The blame REALLY lies with the author of the
-        # DHCP LDAP schema for being so lazy.
+        # Copy the lease times of the dhcpService entry into the new group unless
+        # they were given explicitly.
 
-        hasDefaultLeaseTime = False
-        hasMaxLeaseTime = False
+        dhcp_inherit_lease_times(ldap, DN(self.obj.container_dn, dhcp_dn), entry_attrs)
 
-        if 'dhcpstatements' in entry_attrs:
-            for statement in entry_attrs['dhcpstatements']:
-                if statement.startswith('default-lease-time'):
-                    hasDefaultLeaseTime = True
-                if statement.startswith('max-lease-time'):
-                    hasMaxLeaseTime = True
-
-        if hasDefaultLeaseTime and hasMaxLeaseTime:
-            return dn
-
-        config = ldap.get_entry(DN(container_dhcp_dn, dhcp_dn))
-
-        if 'dhcpStatements' in config:
-            configDHCPStatements = config['dhcpStatements']
-        else:
-            configDHCPStatements = []
+        # Write the virtual options given for the new group the way dhcpgroup_mod
+        # does.
 
-        defaultLeaseTime = None
-        maxLeaseTime = None
-
-        for statement in configDHCPStatements:
-            if statement.startswith('default-lease-time'):
-                (s, v) = statement.split(" ")
-                defaultLeaseTime = v
-            if statement.startswith('max-lease-time'):
-                (s, v) = statement.split(" ")
-                maxLeaseTime = v
-
-        if 'dhcpstatements' in entry_attrs:
-            entryDHCPStatements = entry_attrs['dhcpstatements']
-        else:
-            entryDHCPStatements = []
-
-        if defaultLeaseTime is not None:
-            foundStatement = False
-            for i, s in enumerate(entryDHCPStatements):
-                if s.startswith('default-lease-time'):
-                    foundStatement = True
-                    entryDHCPStatements[i] = 'default-lease-time {0}'.format(defaultLeaseTime)
-                    break
-            if foundStatement is False:
-                entryDHCPStatements.append('default-lease-time {0}'.format(defaultLeaseTime))
-
-        if maxLeaseTime is not None:
-            foundStatement = False
-            for i, s in enumerate(entryDHCPStatements):
-                if s.startswith('max-lease-time'):
-                    foundStatement = True
-                    maxDHCPStatements[i] = 'max-lease-time {0}'.format(maxLeaseTime)
-                    break
-            if foundStatement is False:
-                entryDHCPStatements.append('max-lease-time {0}'.format(maxLeaseTime))
-
-        entry_attrs['dhcpstatements'] = entryDHCPStatements
-
-
-        if 'dhcpoption' in entry_attrs:
-            dhcpOptions = entry_attrs.get('dhcpoption', [])
-        else:
-            dhcpOptions = entry.get('dhcpoption', [])
-
-        if 'domainname' in options:
-            option = 'domain-name "{0}"'.format(options['domainname'])
-            foundOption = False
-            for i, s in enumerate(dhcpOptions):
-                if s.startswith('domain-name '):
-                    foundOption = True
-                    dhcpOptions[i] = option
-                    break
-            if not foundOption:
-                dhcpOptions.append(option)
-                
-        if 'domainsearch' in options:
-            option = 'domain-search ' + ', '.join('"' + s + '"' for s in options['domainsearch'])
-            foundOption = False
-            for i, s in enumerate(dhcpOptions):
-                if s.startswith('domain-search '):
-                    foundOption = True
-                    dhcpOptions[i] = option
-                    break
-            if not foundOption:
-                dhcpOptions.append(option)
-
-        if 'router' in options:
-            option = 'routers {0}'.format(options['router'])
-            foundOption = False
-            for i, s in enumerate(dhcpOptions):
-                if s.startswith('routers '):
-                    foundOption = True
-                    dhcpOptions[i] = option
-                    break
-            if not foundOption:
-                dhcpOptions.append(option)
-                
-        entry_attrs['dhcpoption'] = dhcpOptions
+        updates = dhcp_virtual_updates(dhcp_version, options, ('domainname', 'domainsearch', 'router'))
+        values = dict((attr, list(entry_attrs.get(attr) or [])) for (attr, keyword, value) in updates)
+        dhcp_apply_virtual_updates(updates, values)
+        entry_attrs.update(values)
 
         return dn
 
@@ -1435,6 +1827,17 @@ class dhcpgroup_find(LDAPSearch):
     )
 
 
+    def pre_callback(self, ldap, filter, attrs_list, base_dn, scope, *args, **options):
+        assert isinstance(base_dn, DN)
+        dhcp_find_virtual_attrs(self.obj, attrs_list, options)
+        return (filter, base_dn, scope)
+
+
+    def post_callback(self, ldap, entries, truncated, *args, **options):
+        dhcp_find_extract_virtual_params(self.obj, ldap, entries, options)
+        return truncated
+
+
 @register()
 class dhcpgroup_show(LDAPRetrieve):
     __doc__ = _('Display a DHCP group.')
@@ -1455,36 +1858,7 @@ class dhcpgroup_mod(LDAPUpdate):
     def pre_callback(self, ldap, dn, entry_attrs, attrs_list, *keys, **options):
         assert isinstance(dn, DN)
 
-        entry = ldap.get_entry(dn)
-
-        if 'dhcppermitlist' in entry_attrs:
-            dhcpPermitList = entry_attrs.get('dhcppermitlist', [])
-        else:
-            dhcpPermitList = entry.get('dhcppermitlist', [])
-        
-        dhcp_modify_permitknownclients( dhcp_version, options, dhcpPermitList )
-        dhcp_modify_permitunknownclients( dhcp_version, options, dhcpPermitList )
-        entry_attrs['dhcppermitlist'] = dhcpPermitList
-
-        if 'dhcpstatements' in entry_attrs:
-            dhcpStatements = entry_attrs.get('dhcpstatements', [])
-        else:
-            dhcpStatements = entry.get('dhcpstatements', [])
-
-        if 'dhcpoption' in entry_attrs:
-            dhcpOptions = entry_attrs.get('dhcpoption', [])
-        else:
-            dhcpOptions = entry.get('dhcpoption', [])
-
-        dhcp_modify_router( dhcp_version, options, dhcpOptions )
-        dhcp_modify_domainname( dhcp_version, options, dhcpOptions, dhcpStatements )
-        dhcp_modify_domainserver( dhcp_version, options, dhcpOptions )
-        dhcp_modify_domainsearch( dhcp_version, options, dhcpOptions )
-        dhcp_modify_defaultleasetime( dhcp_version, options, dhcpStatements )
-        dhcp_modify_maxleasetime( dhcp_version, options, dhcpStatements )
-
-        entry_attrs['dhcpStatements'] = dhcpStatements
-        entry_attrs['dhcpoption'] = dhcpOptions
+        dhcp_mod_virtual_params(ldap, dn, entry_attrs, options, dhcp_version, self.obj.virtual_params)
 
         return dn
 
@@ -1751,6 +2125,8 @@ class dhcpserver_add(LDAPCreate):
         except errors.EmptyModlist:
             pass
 
+        dhcp_service_invalidate(dhcpservice.dn)
+
         return dn
 
 
@@ -1798,6 +2174,8 @@ class dhcpserver_del(LDAPDelete):
         except errors.EmptyModlist:
             pass
 
+        dhcp_service_invalidate(dhcpservice.dn)
+
         return dn
 
 #### dhcphost ###############################################################
@@ -1826,7 +2204,7 @@ class dhcphost(LDAPObject):
             'ipapermtargetfilter': ['(objectclass=dhcphost)'],
             'ipapermdefaultattr': {
                 'cn', 'objectclass',
-                'dhcphwaddress',
+                'dhcphwaddress', 'dhcphostownerdn',
                 'dhcpstatements', 'dhcpoption', 'dhcpcomments'
             },
             'default_privileges': {'DHCP Administrators', 'Host Administrators'},
@@ -1896,34 +2274,15 @@ class dhcphost(LDAPObject):
         ),
     )
 
+    virtual_params = (
+        'ipaddress',
+        'hostname',
+        'macaddress',
+    )
+
     @staticmethod
     def extract_virtual_params(ldap, dn, entry_attrs, keys, options):
-
-        dhcpStatements = entry_attrs.get('dhcpstatements', [])
-
-        for statements in dhcpStatements:
-            if statements.startswith('fixed-address '):
-                (o, v) = statements.split(' ', 1)
-                entry_attrs['ipaddress'] = v
-            elif statements.startswith('ddns-hostname '):
-                (o, v) = statements.split(' ', 1)
-                entry_attrs['hostname'] = v.replace('"', '')
-
-        dhcpHWaddress = entry_attrs.get('dhcphwaddress', [])
-
-        for hwaddress in dhcpHWaddress:
-            if hwaddress.startswith('ethernet '):
-                (o, v) = hwaddress.split(' ', 1)
-                entry_attrs['macaddress'] = v.replace('"', '')
-
-        dhcpOptions = entry_attrs.get('dhcpoption', [])
-
-        for option in dhcpOptions:
-            if option.startswith('host-name '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['hostname'] = v.replace('"', '')
-
-        return entry_attrs
+        return dhcp_extract_virtual_params(4, entry_attrs, dhcphost.virtual_params)
 
 
 @register()
@@ -1941,6 +2300,50 @@ class dhcphost_find(LDAPSearch):
         '%(count)d DHCP hosts matched', 0
     )
 
+    has_output = output.standard_list_of_entries + (
+        Output(
+            'cursor',
+            (unicode, type(None)),
+            _('Cursor of the next page, None after the last page')
+        ),
+    )
+
+    takes_options = (
+        Str(
+            'cursor?',
+            cli_name='cursor',
+            label=_('Cursor'),
+            doc=_('Return the page that follows this cursor.')
+        ),
+        Int(
+            'pagesize?',
+            cli_name='pagesize',
+            label=_('Page size'),
+            doc=_('Return the hosts one page of this size at a time, sorted by name.'),
+            minvalue=1
+        ),
+    )
+
+
+    def execute(self, *args, **options):
+        if dhcp_find_paged(options) and options.get('sizelimit') is None:
+            options['sizelimit'] = options.get('pagesize') or dhcp_find_page_size
+        result = super(dhcphost_find, self).execute(*args, **options)
+        result['cursor'] = dhcp_find_page_cursor(result['result'], options)
+        return result
+
+
+    def pre_callback(self, ldap, filter, attrs_list, base_dn, scope, *args, **options):
+        assert isinstance(base_dn, DN)
+        dhcp_find_virtual_attrs(self.obj, attrs_list, options)
+        filter = dhcp_find_page_filter(ldap, filter, base_dn, scope, options)
+        return (filter, base_dn, scope)
+
+
+    def post_callback(self, ldap, entries, truncated, *args, **options):
+        dhcp_find_extract_virtual_params(self.obj, ldap, entries, options)
+        return truncated
+
 
 @register()
 class dhcphost_show(LDAPRetrieve):
@@ -2013,6 +2416,13 @@ class dhcphost_mod(LDAPUpdate):
     __doc__ = _('Modify a DHCP host.')
     msg_summary = _('Modified a DHCP host.')
 
+    def pre_callback(self, ldap, dn, entry_attrs, attrs_list, *keys, **options):
+        assert isinstance(dn, DN)
+
+        dhcp_mod_virtual_params(ldap, dn, entry_attrs, options, dhcp_version, self.obj.virtual_params)
+
+        return dn
+
     def post_callback(self, ldap, dn, entry_attrs, *keys, **options):
         assert isinstance(dn, DN)
         entry_attrs = dhcphost.extract_virtual_params(ldap, dn, entry_attrs, keys, options)
@@ -2024,6 +2434,76 @@ class dhcphost_del(LDAPDelete):
     msg_summary = _('Deleted DHCP host "%(value)s"')
 
 
+@register()
+class dhcphost_effective(Command):
+    __doc__ = _('Show the statements, options and permits in effect for a DHCP host and the scope each comes from.')
+    has_output = dhcpsubnet_effective.has_output
+    msg_summary = dhcpsubnet_effective.msg_summary
+    container_dn = container_dhcp_dn
+
+    takes_args = (
+        Str(
+            'cn',
+            cli_name='cn',
+            label=_('Canonical Name'),
+            doc=_('Canonical name of the DHCP host.')
+        ),
+    )
+
+    def execute(self, *args, **kw):
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        service_dn = DN(self.container_dn, dhcp_dn)
+        filter = ldap.combine_filters([
+            ldap.make_filter_from_attr('objectclass', 'dhcphost'),
+            ldap.make_filter_from_attr('cn', args[0]),
+        ], ldap.MATCH_ALL)
+        try:
+            entries = ldap.get_entries(service_dn, ldap.SCOPE_SUBTREE, filter, dhcp_effective_attrs)
+        except errors.NotFound:
+            raise errors.NotFound(
+                reason=_('DHCP host "%(cn)s" not found') % dict(cn=args[0])
+            )
+        # Host names are only unique within their group or subnet.
+        if len(entries) > 1:
+            raise errors.SingleMatchExpected(found=len(entries))
+        return dhcp_effective_result(ldap, service_dn, entries[0])
+
+
+def dhcphost_cn(hostname, macaddress):
+    return u'{hostname}-{macaddress}'.format(
+        hostname=hostname,
+        macaddress=dhcp_normalize_macaddress(macaddress).replace(':', '')
+    )
+
+
+def dhcphost_owner_dn(fqdn):
+    return DN(('fqdn', fqdn), api.env.container_host, api.env.basedn)
+
+
+def dhcphost_entry_attrs(hostname, macaddress, fixedaddress=None, owner=None):
+    # The attributes of a dhcpHost generated for an IPA host. Without an
+    # explicit address the host name is used, so dhcpd resolves it through DNS.
+    # owner is the DN of the IPA host, stored so the host hooks can find their
+    # entries with an indexed equality lookup.
+    macaddress = dhcp_normalize_macaddress(macaddress)
+    if fixedaddress is None:
+        fixedaddress = hostname
+    attrs = {
+        'objectclass': ['dhcphost', 'top'],
+        'cn': [dhcphost_cn(hostname, macaddress)],
+        'dhcphwaddress': [u'ethernet {0}'.format(macaddress)],
+        'dhcpstatements': [
+            u'fixed-address {0}'.format(fixedaddress),
+            u'ddns-hostname "{0}"'.format(hostname)
+        ],
+        'dhcpoption': [u'host-name "{0}"'.format(hostname)],
+    }
+    if owner is not None:
+        attrs['objectclass'].append('dhcphostowner')
+        attrs['dhcphostownerdn'] = [owner]
+    return attrs
+
+
 @register()
 class dhcphost_add_cmd(Command):
     has_output = output.standard_entry
@@ -2048,25 +2528,51 @@ class dhcphost_add_cmd(Command):
             doc=_("MAC address.")
         ),
         Str(
-            'ipaddress',
+            'ipaddress?',
             cli_name='ipaddress',
             label=_('IP Address'),
             doc=_("Hosts IP Address.")
         )
     )
 
+    takes_options = (
+        Str(
+            'dhcpsubnetcn?',
+            cli_name='subnet',
+            label=_('Subnet'),
+            doc=_('Give the host the next free address of this DHCP subnet.')
+        ),
+    )
+
     def execute(self, *args, **kw):
         hostname = args[0]
         macaddress = args[1]
-        cn = u'{hostname}-{macaddress}'.format(
-            hostname=hostname,
-            macaddress=macaddress.replace(':', '')
-        )
+        ipaddress = args[2]
+
+        # Without an explicit address the host gets the next free address of
+        # the given subnet, or falls back to its host name.
+
+        if ipaddress is None and kw.get('dhcpsubnetcn'):
+            ldap = dhcp_ldap(self.api.Backend.ldap2)
+            service_dn = DN(container_dhcp_dn, dhcp_dn)
+            free = dhcp_free_addresses(
+                ldap, DN(('cn', kw['dhcpsubnetcn']), service_dn), service_dn, 1
+            )
+            if not free:
+                raise errors.NotFound(
+                    reason=_('no free address left in DHCP subnet "%(subnet)s"') % dict(
+                        subnet=kw['dhcpsubnetcn']
+                    )
+                )
+            ipaddress = unicode(free[0])
+
+        attrs = dhcphost_entry_attrs(hostname, macaddress, ipaddress)
+        cn = attrs['cn'][0]
         result = api.Command['dhcphost_add_dhcpschema'](
             cn,
-            dhcphwaddress=u'ethernet {0}'.format(macaddress),
-            dhcpstatements=[u'fixed-address {0}'.format(hostname), u'ddnshostname "{0}"'.format(hostname)],
-            dhcpoption=[u'host-name "{0}"'.format(hostname)]
+            dhcphwaddress=attrs['dhcphwaddress'][0],
+            dhcpstatements=attrs['dhcpstatements'],
+            dhcpoption=attrs['dhcpoption']
         )
         return dict(result=result['result'], value=cn)
 
@@ -2098,13 +2604,222 @@ class dhcphost_del_cmd(Command):
     def execute(self, *args, **kw):
         hostname = args[0]
         macaddress = args[1]
-        cn = u'{hostname}-{macaddress}'.format(
-            hostname=hostname,
-            macaddress=macaddress.replace(':', '')
-        )
+        cn = dhcphost_cn(hostname, macaddress)
         result = api.Command['dhcphost_del_dhcpschema'](cn)
         return dict(result=result['result'], value=cn)
 
+def dhcphost_import_rows(content, format=None):
+
+    # Yield (line number, row, error) for every record of an import file.
+    # CSV files carry hostname, MAC address, IP address and optionally the
+    # subnet and group columns, with or without a header line; JSON lines
+    # files carry one object per line with the same keys. The File argument
+    # delivers the whole upload in the request, so the content is held in
+    # memory; only the parsed rows are produced one at a time, which keeps
+    # the LDAP side bounded by the chunk size. Callers with files too large
+    # for one request split them and import the parts separately.
+
+    columns = ('hostname', 'macaddress', 'ipaddress', 'subnet', 'group')
+    header = None
+    first = True
+
+    for (lineno, line) in enumerate(io.StringIO(content), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        # A header can only be the first line that is not blank or a comment.
+        (first, is_first) = (False, first)
+
+        if format is None:
+            format = u'json' if line.startswith('{') else u'csv'
+
+        if format == u'json':
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield (lineno, None, unicode(e))
+                continue
+            if not isinstance(record, dict):
+                yield (lineno, None, u'expected a JSON object')
+                continue
+            row = dict((k, record.get(k)) for k in columns)
+        else:
+            fields = next(csv.reader([line.encode('utf-8')]))
+            fields = [f.decode('utf-8').strip() for f in fields]
+            if is_first and 'macaddress' in [f.lower() for f in fields]:
+                header = [f.lower() for f in fields]
+                continue
+            row = dict(zip(header or columns, fields))
+
+        for k in columns:
+            if row.get(k) is not None:
+                row[k] = unicode(row[k]).strip() or None
+
+        if not row.get('hostname') or not row.get('macaddress') or not row.get('ipaddress'):
+            yield (lineno, None, u'hostname, macaddress and ipaddress are required')
+            continue
+        if not re.match('^([a-fA-F0-9]{2}[:|\-]?){5}[a-fA-F0-9]{2}$', row['macaddress']):
+            yield (lineno, None, u'invalid MAC address {0}'.format(row['macaddress']))
+            continue
+        try:
+            row['ipaddress'] = unicode(IPAddress(row['ipaddress']))
+        except (AddrFormatError, ValueError):
+            yield (lineno, None, u'invalid IP address {0}'.format(row['ipaddress']))
+            continue
+        row['macaddress'] = dhcp_normalize_macaddress(row['macaddress'])
+
+        yield (lineno, row, None)
+
+
+@register()
+class dhcphost_import(Command):
+    __doc__ = _('Create DHCP hosts from a CSV or JSON lines file.')
+    msg_summary = _('Created %(value)s DHCP host(s)')
+
+    has_output = (
+        output.summary,
+        Output('result', dict, _('Created, skipped and conflicting rows')),
+        output.value,
+    )
+
+    takes_args = (
+        File(
+            'file',
+            cli_name='file',
+            label=_('File'),
+            doc=_('CSV or JSON lines file with hostname, macaddress, '
+                  'ipaddress and optional subnet and group columns.')
+        ),
+    )
+
+    takes_options = (
+        StrEnum(
+            'format?',
+            cli_name='format',
+            label=_('Format'),
+            doc=_('File format, detected from the first record by default.'),
+            values=(u'csv', u'json')
+        ),
+        Int(
+            'chunksize?',
+            cli_name='chunksize',
+            label=_('Chunk size'),
+            doc=_('Number of rows checked and written per LDAP batch.'),
+            minvalue=1,
+            maxvalue=5000,
+            default=500
+        ),
+    )
+
+    # Only the first messages are returned, so a broken file does not blow up
+    # the response.
+    max_messages = 100
+
+    def execute(self, *args, **options):
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        container = DN(container_dhcp_dn, dhcp_dn)
+
+        result = dict(created=0, skipped=0, conflicting=0, messages=[])
+
+        def message(lineno, text):
+            if len(result['messages']) < self.max_messages:
+                result['messages'].append(u'line {0}: {1}'.format(lineno, text))
+
+        def parent_dn(row):
+            dn = container
+            if row.get('subnet'):
+                dn = DN(('cn', row['subnet']), dn)
+            if row.get('group'):
+                dn = DN(('cn', row['group']), dn)
+            return dn
+
+        def write_chunk(chunk):
+            # One search finds every entry in the directory that clashes with
+            # the chunk by name, MAC address or any of its fixed addresses.
+            filter = ldap.make_filter(
+                {
+                    'cn': [dhcphost_cn(r['hostname'], r['macaddress']) for (n, r) in chunk],
+                    'dhcphwaddress': [u'ethernet {0}'.format(r['macaddress']) for (n, r) in chunk],
+                },
+                rules=ldap.MATCH_ANY
+            )
+            filter = ldap.combine_filters(
+                [filter] + [dhcp_fixed_address_filter(r['ipaddress']) for (n, r) in chunk],
+                ldap.MATCH_ANY
+            )
+            filter = ldap.combine_filters(
+                [ldap.make_filter({'objectclass': 'dhcphost'}), filter],
+                ldap.MATCH_ALL
+            )
+            entries = []
+            try:
+                entries = ldap.get_entries(
+                    container,
+                    ldap.SCOPE_SUBTREE,
+                    filter,
+                    ['cn', 'dhcphwaddress', 'dhcpstatements']
+                )
+            except errors.NotFound:
+                pass
+
+            names = set()
+            macaddresses = set()
+            ipaddresses = set()
+            for entry in entries:
+                names.add(entry['cn'][0].lower())
+                for hwaddress in entry.get('dhcphwaddress', []):
+                    macaddresses.add(hwaddress.replace('ethernet ', '').upper())
+                ipaddresses.update(dhcp_fixed_addresses(entry))
+
+            for (lineno, row) in chunk:
+                attrs = dhcphost_entry_attrs(row['hostname'], row['macaddress'], row['ipaddress'])
+                cn = attrs['cn'][0]
+                if cn.lower() in names:
+                    result['skipped'] += 1
+                    continue
+                if row['macaddress'] in macaddresses:
+                    result['conflicting'] += 1
+                    message(lineno, u'MAC address {0} is already reserved'.format(row['macaddress']))
+                    continue
+                if row['ipaddress'] in ipaddresses:
+                    result['conflicting'] += 1
+                    message(lineno, u'IP address {0} is already reserved'.format(row['ipaddress']))
+                    continue
+                try:
+                    ldap.add_entry(ldap.make_entry(DN(('cn', cn), parent_dn(row)), attrs))
+                except errors.NotFound:
+                    result['skipped'] += 1
+                    message(lineno, u'no such subnet or group')
+                    continue
+                except errors.DuplicateEntry:
+                    result['skipped'] += 1
+                    continue
+                names.add(cn.lower())
+                macaddresses.add(row['macaddress'])
+                ipaddresses.add(row['ipaddress'])
+                result['created'] += 1
+
+        chunk = []
+        for (lineno, row, error) in dhcphost_import_rows(args[0], options.get('format')):
+            if error is not None:
+                result['skipped'] += 1
+                message(lineno, error)
+                continue
+            chunk.append((lineno, row))
+            if len(chunk) >= options['chunksize']:
+                write_chunk(chunk)
+                chunk = []
+        if chunk:
+            write_chunk(chunk)
+
+        value = unicode(result['created'])
+        return dict(
+            summary=unicode(self.msg_summary % dict(value=value)),
+            result=result,
+            value=value
+        )
+
+
 #### dhcphost_group ###############################################################
 @register()
 class dhcpgrouphost(dhcphost):
@@ -2287,13 +3002,182 @@ class dhcppoolhost_del(dhcphost_del):
 from . import host
 
 
+def dhcphost_adopt(ldap, entry, owner):
+    # Link a dhcpHost generated before dhcpHostOwnerDN existed to its host.
+    entry['objectclass'].append('dhcphostowner')
+    entry['dhcphostownerdn'] = [owner]
+    ldap.update_entry(entry)
+
+
+def dhcphost_reconcile(ldap, hosts):
+
+    # Bring the generated dhcpHost entries of one or more IPA hosts in line
+    # with their MAC addresses. hosts maps each host FQDN to the MAC addresses
+    # it should have. The existing entries of all the hosts are read with a
+    # single equality search on dhcpHostOwnerDN, the MAC set differences are
+    # computed once and the resulting deletes and adds are written straight
+    # to LDAP instead of going through a dhcphost_* command per MAC. Returns
+    # a per-host summary of the MAC addresses that were added and deleted.
+    #
+    # Entries generated before dhcpHostOwnerDN existed carry no owner. They
+    # are matched by their generated name, <fqdn>-<MAC without colons>, and
+    # handled like owned ones: deleted when their MAC is gone, and adopted
+    # by linking them to their host when it is still wanted.
+
+    container = DN(container_dhcp_dn, dhcp_dn)
+
+    owners = {}
+    wanted = {}
+    for fqdn, macaddresses in hosts.items():
+        owners[dhcphost_owner_dn(fqdn)] = fqdn
+        wanted[fqdn] = dict(
+            (dhcphost_cn(fqdn, mac), dhcp_normalize_macaddress(mac))
+            for mac in macaddresses
+        )
+
+    summary = dict((fqdn, {'added': [], 'deleted': []}) for fqdn in wanted)
+    if not wanted:
+        return summary
+
+    unowned = ldap.combine_filters(
+        [
+            u'(!(dhcphostownerdn=*))',
+            ldap.combine_filters(
+                [
+                    ldap.make_filter_from_attr(
+                        'cn', u'{0}-'.format(fqdn),
+                        exact=False, leading_wildcard=False
+                    )
+                    for fqdn in wanted
+                ],
+                ldap.MATCH_ANY
+            ),
+        ],
+        ldap.MATCH_ALL
+    )
+    filter = ldap.combine_filters(
+        [ldap.make_filter({'dhcphostownerdn': owner}) for owner in owners]
+        + [unowned],
+        ldap.MATCH_ANY
+    )
+
+    entries = []
+    try:
+        entries = ldap.get_entries(
+            container,
+            ldap.SCOPE_SUBTREE,
+            filter,
+            ['objectclass', 'cn', 'dhcphwaddress', 'dhcphostownerdn']
+        )
+    except errors.NotFound:
+        pass
+
+    generated = dict(
+        (fqdn, re.compile(r'^{0}-[0-9A-F]{{12}}$'.format(re.escape(fqdn)), re.I))
+        for fqdn in wanted
+    )
+
+    existing = dict((fqdn, {}) for fqdn in wanted)
+    for entry in entries:
+        cn = entry['cn'][0]
+        if 'dhcphostownerdn' in entry:
+            fqdn = owners.get(DN(entry['dhcphostownerdn'][0]))
+            if fqdn is not None:
+                existing[fqdn][cn] = entry
+            continue
+        # A wildcard on "<fqdn>-" also matches longer host names such as
+        # "<fqdn>-b.example.com", so only exact generated names count.
+        for fqdn, pattern in generated.items():
+            if pattern.match(cn):
+                existing[fqdn][dhcphost_cn(fqdn, cn[-12:])] = entry
+                break
+
+    for fqdn in wanted:
+        for cn, entry in existing[fqdn].items():
+            if cn in wanted[fqdn]:
+                continue
+            ldap.delete_entry(entry.dn)
+            hwaddress = entry.get('dhcphwaddress', [u''])[0]
+            summary[fqdn]['deleted'].append(hwaddress.replace('ethernet ', ''))
+
+        owner = dhcphost_owner_dn(fqdn)
+        for cn, mac in wanted[fqdn].items():
+            entry = existing[fqdn].get(cn)
+            if entry is not None:
+                if 'dhcphostownerdn' not in entry:
+                    dhcphost_adopt(ldap, entry, owner)
+                continue
+            attrs = dhcphost_entry_attrs(fqdn, mac, owner=owner)
+            try:
+                ldap.add_entry(ldap.make_entry(DN(('cn', cn), container), attrs))
+            except errors.DuplicateEntry:
+                # An unowned entry of the same name that the search above did
+                # not return, e.g. one whose cn differs in case.
+                entry = ldap.get_entry(DN(('cn', cn), container), ['objectclass'])
+                dhcphost_adopt(ldap, entry, owner)
+            summary[fqdn]['added'].append(mac)
+
+    return summary
+
+
+@register()
+class dhcphost_reconcile_cmd(Command):
+    __doc__ = _('Synchronize the DHCP hosts of IPA hosts with their MAC addresses.')
+    msg_summary = _('Synchronized DHCP hosts of %(value)s host(s)')
+
+    has_output = (
+        output.summary,
+        Output('result', dict, _('Added and deleted MAC addresses per host')),
+        output.value,
+    )
+
+    takes_args = (
+        Str(
+            'fqdn+',
+            cli_name='hostname',
+            label=_('Host name'),
+            doc=_('Host name.')
+        ),
+    )
+
+    def execute(self, *args, **kw):
+        ldap = dhcp_ldap(self.api.Backend.ldap2)
+        fqdns = args[0]
+
+        filter = ldap.combine_filters(
+            [ldap.make_filter({'fqdn': fqdn}) for fqdn in fqdns],
+            ldap.MATCH_ANY
+        )
+        entries = []
+        try:
+            entries = ldap.get_entries(
+                DN(api.env.container_host, api.env.basedn),
+                ldap.SCOPE_ONELEVEL,
+                filter,
+                ['fqdn', 'macaddress']
+            )
+        except errors.NotFound:
+            pass
+
+        hosts = dict(
+            (entry['fqdn'][0], entry.get('macaddress', []))
+            for entry in entries
+        )
+        result = dhcphost_reconcile(ldap, hosts)
+        value = unicode(len(result))
+        return dict(
+            summary=unicode(self.msg_summary % dict(value=value)),
+            result=result,
+            value=value
+        )
+
+
 def host_add_dhcphost(self, ldap, dn, entry_attrs, *keys, **options):
     if 'macaddress' in entry_attrs:
-        for addr in entry_attrs['macaddress']:
-            api.Command['dhcphost_add_cmd'](entry_attrs['fqdn'][0], addr)
+        dhcphost_reconcile(ldap, {entry_attrs['fqdn'][0]: entry_attrs['macaddress']})
     return dn
 
-host.host_add.register_post_callback(host_add_dhcphost)
+host.host_add.register_post_callback(dhcp_counted_callback(host_add_dhcphost, 'host_add_dhcphost'))
 
 
 def host_mod_dhcphost(self, ldap, dn, entry_attrs, *keys, **options):
@@ -2305,51 +3189,25 @@ def host_mod_dhcphost(self, ldap, dn, entry_attrs, *keys, **options):
     else:
         macaddresses = list(options['macaddress'])
 
-    filter = ldap.make_filter(
-        {
-            'cn': entry_attrs['fqdn'][0]
-        },
-        exact=False,
-        leading_wildcard=False,
-        trailing_wildcard=True
-    )
-
-    entries = []
-    try:
-        entries = ldap.get_entries(
-            DN(container_dhcp_dn, dhcp_dn),
-            ldap.SCOPE_SUBTREE,
-            filter
-        )
-    except errors.NotFound:
-        pass
-
-    for entry in entries:
-        entry_macaddr = entry['dhcpHWAddress'][0].replace('ethernet ', '')
-        if entry_macaddr not in macaddresses:
-            api.Command['dhcphost_del'](entry_attrs['fqdn'][0], entry_macaddr)
-        if entry_macaddr in macaddresses:
-            macaddresses.remove(entry_macaddr)
-
-    for new_macaddr in macaddresses:
-        api.Command['dhcphost_add'](entry_attrs['fqdn'][0], new_macaddr)
+    dhcphost_reconcile(ldap, {entry_attrs['fqdn'][0]: macaddresses})
 
     return dn
 
-host.host_mod.register_post_callback(host_mod_dhcphost)
+host.host_mod.register_post_callback(dhcp_counted_callback(host_mod_dhcphost, 'host_mod_dhcphost'))
 
 
 def host_del_dhcphost(self, ldap, dn, *keys, **options):
 
-    entry = ldap.get_entry(dn)
+    entry = ldap.get_entry(dn, ['fqdn'])
 
-    if 'macaddress' in entry:
-        for addr in entry['macaddress']:
-            try:
-                api.Command['dhcphost_del_cmd'](entry['fqdn'][0], addr)
-            except:
-                pass
+    try:
+        dhcphost_reconcile(ldap, {entry['fqdn'][0]: []})
+    except errors.ExecutionError:
+        pass
 
     return dn
 
-host.host_del.register_pre_callback(host_del_dhcphost)
+host.host_del.register_pre_callback(dhcp_counted_callback(host_del_dhcphost, 'host_del_dhcphost'))
+
+
+dhcp_instrument_commands(globals())
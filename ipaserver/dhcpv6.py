@@ -44,7 +44,6 @@ from dhcpcommon import *
 #dhcpv6_dn = 'cn=dhcp,{0}'.format(api.env.basedn)
 dhcpv6_dn = '{0}'.format(api.env.basedn)
 service_dhcpv6_dn = 'cn=v6'
-container_dhcpv6_dn = DN(('cn', 'v6'), 'cn=dhcp')
 register = Registry()
 
 dhcp_version = 6
@@ -69,6 +68,12 @@ class dhcpv6service_mod(dhcpservice_mod):
     __doc__ = _('Modify the DHCP IPv6 configuration.')
     msg_summary = _('Modified the DHCP IPv6 configuration.')
 
+@register()
+class dhcpv6service_export(dhcpservice_export):
+    __doc__ = _('Export the DHCP IPv6 configuration as a dhcpd.conf file.')
+    container_dn = container_dhcpv6_dn
+    dhcp_version = 6
+
 #### dhcpsubnet ###############################################################
 
 
@@ -147,23 +152,15 @@ class dhcpv6subnet(dhcpsubnet):
    )
 
 
+    virtual_params = (
+        'router',
+        'domainnameservers',
+        'domainsearch',
+    )
+
     @staticmethod
     def extract_virtual_params(ldap, dn, entry_attrs, keys, options):
-
-        dhcpOptions = entry_attrs.get('dhcpoption', [])
-
-        for option in dhcpOptions:
-            if option.startswith('routers '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['router'] = v
-            elif option.startswith('dhcp6.name-servers '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['domainnameservers'] = v.split(', ')
-            elif option.startswith('domain-search '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['domainsearch'] = v.replace('"', '').split(', ')
-
-        return entry_attrs
+        return dhcp_extract_virtual_params(6, entry_attrs, dhcpv6subnet.virtual_params)
 
 
 @register()
@@ -235,25 +232,7 @@ class dhcpv6subnet_mod(dhcpsubnet_mod):
     def pre_callback(self, ldap, dn, entry_attrs, attrs_list, *keys, **options):
         assert isinstance(dn, DN)
 
-        entry = ldap.get_entry(dn)
-
-        if 'dhcpstatements' in entry_attrs:
-            dhcpStatements = entry_attrs.get('dhcpstatements', [])
-        else:         
-            dhcpStatements = entry.get('dhcpstatements', [])
-
-        if 'dhcpoption' in entry_attrs:
-            dhcpOptions = entry_attrs.get('dhcpoption', [])
-        else:
-            dhcpOptions = entry.get('dhcpoption', [])
-
-        dhcp_modify_router( dhcp_version, options, dhcpOptions )
-        dhcp_modify_domainname( dhcp_version, options, dhcpOptions, dhcpStatements )
-        dhcp_modify_domainserver( dhcp_version, options, dhcpOptions )
-        dhcp_modify_domainsearch( dhcp_version, options, dhcpOptions )
-
-        entry_attrs['dhcpstatements'] = dhcpStatements
-        entry_attrs['dhcpoption'] = dhcpOptions
+        dhcp_mod_virtual_params(ldap, dn, entry_attrs, options, dhcp_version, self.obj.virtual_params)
 
         return dn
 
@@ -269,6 +248,24 @@ class dhcpv6subnet_del(dhcpsubnet_del):
     msg_summary = _('Deleted DHCP IPv6 subnet "%(value)s"')
 
 
+@register()
+class dhcpv6subnet_check_overlaps(dhcpsubnet_check_overlaps):
+    __doc__ = _('Report overlapping pool ranges and fixed addresses in a DHCP IPv6 subnet.')
+    container_dn = container_dhcpv6_dn
+
+
+@register()
+class dhcpv6subnet_next_free(dhcpsubnet_next_free):
+    __doc__ = _('Find the next free addresses in a DHCP IPv6 subnet.')
+    container_dn = container_dhcpv6_dn
+
+
+@register()
+class dhcpv6subnet_effective(dhcpsubnet_effective):
+    __doc__ = _('Show the statements, options and permits in effect for a DHCP IPv6 subnet and the scope each comes from.')
+    container_dn = container_dhcpv6_dn
+
+
 #### dhcpfailoverpeer ###############################################################
 
 @register()
@@ -379,6 +376,7 @@ class dhcpv6pool(dhcppool):
     default_attributes = ['cn']
     label = _('DHCP IPv6 Pools')
     label_singular = _('DHCP IPv6 Pool')
+    range_attribute = 'dhcprange6'
 
     takes_params = (
         Str(
@@ -479,10 +477,8 @@ class dhcpv6pool_del(dhcppool_del):
 
 
 @register()
-class dhcpv6pool_is_valid(Command):
-    NO_CLI = True
-    has_output = output.standard_boolean
-    msg_summary = _('"%(value)s"')
+class dhcpv6pool_is_valid(dhcppool_is_valid):
+    container_dn = container_dhcpv6_dn
 
     takes_args = (
         Str(
@@ -499,43 +495,41 @@ class dhcpv6pool_is_valid(Command):
         )
     )
 
-    def execute(self, *args, **kw):
-
-        # Run some basic sanity checks on a DHCP pool IP range to make sure it
-        # fits into its parent DHCP subnet. This method looks up the parent
-        # subnet given the necessary LDAP keys because that's what works best
-        # with the GUI.
-
-        dhcpsubnetcn = args[0]
-        dhcprange = args[1][0]
-
-        ldap = self.api.Backend.ldap2
-        dn = DN(
-            ('cn', dhcpsubnetcn),
-            container_dhcpv6_dn,
-            dhcpv6_dn
-        )
-        try:
-            entry = ldap.get_entry(dn)
-        except:
-            return dict(result=False, value=u'No such subnet.')
 
-        subnetIP = IPNetwork( entry['cn'][0] )
+@register()
+class dhcpv6pool_utilization(dhcppool_utilization):
+    __doc__ = _('Report how many addresses of each DHCP IPv6 pool are in use, from a dhcpd6 lease file.')
+    container_dn = container_dhcpv6_dn
+    dhcp_version = 6
 
-        (rangeStart, rangeEnd) = dhcprange.split(" ")
-        rangeStartIP = IPNetwork("{0}/128".format(rangeStart))
-        rangeEndIP = IPNetwork("{0}/128".format(rangeEnd))
 
-        if rangeStartIP > rangeEndIP:
-            return dict(result=False, value=u'First IPv6 must come before last IPv6!')
+#### dhcplease ###############################################################
 
-        if rangeStartIP < subnetIP[0] or rangeStartIP > subnetIP[-1]:
-            return dict(result=False, value=u'{0} is outside parent subnet {1}. Addresses in this pool must come from the range {2}-{3}.'.format(rangeStartIP.ip, subnetIP.cidr, subnetIP[0], subnetIP[-1]))
+@register()
+class dhcpv6lease_find(dhcplease_find):
+    __doc__ = _('Search for DHCP IPv6 leases by IP address.')
+    msg_summary = ngettext(
+        '%(count)d DHCP IPv6 lease matched',
+        '%(count)d DHCP IPv6 leases matched', 0
+    )
+    container_dn = container_dhcpv6_dn
+    dhcp_version = 6
+    lease_keys = ('address',)
 
-        if rangeEndIP < subnetIP[0] or rangeEndIP > subnetIP[-1]:
-            return dict(result=False, value=u'{0} is outside parent subnet {1}. Addresses in this pool must come from the range {2}-{3}.'.format(rangeEndIP.ip, subnetIP.cidr, subnetIP[0], subnetIP[-1]))
+    # dhcpd6 keeps neither the MAC address nor a host name with a lease.
+    takes_args = (
+        Str(
+            'criteria?',
+            cli_name='criteria',
+            label=_('Criteria'),
+            doc=_('IP address.')
+        ),
+    )
 
-        return dict(result=True, value=u'Valid IPv6 range.')
+    takes_options = tuple(
+        option for option in dhcplease_find.takes_options
+        if option.name not in ('macaddress', 'hostname')
+    )
 
 
 #### dhcpgroup #################################################################
@@ -812,35 +806,15 @@ class dhcpv6host(dhcphost):
         ),
     )
 
+    virtual_params = (
+        'ipaddress6',
+        'hostname',
+        'macaddress',
+    )
+
     @staticmethod
     def extract_virtual_params(ldap, dn, entry_attrs, keys, options):
-
-        dhcpStatements = entry_attrs.get('dhcpstatements', [])
-
-        for statements in dhcpStatements:
-            if statements.startswith('fixed-address6 '):
-                (o, v) = statements.split(' ', 1)
-                entry_attrs['ipaddress6'] = v
-                entry_attrs['ipaddress6'] = v
-            elif statements.startswith('ddns-hostname '):
-                (o, v) = statements.split(' ', 1)
-                entry_attrs['hostname'] = v.replace('"', '')
-
-        dhcpHWaddress = entry_attrs.get('dhcphwaddress', [])
-
-        for hwaddress in dhcpHWaddress:
-            if hwaddress.startswith('ethernet '):
-                (o, v) = hwaddress.split(' ', 1)
-                entry_attrs['macaddress'] = v.replace('"', '')
-
-        dhcpOptions = entry_attrs.get('dhcpoption', [])
-
-        for option in dhcpOptions:
-            if option.startswith('host-name '):
-                (o, v) = option.split(' ', 1)
-                entry_attrs['hostname'] = v.replace('"', '')
-
-        return entry_attrs
+        return dhcp_extract_virtual_params(6, entry_attrs, dhcpv6host.virtual_params)
 
 @register()
 class dhcpv6host_find(dhcphost_find):
@@ -880,22 +854,7 @@ class dhcpv6host_mod(dhcphost_mod):
     def pre_callback(self, ldap, dn, entry_attrs, attrs_list, *keys, **options):
         assert isinstance(dn, DN)
 
-        entry = ldap.get_entry(dn)
-
-        if 'dhcpstatements' in entry_attrs:
-            dhcpStatements = entry_attrs.get('dhcpstatements', [])
-        else:
-            dhcpStatements = entry.get('dhcpstatements', [])
-
-        if 'dhcpoption' in entry_attrs:
-            dhcpOptions = entry_attrs.get('dhcpoption', [])
-        else:
-            dhcpOptions = entry.get('dhcpoption', [])
-
-        dhcp_modify_hostname( dhcp_version, options, dhcpOptions, dhcpStatements )
-
-        entry_attrs['dhcpStatements'] = dhcpStatements
-        entry_attrs['dhcpoption'] = dhcpOptions
+        dhcp_mod_virtual_params(ldap, dn, entry_attrs, options, dhcp_version, self.obj.virtual_params)
 
         return dn
 
@@ -911,6 +870,12 @@ class dhcpv6host_del(dhcphost_del):
     msg_summary = _('Deleted DHCP IPv6 host "%(value)s"')
 
 
+@register()
+class dhcpv6host_effective(dhcphost_effective):
+    __doc__ = _('Show the statements, options and permits in effect for a DHCP IPv6 host and the scope each comes from.')
+    container_dn = container_dhcpv6_dn
+
+
 @register()
 class dhcpv6host_add_cmd(Command):
     has_output = output.standard_entry
@@ -1136,3 +1101,5 @@ class dhcpv6poolhost_del(dhcpv6host_del):
 
 ###############################################################################
 
+
+dhcp_instrument_commands(globals())
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The tests run on a host with FreeIPA server packages installed, but need
+# no running server: the plugin functions are handed a MemoryLDAP from
+# tools/memldap.py instead of the ldap2 backend. The plugin modules of this
+# tree are imported as ipaserver.plugins.dhcp*, where install.sh puts them.
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+from ipalib import api
+from ipalib.request import destroy_context
+from ipapython.dn import DN
+
+if not api.isdone('bootstrap'):
+    api.bootstrap(
+        context='dhcptest',
+        in_server=True,
+        basedn=DN('dc=example,dc=test'),
+        realm='EXAMPLE.TEST',
+        domain='example.test',
+    )
+
+import ipaserver.plugins
+ipaserver.plugins.__path__.insert(0, os.path.join(ROOT, 'ipaserver'))
+
+import memldap
+
+
+@pytest.fixture(autouse=True)
+def request_context():
+    # The plugin caches entries for the length of a request.
+    yield
+    destroy_context()
+
+
+@pytest.fixture
+def ldap():
+    # An empty tree with the v4 and v6 service containers.
+    ldap = memldap.MemoryLDAP()
+    ldap.load([
+        (DN(('cn', name), ('cn', 'dhcp'), api.env.basedn), {
+            'objectclass': ['dhcpservice', 'nscontainer', 'top'],
+            'cn': [name],
+        })
+        for name in ('v4', 'v6')
+    ])
+    return ldap
+
+
+@pytest.fixture
+def service_dn():
+    return DN(('cn', 'v4'), ('cn', 'dhcp'), api.env.basedn)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from ipalib.request import destroy_context
+from ipapython.dn import DN
+from netaddr import IPAddress
+
+from ipaserver.plugins import dhcpcommon
+
+
+@pytest.fixture
+def tree(ldap, service_dn, monkeypatch):
+    monkeypatch.setattr(dhcpcommon, 'dhcp_address_indexes', {})
+    subnet_dn = DN(('cn', u'192.0.2.0'), service_dn)
+    ldap.load([
+        (subnet_dn, {'objectclass': ['dhcpsubnet', 'top'], 'cn': [u'192.0.2.0'], 'dhcpnetmask': [u'24']}),
+        (DN(('cn', u'pool'), subnet_dn), {
+            'objectclass': ['dhcppool', 'top'],
+            'cn': [u'pool'],
+            'dhcprange': [u'192.0.2.10 192.0.2.19'],
+        }),
+    ])
+    return ldap
+
+
+def count_searches(ldap, monkeypatch):
+    calls = []
+    find_entries = ldap.find_entries
+
+    def counted(*args, **kw):
+        calls.append(kw.get('filter'))
+        return find_entries(*args, **kw)
+    monkeypatch.setattr(ldap, 'find_entries', counted)
+    return calls
+
+
+def test_lookup(tree, service_dn):
+    index = dhcpcommon.dhcp_address_index(tree, service_dn)
+
+    (subnet, pool, range) = index.lookup(IPAddress(u'192.0.2.12'))
+    assert pool['cn'] == [u'pool']
+    assert range == u'192.0.2.10 192.0.2.19'
+    assert index.lookup(IPAddress(u'192.0.2.200'))[1] is None
+    assert index.lookup(IPAddress(u'198.51.100.1')) is None
+
+
+def test_index_outlives_the_request_until_the_tree_changes(tree, service_dn, monkeypatch):
+    searches = count_searches(tree, monkeypatch)
+
+    index = dhcpcommon.dhcp_address_index(tree, service_dn)
+    destroy_context()
+    assert dhcpcommon.dhcp_address_index(tree, service_dn) is index
+    assert len(searches) == 1
+
+    tree.delete_entry(DN(('cn', u'pool'), ('cn', u'192.0.2.0'), service_dn))
+    destroy_context()
+    rebuilt = dhcpcommon.dhcp_address_index(tree, service_dn)
+    assert rebuilt is not index
+    assert len(searches) == 2
+    assert rebuilt.lookup(IPAddress(u'192.0.2.12'))[1] is None
+
+
+def test_index_is_kept_per_principal(tree, service_dn):
+    from ipalib.request import context
+
+    context.principal = u'admin@EXAMPLE.TEST'
+    index = dhcpcommon.dhcp_address_index(tree, service_dn)
+    destroy_context()
+
+    context.principal = u'user@EXAMPLE.TEST'
+    assert dhcpcommon.dhcp_address_index(tree, service_dn) is not index
+
+
+def test_without_usn_plugin_index_lives_for_the_request(tree, service_dn, monkeypatch):
+    monkeypatch.setattr(dhcpcommon, 'dhcp_tree_stamp', lambda ldap: None)
+
+    index = dhcpcommon.dhcp_address_index(tree, service_dn)
+    assert dhcpcommon.dhcp_address_index(tree, service_dn) is index
+    destroy_context()
+    assert dhcpcommon.dhcp_address_index(tree, service_dn) is not index
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+import pytest
+
+from ipapython.dn import DN
+
+from ipaserver.plugins import dhcpcommon
+
+import memldap
+
+
+class Clock(object):
+    # Stands in for the time module of memldap, so that changes fall into
+    # the seconds a test chooses. It starts a minute after the entries of
+    # the ldap fixture were made.
+    gmtime = staticmethod(time.gmtime)
+    strftime = staticmethod(time.strftime)
+
+    def __init__(self):
+        self.now = float(int(time.time()) + 60)
+        self.start = time.strftime('%Y%m%d%H%M%SZ', time.gmtime(self.now)).decode('ascii')
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(memldap, 'time', clock)
+    return clock
+
+
+def host(ldap, service_dn, name):
+    ldap.load([(DN(('cn', name), service_dn), {
+        'objectclass': ['dhcphost', 'top'],
+        'cn': [name],
+    })])
+
+
+def poll(ldap, service_dn, cursor, sizelimit, deletes=True):
+    # Follow the feed to its end, one call per sizelimit changes.
+    seen = []
+    while True:
+        (changes, cursor, truncated) = dhcpcommon.dhcp_changes(
+            ldap, service_dn, cursor, sizelimit, deletes
+        )
+        assert len(changes) <= sizelimit
+        seen.extend((change, dn[0][1]) for (change, dn, modified, csn, objectclasses) in changes)
+        if not truncated:
+            return (seen, cursor)
+
+
+def test_feed_lists_every_change_once(ldap, service_dn, clock):
+    start = clock.start
+    # Many changes within one second and a few in the next ones.
+    for i in range(7):
+        host(ldap, service_dn, u'host{0}'.format(i))
+    clock.now += 1
+    host(ldap, service_dn, u'host7')
+    ldap.delete_entry(DN(('cn', u'host0'), service_dn))
+    clock.now += 1
+    host(ldap, service_dn, u'host8')
+
+    for sizelimit in (1, 2, 3, 100):
+        (seen, cursor) = poll(ldap, service_dn, start, sizelimit)
+        assert sorted(seen) == sorted(
+            [(u'add', u'host{0}'.format(i)) for i in range(1, 9)] + [(u'delete', u'host0')]
+        )
+        assert poll(ldap, service_dn, cursor, sizelimit) == ([], cursor)
+
+
+def test_feed_reads_about_sizelimit_entries(ldap, service_dn, clock):
+    for i in range(50):
+        clock.now += 1
+        host(ldap, service_dn, u'host{0}'.format(i))
+
+    (changes, cursor, truncated) = dhcpcommon.dhcp_changes(ldap, service_dn, clock.start, 5)
+
+    assert truncated
+    assert [dn[0][1] for (change, dn, modified, csn, objectclasses) in changes] == [
+        u'host0', u'host1', u'host2', u'host3', u'host4'
+    ]
+    # ldap.conn.search_ext() hands out one message id per search.
+    assert next(ldap.conn.msgids) <= 4
+
+
+def test_deletes_need_directory_manager(ldap, service_dn, clock):
+    host(ldap, service_dn, u'host0')
+    ldap.delete_entry(DN(('cn', u'host0'), service_dn))
+
+    assert dhcpcommon.dhcp_tombstones_visible(ldap)
+    (seen, cursor) = poll(ldap, service_dn, clock.start, 100, deletes=False)
+    assert (u'delete', u'host0') not in seen
+
+    ldap.conn.authzid = 'dn: uid=admin,cn=users,cn=accounts,dc=example,dc=test'
+    assert not dhcpcommon.dhcp_tombstones_visible(ldap)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from ipapython.dn import DN
+
+from ipaserver.plugins import dhcpv4
+
+
+def container():
+    return DN(dhcpv4.container_dhcp_dn, dhcpv4.dhcp_dn)
+
+
+def dhcphosts(ldap):
+    # cn -> (MAC address, owner DN or None) of every dhcpHost.
+    hosts = {}
+    for entry in ldap.get_entries(container(), ldap.SCOPE_SUBTREE, u'(objectclass=dhcphost)'):
+        owner = entry.get('dhcphostownerdn')
+        hosts[entry['cn'][0]] = (
+            entry['dhcphwaddress'][0].replace(u'ethernet ', u''),
+            DN(owner[0]) if owner else None,
+        )
+    return hosts
+
+
+def add_legacy(ldap, fqdn, mac):
+    # A dhcpHost as generated before dhcpHostOwnerDN existed.
+    attrs = dhcpv4.dhcphost_entry_attrs(fqdn, mac)
+    ldap.add_entry(ldap.make_entry(DN(('cn', attrs['cn'][0]), container()), attrs))
+
+
+def test_adds_owned_entries(ldap):
+    summary = dhcpv4.dhcphost_reconcile(ldap, {
+        u'a.example.test': [u'00-11-22-33-44-55', u'001122334466'],
+    })
+
+    assert sorted(summary[u'a.example.test']['added']) == [u'00:11:22:33:44:55', u'00:11:22:33:44:66']
+    assert summary[u'a.example.test']['deleted'] == []
+    owner = dhcpv4.dhcphost_owner_dn(u'a.example.test')
+    assert dhcphosts(ldap) == {
+        u'a.example.test-001122334455': (u'00:11:22:33:44:55', owner),
+        u'a.example.test-001122334466': (u'00:11:22:33:44:66', owner),
+    }
+
+
+def test_deletes_dropped_macs_and_is_idempotent(ldap):
+    dhcpv4.dhcphost_reconcile(ldap, {
+        u'a.example.test': [u'00:11:22:33:44:55', u'00:11:22:33:44:66'],
+        u'b.example.test': [u'00:11:22:33:44:77'],
+    })
+
+    summary = dhcpv4.dhcphost_reconcile(ldap, {u'a.example.test': [u'00:11:22:33:44:66']})
+    assert summary == {u'a.example.test': {'added': [], 'deleted': [u'00:11:22:33:44:55']}}
+    assert sorted(dhcphosts(ldap)) == [u'a.example.test-001122334466', u'b.example.test-001122334477']
+
+    summary = dhcpv4.dhcphost_reconcile(ldap, {u'a.example.test': [u'00:11:22:33:44:66']})
+    assert summary == {u'a.example.test': {'added': [], 'deleted': []}}
+
+
+def test_adopts_and_deletes_legacy_entries(ldap):
+    add_legacy(ldap, u'a.example.test', u'00:11:22:33:44:55')
+    add_legacy(ldap, u'a.example.test', u'00:11:22:33:44:66')
+
+    summary = dhcpv4.dhcphost_reconcile(ldap, {u'a.example.test': [u'00:11:22:33:44:55']})
+
+    assert summary == {u'a.example.test': {'added': [], 'deleted': [u'00:11:22:33:44:66']}}
+    owner = dhcpv4.dhcphost_owner_dn(u'a.example.test')
+    assert dhcphosts(ldap) == {u'a.example.test-001122334455': (u'00:11:22:33:44:55', owner)}
+    entry = ldap.get_entry(DN(('cn', u'a.example.test-001122334455'), container()), ['objectclass'])
+    assert 'dhcphostowner' in [value.lower() for value in entry['objectclass']]
+
+
+def test_leaves_longer_host_names_alone(ldap):
+    # "a.example.test-b.example.test-..." starts with "a.example.test-" but
+    # belongs to another host.
+    add_legacy(ldap, u'a.example.test-b.example.test', u'00:11:22:33:44:55')
+
+    summary = dhcpv4.dhcphost_reconcile(ldap, {u'a.example.test': []})
+
+    assert summary == {u'a.example.test': {'added': [], 'deleted': []}}
+    assert dhcphosts(ldap) == {
+        u'a.example.test-b.example.test-001122334455': (u'00:11:22:33:44:55', None),
+    }
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from ipapython.dn import DN
+
+from ipaserver.plugins import dhcpcommon
+
+
+def peer(**attrs):
+    entry = {
+        'objectclass': ['dhcpfailoverpeer', 'top'],
+        'cn': [u'peer'],
+        'dhcpfailoverprimaryserver': [u'dhcp1.example.test'],
+        'dhcpfailoversecondaryserver': [u'dhcp2.example.test'],
+        'dhcpfailoverprimaryport': [u'647'],
+        'dhcpfailoversecondaryport': [u'847'],
+        'dhcpmaxclientleadtime': [u'3600'],
+        'dhcpfailoversplit': [u'128'],
+    }
+    entry.update(attrs)
+    return dict((attr, values) for (attr, values) in entry.items() if values is not None)
+
+
+def test_peer_from_either_side():
+    assert u''.join(dhcpcommon.dhcp_export_peer(peer())) == (
+        u'failover peer "peer" {\n'
+        u'    primary;\n'
+        u'    address dhcp1.example.test;\n'
+        u'    port 647;\n'
+        u'    peer address dhcp2.example.test;\n'
+        u'    peer port 847;\n'
+        u'    mclt 3600;\n'
+        u'    split 128;\n'
+        u'}\n'
+    )
+    assert u''.join(dhcpcommon.dhcp_export_peer(peer(), u'DHCP2.example.test')) == (
+        u'failover peer "peer" {\n'
+        u'    secondary;\n'
+        u'    address dhcp2.example.test;\n'
+        u'    port 847;\n'
+        u'    peer address dhcp1.example.test;\n'
+        u'    peer port 647;\n'
+        u'}\n'
+    )
+
+
+def test_peer_with_unreadable_attributes():
+    # What a bind without read access to the failover attributes gets back.
+    text = u''.join(dhcpcommon.dhcp_export_peer(peer(dhcpfailoverprimaryport=None, dhcpfailoversecondaryport=None)))
+    assert u'port' not in text
+    assert u'peer address dhcp2.example.test;\n' in text
+
+    assert list(dhcpcommon.dhcp_export_peer(peer(dhcpfailoversecondaryserver=None))) == []
+
+
+def test_export_counts_each_search_once(ldap, service_dn, monkeypatch):
+    subnet_dn = DN(('cn', u'192.0.2.0'), service_dn)
+    ldap.load([
+        (DN(('cn', u'peer'), service_dn), peer()),
+        (subnet_dn, {'objectclass': ['dhcpsubnet', 'top'], 'cn': [u'192.0.2.0'], 'dhcpnetmask': [u'24']}),
+        (DN(('cn', u'pool'), subnet_dn), {
+            'objectclass': ['dhcppool', 'top'],
+            'cn': [u'pool'],
+            'dhcprange': [u'192.0.2.10 192.0.2.19'],
+        }),
+    ])
+    records = []
+    monkeypatch.setattr(dhcpcommon, 'dhcp_stats_add', lambda name, elapsed, record, failed: records.append(record))
+
+    text = dhcpcommon.dhcp_stats_call(
+        'dhcpservice_export', lambda: u''.join(dhcpcommon.dhcp_export_config(
+            dhcpcommon.DHCPLDAPCounter(ldap), service_dn, 4
+        ))
+    )
+
+    assert u'failover peer "peer" {\n' in text
+    assert u'subnet 192.0.2.0 netmask 255.255.255.0 {\n    pool {\n        range 192.0.2.10 192.0.2.19;\n' in text
+    # The service entry, then one search for the peers, one for the shared
+    # networks, one per rendered class and one below the subnet.
+    classes = len(dhcpcommon.dhcp_export_classes)
+    assert records[0]['ops'] == {'get_entry': 1, 'find_entries': 2 + classes + 1}
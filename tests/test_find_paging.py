@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import dhcptopology
+
+from ipaserver.plugins import dhcpcommon
+
+
+def load_hosts(ldap, service_dn, names):
+    ldap.load(
+        (u'cn={0},{1}'.format(name, service_dn), {'objectclass': ['dhcphost', 'top'], 'cn': [name]})
+        for name in names
+    )
+
+
+def pages(ldap, service_dn, size):
+    cursor = None
+    while True:
+        keys = dhcpcommon.dhcp_find_page_keys(
+            ldap, service_dn, ldap.SCOPE_SUBTREE, u'(objectclass=dhcphost)', 'cn', cursor, size
+        )
+        yield keys
+        if len(keys) < size:
+            return
+        cursor = keys[-1]
+
+
+def test_pages_cover_every_host_once_in_order(ldap, service_dn):
+    names = [dhcptopology.host_name(i) for i in range(257)]
+    load_hosts(ldap, service_dn, names)
+
+    result = list(pages(ldap, service_dn, 50))
+
+    assert [len(keys) for keys in result] == [50, 50, 50, 50, 50, 7]
+    assert sum(result, []) == sorted(names, key=lambda name: name.lower())
+
+
+def test_search_asks_for_one_page(ldap, service_dn, monkeypatch):
+    load_hosts(ldap, service_dn, [dhcptopology.host_name(i) for i in range(30)])
+    calls = []
+    search_ext = ldap.conn.search_ext
+
+    def counted(*args, **kw):
+        calls.append(kw.get('sizelimit'))
+        return search_ext(*args, **kw)
+    monkeypatch.setattr(ldap.conn, 'search_ext', counted)
+
+    keys = dhcpcommon.dhcp_find_page_keys(
+        ldap, service_dn, ldap.SCOPE_SUBTREE, u'(objectclass=dhcphost)', 'cn', None, 10
+    )
+
+    assert len(keys) == 10
+    assert calls == [10]
+
+
+def test_non_ascii_cursor(ldap, service_dn):
+    load_hosts(ldap, service_dn, [u'a-host', u'b-hôst', u'c-host', u'd-host'])
+
+    keys = dhcpcommon.dhcp_find_page_keys(
+        ldap, service_dn, ldap.SCOPE_SUBTREE, u'(objectclass=dhcphost)', 'cn', u'b-hôst', 10
+    )
+
+    assert keys == [u'c-host', u'd-host']
+
+
+def test_page_filter(ldap, service_dn):
+    load_hosts(ldap, service_dn, [u'host{0}'.format(i) for i in range(5)])
+    options = {'pagesize': 2, 'cursor': u'host1'}
+
+    filter = dhcpcommon.dhcp_find_page_filter(ldap, u'(objectclass=dhcphost)', service_dn, ldap.SCOPE_SUBTREE, options)
+
+    entries = ldap.get_entries(service_dn, ldap.SCOPE_SUBTREE, filter, ['cn'])
+    assert sorted(entry['cn'][0] for entry in entries) == [u'host2', u'host3']
+    assert dhcpcommon.dhcp_find_page_cursor(entries, options) == u'host3'
+    assert dhcpcommon.dhcp_find_page_filter(ldap, u'(objectclass=dhcphost)', service_dn, ldap.SCOPE_SUBTREE, {}) == \
+        u'(objectclass=dhcphost)'
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+from ipapython.dn import DN
+from netaddr import IPAddress
+
+from ipaserver.plugins import dhcpcommon
+
+
+def test_range_gaps():
+    gaps = dhcpcommon.dhcp_range_gaps
+    assert list(gaps(0, 9, [])) == [(0, 9)]
+    assert list(gaps(0, 9, [(0, 9)])) == []
+    assert list(gaps(0, 9, [(3, 4), (6, 6)])) == [(0, 2), (5, 5), (7, 9)]
+    # Unsorted, overlapping and nested intervals, and intervals that stick
+    # out of the range on either side.
+    assert list(gaps(10, 30, [(25, 40), (12, 15), (13, 14), (14, 18), (0, 10)])) == [(11, 11), (19, 24)]
+    assert list(gaps(10, 30, [(40, 50)])) == [(10, 30)]
+
+
+def test_range_gaps_matches_scan():
+    rng = random.Random(2)
+    occupied = []
+    for i in range(40):
+        first = rng.randrange(500)
+        occupied.append((first, first + rng.randrange(20)))
+    covered = set()
+    for (first, last) in occupied:
+        covered.update(range(first, last + 1))
+    free = set()
+    for (first, last) in dhcpcommon.dhcp_range_gaps(100, 400, occupied):
+        free.update(range(first, last + 1))
+    assert free == set(range(100, 401)) - covered
+
+
+def add_subnet(ldap, service_dn, cn, netmask, routers=None):
+    attrs = {'objectclass': ['dhcpsubnet', 'top'], 'cn': [cn], 'dhcpnetmask': [netmask]}
+    if routers:
+        attrs['dhcpoption'] = [u'routers {0}'.format(routers)]
+    dn = DN(('cn', cn), service_dn)
+    ldap.add_entry(ldap.make_entry(dn, attrs))
+    return dn
+
+
+def test_free_addresses(ldap, service_dn):
+    subnet_dn = add_subnet(ldap, service_dn, u'192.0.2.0', u'24', routers=u'192.0.2.1')
+    ldap.add_entry(ldap.make_entry(DN(('cn', u'pool'), subnet_dn), {
+        'objectclass': ['dhcppool', 'top'],
+        'cn': [u'pool'],
+        'dhcprange': [u'192.0.2.10 192.0.2.19'],
+    }))
+    ldap.add_entry(ldap.make_entry(DN(('cn', u'host'), service_dn), {
+        'objectclass': ['dhcphost', 'top'],
+        'cn': [u'host'],
+        'dhcpstatements': [u'fixed-address 192.0.2.2, 192.0.2.5'],
+    }))
+    # Fixed addresses that are host names or outside the subnet take no
+    # address.
+    ldap.add_entry(ldap.make_entry(DN(('cn', u'other'), service_dn), {
+        'objectclass': ['dhcphost', 'top'],
+        'cn': [u'other'],
+        'dhcpstatements': [u'fixed-address other.example.test, 198.51.100.3'],
+    }))
+
+    free = dhcpcommon.dhcp_free_addresses(ldap, subnet_dn, service_dn, 10)
+
+    assert free == [IPAddress(u'192.0.2.{0}'.format(i)) for i in (3, 4, 6, 7, 8, 9, 20, 21, 22, 23)]
+
+
+def test_free_addresses_skips_broadcast(ldap, service_dn):
+    subnet_dn = add_subnet(ldap, service_dn, u'192.0.2.248', u'29', routers=u'192.0.2.249')
+
+    free = dhcpcommon.dhcp_free_addresses(ldap, subnet_dn, service_dn, 10)
+
+    assert free == [IPAddress(u'192.0.2.{0}'.format(i)) for i in range(250, 255)]
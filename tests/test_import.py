@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from ipapython.dn import DN
+
+from ipaserver.plugins import dhcpv4
+
+
+class Namespace(object):
+    pass
+
+
+class ImportCommand(object):
+    # Just what dhcphost_import.execute() uses of the command.
+    max_messages = dhcpv4.dhcphost_import.max_messages
+    msg_summary = dhcpv4.dhcphost_import.msg_summary
+
+    def __init__(self, ldap):
+        self.api = Namespace()
+        self.api.Backend = Namespace()
+        self.api.Backend.ldap2 = ldap
+
+
+def run_import(ldap, content, chunksize=500):
+    execute = dhcpv4.dhcphost_import.__dict__['execute']
+    return execute(ImportCommand(ldap), content, format=None, chunksize=chunksize)['result']
+
+
+def test_header_after_comments_and_blank_lines():
+    content = (
+        u'# exported from the inventory\n'
+        u'\n'
+        u'MACAddress,HostName,IPAddress\n'
+        u'00:11:22:33:44:55,a.example.test,192.0.2.10\n'
+    )
+
+    rows = list(dhcpv4.dhcphost_import_rows(content))
+
+    assert rows == [(4, {
+        'hostname': u'a.example.test',
+        'macaddress': u'00:11:22:33:44:55',
+        'ipaddress': u'192.0.2.10',
+    }, None)]
+
+
+def test_header_only_on_first_record():
+    content = (
+        u'a.example.test,00:11:22:33:44:55,192.0.2.10\n'
+        u'hostname,macaddress,ipaddress\n'
+    )
+
+    rows = list(dhcpv4.dhcphost_import_rows(content))
+
+    assert rows[0][1]['hostname'] == u'a.example.test'
+    assert rows[1][1] is None
+
+
+def test_conflicts_with_every_fixed_address(ldap):
+    container = DN(dhcpv4.container_dhcp_dn, dhcpv4.dhcp_dn)
+    attrs = dhcpv4.dhcphost_entry_attrs(u'a.example.test', u'00:11:22:33:44:55')
+    attrs['dhcpstatements'] = [u'fixed-address 192.0.2.10, 192.0.2.11']
+    ldap.add_entry(ldap.make_entry(DN(('cn', attrs['cn'][0]), container), attrs))
+
+    result = run_import(ldap, (
+        u'b.example.test,00:11:22:33:44:66,192.0.2.11\n'
+        u'c.example.test,00:11:22:33:44:77,192.0.2.1\n'
+    ))
+
+    assert result['conflicting'] == 1
+    assert result['messages'] == [u'line 1: IP address 192.0.2.11 is already reserved']
+    assert result['created'] == 1
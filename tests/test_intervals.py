@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+from ipaserver.plugins import dhcpcommon
+
+
+def random_intervals(rng, count, space=1000, width=20):
+    intervals = []
+    for i in range(count):
+        first = rng.randrange(space)
+        intervals.append((first, first + rng.randrange(width), i))
+    return intervals
+
+
+def test_interval_tree_overlapping_matches_scan():
+    rng = random.Random(0)
+    intervals = random_intervals(rng, 300)
+    tree = dhcpcommon.DHCPIntervalTree(intervals)
+    for i in range(500):
+        first = rng.randrange(-10, 1030)
+        last = first + rng.randrange(40)
+        expected = [interval for interval in intervals if interval[0] <= last and interval[1] >= first]
+        assert sorted(tree.overlapping(first, last)) == sorted(expected)
+
+
+def test_interval_tree_overlaps_matches_pairs():
+    rng = random.Random(1)
+    intervals = random_intervals(rng, 100)
+    tree = dhcpcommon.DHCPIntervalTree(intervals)
+    found = set(frozenset((a[2], b[2])) for (a, b) in tree.overlaps())
+    expected = set(
+        frozenset((a[2], b[2]))
+        for (i, a) in enumerate(intervals)
+        for b in intervals[i + 1:]
+        if a[0] <= b[1] and b[0] <= a[1]
+    )
+    assert found == expected
+
+
+def test_interval_tree_empty():
+    tree = dhcpcommon.DHCPIntervalTree([])
+    assert tree.overlapping(0, 10) == []
+    assert list(tree.overlaps()) == []
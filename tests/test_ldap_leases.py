@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from ipapython.dn import DN
+
+from ipaserver.plugins import dhcpcommon
+
+
+def lease(address, state=u'active', mac=None, hostname=None):
+    attrs = {
+        'objectclass': ['dhcpleases', 'top'],
+        'cn': [address],
+        'dhcpexpirationtime': [u'20190101120000Z'],
+    }
+    if state is not None:
+        attrs['dhcpaddressstate'] = [state]
+    if mac is not None:
+        attrs['dhcphwaddress'] = [u'ethernet ' + mac]
+    if hostname is not None:
+        attrs['dhcpassignedhostname'] = [hostname]
+    return attrs
+
+
+@pytest.fixture
+def leases(ldap, service_dn):
+    subnet_dn = DN(('cn', u'192.0.2.0'), service_dn)
+    ldap.load([
+        (subnet_dn, {'objectclass': ['dhcpsubnet', 'top'], 'cn': [u'192.0.2.0'], 'dhcpnetmask': [u'24']}),
+    ] + [
+        (DN(('cn', u'192.0.2.{0}'.format(i)), subnet_dn), lease(
+            u'192.0.2.{0}'.format(i), mac=u'00:11:22:33:44:{0:02X}'.format(i), hostname=u'host{0}'.format(i)
+        ))
+        for i in range(10, 20)
+    ])
+    return ldap
+
+
+def find(ldap, service_dn, keys={}, criteria=(), sizelimit=0):
+    keys = dict((kind, dhcpcommon.dhcp_lease_key(kind, value)) for (kind, value) in keys.items())
+    criteria = [(kind, dhcpcommon.dhcp_lease_key(kind, value)) for (kind, value) in criteria]
+    searches = []
+    find_entries = ldap.find_entries
+
+    def counted(*args, **kw):
+        (entries, truncated) = find_entries(*args, **kw)
+        searches.append(len(entries))
+        return (entries, truncated)
+    ldap.find_entries = counted
+    (store, truncated) = dhcpcommon.dhcp_ldap_lease_store(
+        ldap, service_dn, dhcpcommon.dhcp_ldap_lease_filter(ldap, keys, criteria), sizelimit
+    )
+    del ldap.find_entries
+    return ([store.lease(slot) for slot in store.find()], truncated, searches)
+
+
+def test_lookup_reads_matching_entries_only(leases, service_dn):
+    (result, truncated, searches) = find(leases, service_dn, keys={'mac': u'00-11-22-33-44-0c'})
+
+    assert result == [{
+        'address': u'192.0.2.12',
+        'state': u'active',
+        'ends': u'2 2019/01/01 12:00:00',
+        'macaddress': u'00:11:22:33:44:0C',
+        'hostname': u'host12',
+    }]
+    assert not truncated
+    assert searches == [1]
+
+
+def test_criteria_match_any_key(leases, service_dn):
+    criteria = [('address', u'192.0.2.11'), ('hostname', u'HOST13')]
+    (result, truncated, searches) = find(leases, service_dn, criteria=criteria)
+    assert sorted(lease['address'] for lease in result) == [u'192.0.2.11', u'192.0.2.13']
+
+    (result, truncated, searches) = find(leases, service_dn, keys={'hostname': u'host11'}, criteria=criteria)
+    assert [lease['address'] for lease in result] == [u'192.0.2.11']
+
+    (result, truncated, searches) = find(leases, service_dn, keys={'address': u'192.0.2.99'})
+    assert result == []
+
+
+def test_size_limit(leases, service_dn):
+    (result, truncated, searches) = find(leases, service_dn, sizelimit=3)
+    assert len(result) == 3
+    assert truncated
+
+
+def test_unreadable_attributes(ldap, service_dn):
+    # What a bind without read access to the lease attributes gets back.
+    unreadable = lease(u'192.0.2.11', state=None)
+    del unreadable['dhcpexpirationtime']
+    no_address = lease(u'192.0.2.12')
+    del no_address['cn']
+    ldap.load([
+        (DN(('cn', u'192.0.2.11'), service_dn), unreadable),
+        (DN(('cn', u'192.0.2.12'), service_dn), no_address),
+    ])
+
+    (result, truncated, searches) = find(ldap, service_dn)
+    assert result == [{'address': u'192.0.2.11', 'state': u'unknown', 'ends': u'never'}]
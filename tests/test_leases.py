@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+
+import pytest
+
+from ipalib import errors
+
+from ipaserver.plugins import dhcpcommon
+
+header = (
+    '# The format of this file is documented in the dhcpd.leases(5) manual page.\n'
+    '\n'
+    'authoring-byte-order little-endian;\n'
+    '\n'
+)
+
+ia_na = (
+    'ia-na "\\001\\000\\000\\000" {\n'
+    '  cltt 2 2019/01/01 00:00:00;\n'
+    '  iaaddr 2001:db8::10 {\n'
+    '    binding state active;\n'
+    '    preferred-life 375;\n'
+    '    max-life 600;\n'
+    '    ends 2 2019/01/01 00:10:00;\n'
+    '  }\n'
+    '  iaaddr 2001:db8::11 {\n'
+    '    binding state expired;\n'
+    '    ends 2 2019/01/01 00:05:00;\n'
+    '  }\n'
+    '}\n'
+)
+
+
+def lease(address, state, mac, hostname=None):
+    block = (
+        'lease {0} {{\n'
+        '  starts 2 2019/01/01 00:00:00;\n'
+        '  ends 2 2019/01/01 12:00:00;\n'
+        '  binding state {1};\n'
+        '  next binding state free;\n'
+        '  hardware ethernet {2};\n'
+    ).format(address, state, mac)
+    if hostname is not None:
+        block += '  client-hostname "{0}";\n'.format(hostname)
+    return block + '}\n'
+
+
+def test_chunk_leases():
+    buf = header + lease('192.0.2.10', 'active', '00:11:22:33:44:55', 'one') + ia_na
+
+    leases = list(dhcpcommon.dhcp_chunk_leases(buf, dhcpcommon.dhcp_lease_fields))
+
+    assert leases == [
+        ('192.0.2.10', {
+            'binding state': 'active',
+            'ends': '2 2019/01/01 12:00:00',
+            'hardware ethernet': '00:11:22:33:44:55',
+            'client-hostname': '"one"',
+        }),
+        ('2001:db8::10', {
+            'binding state': 'active',
+            'ends': '2 2019/01/01 00:10:00',
+            'ia': '"\\001\\000\\000\\000"',
+        }),
+        ('2001:db8::11', {
+            'binding state': 'expired',
+            'ends': '2 2019/01/01 00:05:00',
+            'ia': '"\\001\\000\\000\\000"',
+        }),
+    ]
+
+
+def test_chunks_leave_out_incomplete_block():
+    complete = header + ''.join(
+        lease('192.0.2.{0}'.format(i), 'active', '00:11:22:33:44:{0:02x}'.format(i)) for i in range(20)
+    )
+    partial = 'lease 192.0.2.99 {\n  starts 2 2019/01/01 00:00:00;\n'
+
+    for chunk_size in (7, 64, 1000, 1 << 20):
+        chunks = list(dhcpcommon.dhcp_lease_chunks(io.BytesIO(complete + partial), chunk_size))
+        assert ''.join(chunks) == complete
+        assert all(chunk.endswith('\n}\n') for chunk in chunks)
+        leases = list(dhcpcommon.dhcp_iter_leases(io.BytesIO(complete + partial), chunk_size=chunk_size))
+        assert [address for (address, fields) in leases] == ['192.0.2.{0}'.format(i) for i in range(20)]
+
+
+def write(path, text, mode='w'):
+    with open(path, mode) as f:
+        f.write(text)
+
+
+def addresses(ingester):
+    store = ingester.store
+    return dict((store.addresses[slot], store.states[slot]) for slot in store.find())
+
+
+def test_ingester_follows_appends(tmpdir):
+    path = str(tmpdir.join('dhcpd.leases'))
+    write(path, header + lease('192.0.2.10', 'active', '00:11:22:33:44:55', 'one'))
+    ingester = dhcpcommon.DHCPLeaseIngester(path)
+
+    ingester.refresh()
+    assert addresses(ingester) == {'192.0.2.10': 'active'}
+    offset = ingester.offset
+    assert offset == os.path.getsize(path)
+
+    # A block dhcpd is still writing is picked up once it is complete.
+    partial = lease('192.0.2.11', 'active', '00:11:22:33:44:66')
+    write(path, lease('192.0.2.10', 'free', '00:11:22:33:44:55') + partial[:20], 'a')
+    ingester.refresh()
+    assert addresses(ingester) == {'192.0.2.10': 'free'}
+    write(path, partial[20:], 'a')
+    ingester.refresh()
+    assert addresses(ingester) == {'192.0.2.10': 'free', '192.0.2.11': 'active'}
+    assert ingester.offset == os.path.getsize(path)
+    # The host name went with the old lease of the address.
+    assert list(ingester.store.find(mac='00:11:22:33:44:55')) == [0]
+    assert list(ingester.store.find(hostname='one')) == []
+
+
+def test_ingester_starts_over_on_rewrite(tmpdir):
+    path = str(tmpdir.join('dhcpd.leases'))
+    write(path, header + lease('192.0.2.10', 'active', '00:11:22:33:44:55') +
+          lease('192.0.2.11', 'active', '00:11:22:33:44:66'))
+    ingester = dhcpcommon.DHCPLeaseIngester(path)
+    ingester.refresh()
+    inode = ingester.inode
+
+    # dhcpd renames dhcpd.leases.new over the file, which has a new inode.
+    # The new file is longer here, so only the inode tells.
+    new = str(tmpdir.join('dhcpd.leases.new'))
+    write(new, header + ''.join(
+        lease('192.0.2.{0}'.format(i), 'active', '00:11:22:33:44:{0:02x}'.format(i)) for i in range(20, 23)
+    ))
+    os.rename(new, path)
+    ingester.refresh()
+    assert ingester.inode != inode
+    assert sorted(addresses(ingester)) == ['192.0.2.20', '192.0.2.21', '192.0.2.22']
+
+    # A file rewritten in place and now shorter than the offset.
+    write(path, header + lease('192.0.2.30', 'active', '00:11:22:33:44:77'))
+    ingester.refresh()
+    assert addresses(ingester) == {'192.0.2.30': 'active'}
+    assert ingester.offset == os.path.getsize(path)
+
+
+def test_lease_ingester_per_version(tmpdir, monkeypatch):
+    path = str(tmpdir.join('dhcpd6.leases'))
+    write(path, header + ia_na)
+    monkeypatch.setattr(dhcpcommon, 'dhcp_lease_ingesters', {})
+    monkeypatch.setitem(dhcpcommon.dhcp_lease_files, 6, path)
+
+    ingester = dhcpcommon.dhcp_lease_ingester(6)
+    assert ingester.path == path
+    assert addresses(ingester) == {'2001:db8::10': 'active', '2001:db8::11': 'expired'}
+    assert dhcpcommon.dhcp_lease_ingester(6) is ingester
+
+    monkeypatch.setitem(dhcpcommon.dhcp_lease_files, 6, str(tmpdir.join('missing')))
+    with pytest.raises(errors.NotFound):
+        dhcpcommon.dhcp_lease_ingester(6)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import binascii
+import random
+
+import pytest
+
+from ipaserver.plugins import dhcpcommon
+
+
+def random_macs(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        ':'.join('{0:02x}'.format(rng.randrange(256)) for i in range(6))
+        for j in range(count)
+    ]
+
+
+def scalar_buckets(macs, prefix=''):
+    counts = [0] * 256
+    for mac in macs:
+        counts[dhcpcommon.dhcp_loadb_hash(prefix + binascii.unhexlify(mac.replace(':', '')))] += 1
+    return counts
+
+
+def test_hash_known_answers():
+    # loadb_p_hash() of ISC dhcpd's failover.c starts from the key length
+    # and folds the key in from its last octet:
+    #   hash = len; for (i = len; i > 0;) hash = loadb_mx_tbl[hash ^ key[--i]];
+    # The answers below are worked through by hand on the RFC 3074 table.
+    hash = dhcpcommon.dhcp_loadb_hash
+
+    # No octets: the length itself.
+    assert hash('') == 0
+    # chaddr 0x0e with hlen 1: table[1 ^ 0x0e] = table[15].
+    assert hash('\x0e') == 232
+    # Six zero octets: table[6] = 79, table[79] = 67, table[67] = 61,
+    # table[61] = 23, table[23] = 237, table[237] = 254.
+    assert hash('\x00' * 6) == 254
+    # Two octets 0x01 0x02: table[2 ^ 0x02] = table[0] = 251, then
+    # table[251 ^ 0x01] = table[250] = 170.
+    assert hash('\x01\x02') == 170
+
+
+def test_hash_table_is_a_permutation():
+    assert sorted(dhcpcommon.dhcp_loadb_table) == list(range(256))
+
+
+@pytest.mark.parametrize('prefix', ['', '\x01'])
+@pytest.mark.parametrize('count', [1, 2, 255, 5000])
+def test_buckets_match_scalar_hash(prefix, count):
+    macs = random_macs(count, seed=count)
+
+    counts = dhcpcommon.dhcp_loadb_buckets(dhcpcommon.dhcp_loadb_macs(macs), prefix)
+
+    assert counts == scalar_buckets(macs, prefix)
+    assert sum(counts) == count
+
+
+def test_buckets_of_every_single_octet_mac():
+    # Every value of every octet goes through the table at least once.
+    macs = []
+    for position in range(6):
+        for octet in range(256):
+            raw = bytearray(6)
+            raw[position] = octet
+            macs.append(':'.join('{0:02x}'.format(b) for b in raw))
+
+    assert dhcpcommon.dhcp_loadb_buckets(dhcpcommon.dhcp_loadb_macs(macs)) == scalar_buckets(macs)
+
+
+def test_buckets_of_no_clients():
+    assert dhcpcommon.dhcp_loadb_buckets('') == [0] * 256
+    assert dhcpcommon.dhcp_loadb_buckets('', '\x01') == [0] * 256
+
+
+def test_macs_skip_malformed():
+    macs = ['00:11:22:33:44:55', 'garbage', '00:11:22:33:44', '66:77:88:99:aa:bb']
+    assert dhcpcommon.dhcp_loadb_macs(macs) == binascii.unhexlify('001122334455' '66778899aabb')
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from ipapython.dn import DN
+
+from ipaserver.plugins import dhcpcommon
+
+options = {
+    'defaultleasetime': 3600,
+    'maxleasetime': 7200,
+    'domainname': u'example.test',
+    'domainnameservers': [u'192.0.2.53', u'192.0.2.54'],
+    'domainsearch': [u'example.test', u'lab.example.test'],
+    'router': u'192.0.2.1',
+    'permitknownclients': True,
+    'permitunknownclients': False,
+    'hostname': u'host1.example.test',
+}
+
+decoded = {
+    'defaultleasetime': u'3600',
+    'maxleasetime': u'7200',
+    'domainname': u'example.test',
+    'domainnameservers': [u'192.0.2.53', u'192.0.2.54'],
+    'domainsearch': [u'example.test', u'lab.example.test'],
+    'router': u'192.0.2.1',
+    'permitknownclients': True,
+    'permitunknownclients': False,
+    'hostname': u'host1.example.test',
+}
+
+
+def encode(version, options, values=None):
+    updates = dhcpcommon.dhcp_virtual_updates(version, options, sorted(options))
+    return dhcpcommon.dhcp_apply_virtual_updates(updates, values if values is not None else {})
+
+
+def decode(version, values, names):
+    return dhcpcommon.dhcp_extract_virtual_params(version, dict(values), names)
+
+
+def test_round_trip_v4():
+    values = encode(4, options)
+
+    assert values['dhcpoption'].count(u'domain-name-servers 192.0.2.53, 192.0.2.54') == 1
+    assert u'allow known-clients' in values['dhcppermitlist']
+    assert u'deny unknown-clients' in values['dhcppermitlist']
+    result = decode(4, values, sorted(options))
+    for name in options:
+        assert result[name] == decoded[name], name
+
+
+def test_round_trip_v6():
+    values = encode(6, options)
+
+    assert u'dhcp6.name-servers 192.0.2.53, 192.0.2.54' in values['dhcpoption']
+    assert u'dhcp6.domain-search "example.test", "lab.example.test"' in values['dhcpoption']
+    result = decode(6, values, sorted(options))
+    for name in options:
+        assert result[name] == decoded[name], name
+
+
+def test_update_replaces_in_place():
+    values = {
+        'dhcpstatements': [u'authoritative', u'default-lease-time 600', u'dddns-domainname "old.test"'],
+        'dhcppermitlist': [u'deny known-clients'],
+    }
+
+    encode(4, {'defaultleasetime': 900, 'domainname': u'new.test', 'permitknownclients': True}, values)
+
+    # The misspelt keyword of older versions is replaced by the right one.
+    assert values['dhcpstatements'] == [
+        u'authoritative', u'default-lease-time 900', u'ddns-domainname "new.test"',
+    ]
+    assert values['dhcppermitlist'] == [u'allow known-clients']
+    assert values['dhcpoption'] == [u'domain-name "new.test"']
+
+
+def test_read_only_and_empty_values_are_not_written():
+    assert encode(4, {'ipaddress': u'192.0.2.10', 'macaddress': u'00:11:22:33:44:55'}) == {}
+    assert encode(4, {'defaultleasetime': None, 'domainsearch': [], 'permitknownclients': None}) == {}
+
+
+def test_mod_reads_only_missing_attributes(ldap, service_dn):
+    dn = DN(('cn', u'subnet'), service_dn)
+    ldap.add_entry(ldap.make_entry(dn, {
+        'objectclass': ['dhcpsubnet', 'top'],
+        'cn': [u'subnet'],
+        'dhcpstatements': [u'authoritative', u'default-lease-time 600'],
+        'dhcpoption': [u'routers 192.0.2.1'],
+    }))
+
+    entry_attrs = {'dhcpoption': [u'domain-name "set.test"']}
+    dhcpcommon.dhcp_mod_virtual_params(
+        ldap, dn, entry_attrs, {'defaultleasetime': 1200, 'router': u'192.0.2.254'}, 4,
+        ['defaultleasetime', 'router']
+    )
+
+    assert entry_attrs == {
+        'dhcpstatements': [u'authoritative', u'default-lease-time 1200'],
+        'dhcpoption': [u'domain-name "set.test"', u'routers 192.0.2.254'],
+    }
+    assert dhcpcommon.dhcp_mod_virtual_params(ldap, dn, {}, {}, 4, ['defaultleasetime']) == {}
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark of the lookup dhcpd issues for every request with
+# ldap-method dynamic: (&(objectClass=dhcpHost)(dhcpHWAddress=ethernet MAC))
+# against the tree this plugin builds.
+#
+# The hosts are loaded into an existing scratch suffix of a local 389
+# Directory Server instance, for example one created with dscreate, that has
+# schema/89dhcp.ldif in its schema directory. They are looked up by MAC
+# address, with and without the dhcpHWAddress index of 89dhcp.update.
+# Toggling the index needs write access to cn=config, so bind as
+# cn=Directory Manager. Never point this at a production server.
+#
+#   ./dhcpbench.py --uri ldap://localhost:389 --base dc=bench,dc=test \
+#       --password-file dm.pw --hosts 1000,10000,100000 --index both
+
+from __future__ import print_function, division
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+import ldap
+import ldap.modlist
+
+from dhcptopology import host_entries, host_mac
+
+
+#### Tree #####################################################################
+
+def encode(attrs):
+    return dict(
+        (attr, [value.encode('utf-8') for value in values])
+        for (attr, values) in attrs.items()
+    )
+
+
+def add(conn, dn, attrs):
+    try:
+        conn.add_s(dn, ldap.modlist.addModlist(encode(attrs)))
+    except ldap.ALREADY_EXISTS:
+        return False
+    return True
+
+
+def create_service(conn, base):
+    # cn=dhcp and cn=v4 below the scratch suffix, laid out as the update file
+    # creates them below the IPA suffix.
+    add(conn, 'cn=dhcp,{0}'.format(base), {
+        'objectClass': ['dhcpService', 'nsContainer', 'top'],
+        'cn': ['dhcp'],
+    })
+    service_dn = 'cn=v4,cn=dhcp,{0}'.format(base)
+    add(conn, service_dn, {
+        'objectClass': ['dhcpService', 'nsContainer', 'top'],
+        'cn': ['v4'],
+        'dhcpStatements': ['authoritative', 'default-lease-time 43200', 'max-lease-time 86400'],
+    })
+    return service_dn
+
+
+def populate(conn, service_dn, count):
+    # Grow the tree to count hosts; hosts from earlier, smaller rounds are
+    # kept.
+    present = len(conn.search_s(
+        service_dn, ldap.SCOPE_ONELEVEL, '(objectClass=dhcpHost)', ['1.1']
+    ))
+    for (dn, attrs) in host_entries(service_dn, max(count - present, 0), present):
+        add(conn, dn, attrs)
+
+
+def remove_service(conn, base):
+    dns = [dn for (dn, attrs) in conn.search_s(
+        'cn=dhcp,{0}'.format(base), ldap.SCOPE_SUBTREE, '(objectClass=*)', ['1.1']
+    )]
+    for dn in sorted(dns, key=lambda dn: -dn.count(',')):
+        conn.delete_s(dn)
+
+
+#### Index ####################################################################
+
+def index_dn(backend, attr):
+    return 'cn={0},cn=index,cn={1},cn=ldbm database,cn=plugins,cn=config'.format(attr, backend)
+
+
+def index_exists(conn, backend, attr):
+    try:
+        conn.search_s(index_dn(backend, attr), ldap.SCOPE_BASE, '(objectClass=*)', ['1.1'])
+    except ldap.NO_SUCH_OBJECT:
+        return False
+    return True
+
+
+def set_index(conn, backend, attr, enabled):
+    if enabled == index_exists(conn, backend, attr):
+        return
+    if not enabled:
+        conn.delete_s(index_dn(backend, attr))
+        return
+
+    add(conn, index_dn(backend, attr), {
+        'objectClass': ['top', 'nsIndex'],
+        'cn': [attr],
+        'nsSystemIndex': ['false'],
+        'nsIndexType': ['eq'],
+    })
+
+    # A new index is only used once the backend has been reindexed.
+    task_dn = 'cn=dhcpbench-{0},cn=index,cn=tasks,cn=config'.format(int(time.time() * 1000))
+    add(conn, task_dn, {
+        'objectClass': ['top', 'extensibleObject'],
+        'cn': [task_dn.split(',')[0][3:]],
+        'nsInstance': [backend],
+        'nsIndexAttribute': ['{0}:eq'.format(attr)],
+    })
+    while True:
+        try:
+            (dn, attrs) = conn.search_s(task_dn, ldap.SCOPE_BASE, '(objectClass=*)', ['nsTaskExitCode'])[0]
+        except ldap.NO_SUCH_OBJECT:
+            break
+        if 'nsTaskExitCode' in attrs:
+            if attrs['nsTaskExitCode'][0] != b'0':
+                raise RuntimeError('reindexing {0} failed'.format(attr))
+            break
+        time.sleep(0.5)
+
+
+#### Lookups ##################################################################
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def lookup_worker(args, service_dn, macs, latencies, lock):
+    conn = connect(args)
+    local = []
+    for mac in macs:
+        filter = '(&(objectClass=dhcpHost)(dhcpHWAddress=ethernet {0}))'.format(mac)
+        start = time.time()
+        conn.search_s(service_dn, ldap.SCOPE_SUBTREE, filter, ['cn', 'dhcpStatements', 'dhcpOption'])
+        local.append(time.time() - start)
+    conn.unbind_s()
+    with lock:
+        latencies.extend(local)
+
+
+def run_lookups(args, service_dn, hosts, rng):
+    # A share of the lookups is for MAC addresses that have no dhcpHost
+    # entry, like requests of unknown clients.
+    macs = []
+    for i in range(args.lookups):
+        if rng.random() < args.miss_ratio:
+            macs.append(host_mac(hosts + rng.randrange(1 << 24)))
+        else:
+            macs.append(host_mac(rng.randrange(hosts)))
+
+    latencies = []
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(
+            target=lookup_worker,
+            args=(args, service_dn, macs[n::args.concurrency], latencies, lock)
+        )
+        for n in range(args.concurrency)
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    latencies.sort()
+    return {
+        'p50': percentile(latencies, 50) * 1000,
+        'p90': percentile(latencies, 90) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'max': (latencies[-1] if latencies else 0.0) * 1000,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+#### Main #####################################################################
+
+def connect(args):
+    conn = ldap.initialize(args.uri)
+    conn.protocol_version = ldap.VERSION3
+    conn.simple_bind_s(args.bind_dn, args.password)
+    return conn
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark dhcpHost lookups by MAC address.')
+    parser.add_argument('--uri', default='ldap://localhost:389')
+    parser.add_argument('--bind-dn', default='cn=Directory Manager')
+    parser.add_argument('--password')
+    parser.add_argument('--password-file')
+    parser.add_argument('--base', required=True, help='scratch suffix the tree is created in')
+    parser.add_argument('--backend', default='userRoot', help='backend that holds the suffix')
+    parser.add_argument('--hosts', default='1000,10000,100000', help='comma separated tree sizes')
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--miss-ratio', type=float, default=0.1)
+    parser.add_argument('--index', choices=['on', 'off', 'both'], default='both')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='keep the tree afterwards')
+    args = parser.parse_args(argv)
+
+    if args.password_file:
+        with open(args.password_file) as f:
+            args.password = f.read().strip()
+    if args.password is None:
+        parser.error('--password or --password-file is required')
+    args.hosts = [int(value) for value in args.hosts.split(',')]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    conn = connect(args)
+    indexed = index_exists(conn, args.backend, 'dhcpHWAddress')
+    modes = {'on': [True], 'off': [False], 'both': [True, False]}[args.index]
+
+    service_dn = create_service(conn, args.base)
+    print('{0:>8} {1:>6} {2:>9} {3:>9} {4:>9} {5:>9} {6:>11}'.format(
+        'hosts', 'index', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'lookups/s'
+    ))
+    try:
+        for hosts in sorted(args.hosts):
+            populate(conn, service_dn, hosts)
+            for enabled in modes:
+                set_index(conn, args.backend, 'dhcpHWAddress', enabled)
+                stats = run_lookups(args, service_dn, hosts, rng)
+                print('{0:>8} {1:>6} {p50:>9.3f} {p90:>9.3f} {p99:>9.3f} {max:>9.3f} {throughput:>11.1f}'.format(
+                    hosts, 'on' if enabled else 'off', **stats
+                ))
+                sys.stdout.flush()
+    finally:
+        set_index(conn, args.backend, 'dhcpHWAddress', indexed)
+        if not args.keep:
+            remove_service(conn, args.base)
+        conn.unbind_s()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Generator of synthetic DHCP trees in the layout of this plugin: subnets
+# with pools, subnet and pool groups, nested top-level groups and hosts with
+# MAC and fixed addresses, plus IPv6 subnets with pools. The same seed and
+# shape always give the same tree.
+#
+# The tree is written as LDIF to stdout, one entry at a time:
+#
+#   ./dhcptopology.py --base dc=example,dc=com --subnets 500 --hosts 50000 > tree.ldif
+#
+# or created through the plugin's commands with the IPA API of the current
+# Kerberos user, so that all callbacks run:
+#
+#   ./dhcptopology.py --commands --subnets 50 --hosts 2000
+#
+# It also writes a dhcpd.leases for the pools of the same shape, or adds the
+# leases to the LDIF as dhcpLeases entries:
+#
+#   ./dhcptopology.py --subnets 500 --leases 1000000 > dhcpd.leases
+#   ./dhcptopology.py --base dc=example,dc=com --lease-entries 100000 > tree.ldif
+#
+# Other tools import topology() and the host helpers from this module.
+
+from __future__ import print_function, division
+
+import argparse
+import base64
+import itertools
+import random
+import sys
+import time
+
+
+#### Hosts ####################################################################
+
+def host_mac(i):
+    # Locally administered unicast MAC addresses, one per host number.
+    return '02:{0:02X}:{1:02X}:{2:02X}:{3:02X}:{4:02X}'.format(
+        (i >> 32) & 0xff, (i >> 24) & 0xff, (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff
+    )
+
+
+def host_name(i, domain='example.test'):
+    return 'host{0}.{1}'.format(i, domain)
+
+
+def host_address(i):
+    # A distinct address in 10.0.0.0/8 per host number.
+    i += 1
+    return '10.{0}.{1}.{2}'.format((i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff)
+
+
+def host_attrs(hostname, mac, fixedaddress):
+    # The attributes dhcphost_entry_attrs() in dhcpv4.py gives a dhcpHost.
+    cn = '{0}-{1}'.format(hostname, mac.replace(':', ''))
+    return {
+        'objectClass': ['dhcpHost', 'top'],
+        'cn': [cn],
+        'dhcpHWAddress': ['ethernet {0}'.format(mac)],
+        'dhcpStatements': [
+            'fixed-address {0}'.format(fixedaddress),
+            'ddns-hostname "{0}"'.format(hostname),
+        ],
+        'dhcpOption': ['host-name "{0}"'.format(hostname)],
+    }
+
+
+def host_entries(parent_dn, count, first=0):
+    # count flat dhcpHost entries below parent_dn, numbered from first.
+    for i in range(first, first + count):
+        attrs = host_attrs(host_name(i), host_mac(i), host_address(i))
+        yield ('cn={0},{1}'.format(attrs['cn'][0], parent_dn), attrs)
+
+
+#### Topology #################################################################
+
+class Shape(object):
+    subnets = 100
+    prefix = 24
+    pools = 2
+    pool_size = 50
+    subnet_groups = 1
+    pool_groups = 0
+    groups = 10
+    group_depth = 2
+    group_fanout = 2
+    hosts = 10000
+    grouped = 0.2
+    subnets6 = 0
+
+    def __init__(self, **kw):
+        for (name, value) in kw.items():
+            if not hasattr(Shape, name):
+                raise TypeError('unknown shape parameter {0}'.format(name))
+            setattr(self, name, value)
+
+
+def ip4(value):
+    return '{0}.{1}.{2}.{3}'.format((value >> 24) & 0xff, (value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff)
+
+
+def topology(base, shape, seed=0, service=False):
+    # Yield (kind, keys, dn, attrs) in parent before child order. kind names
+    # the plugin object ('subnet', 'pool', 'subnetgroup', 'poolgroup',
+    # 'group', 'groupgroup', 'host', 'subnet6', 'pool6' or 'service') and
+    # keys are the primary keys of the entry and its parents, outermost
+    # first, as the plugin's commands take them.
+    rng = random.Random(seed)
+    dhcp_dn = 'cn=dhcp,{0}'.format(base)
+    v4_dn = 'cn=v4,{0}'.format(dhcp_dn)
+    v6_dn = 'cn=v6,{0}'.format(dhcp_dn)
+
+    if service:
+        for dn in (dhcp_dn, v4_dn, v6_dn):
+            yield ('service', (), dn, {
+                'objectClass': ['dhcpService', 'nsContainer', 'top'],
+                'cn': [dn.split(',')[0][3:]],
+                'dhcpStatements': ['authoritative', 'default-lease-time 43200', 'max-lease-time 86400'],
+            })
+
+    size = 1 << (32 - shape.prefix)
+    if shape.subnets * size > 1 << 24:
+        raise ValueError('{0} subnets of /{1} do not fit into 10.0.0.0/8'.format(shape.subnets, shape.prefix))
+    if 10 + shape.pools * shape.pool_size >= size - 1:
+        raise ValueError('{0} pools of {1} addresses do not fit into a /{2}'.format(shape.pools, shape.pool_size, shape.prefix))
+
+    # Where hosts go: the service container, a subnet group or a top-level
+    # group, which are the places dhcphost-import can put them.
+    subnets = []
+    host_parents = []
+    for s in range(shape.subnets):
+        network = (10 << 24) + s * size
+        cn = ip4(network)
+        dn = 'cn={0},{1}'.format(cn, v4_dn)
+        subnets.append([network, 10 + shape.pools * shape.pool_size])
+        yield ('subnet', (cn,), dn, {
+            'objectClass': ['dhcpSubnet', 'top'],
+            'cn': [cn],
+            'dhcpNetMask': [str(shape.prefix)],
+            'dhcpOption': ['routers {0}'.format(ip4(network + 1))],
+        })
+
+        for p in range(shape.pools):
+            first = network + 10 + p * shape.pool_size
+            pool = 'pool{0}'.format(p)
+            pool_dn = 'cn={0},{1}'.format(pool, dn)
+            yield ('pool', (cn, pool), pool_dn, {
+                'objectClass': ['dhcpPool', 'top'],
+                'cn': [pool],
+                'dhcpRange': ['{0} {1}'.format(ip4(first), ip4(first + shape.pool_size - 1))],
+                'dhcpPermitList': ['allow unknown-clients', 'allow known-clients'],
+            })
+            for g in range(shape.pool_groups):
+                group = 'poolgroup{0}'.format(g)
+                yield ('poolgroup', (cn, pool, group), 'cn={0},{1}'.format(group, pool_dn), {
+                    'objectClass': ['dhcpGroup', 'top'],
+                    'cn': [group],
+                })
+
+        for g in range(shape.subnet_groups):
+            group = 'group{0}'.format(g)
+            yield ('subnetgroup', (cn, group), 'cn={0},{1}'.format(group, dn), {
+                'objectClass': ['dhcpGroup', 'top'],
+                'cn': [group],
+                'dhcpStatements': ['default-lease-time {0}'.format(rng.choice([3600, 14400, 43200]))],
+            })
+            host_parents.append((s, (cn, group), 'cn={0},{1}'.format(group, dn)))
+
+    def nested(path, parent_dn, depth, keys):
+        # Only groups directly below a top-level group have keys; the
+        # plugin has no command for deeper ones.
+        for g in range(shape.group_fanout):
+            cn = '{0}-{1}'.format(path, g)
+            dn = 'cn={0},{1}'.format(cn, parent_dn)
+            yield ('groupgroup', keys and keys + (cn,), dn, {
+                'objectClass': ['dhcpGroup', 'top'],
+                'cn': [cn],
+            })
+            if depth > 1:
+                for entry in nested(cn, dn, depth - 1, None):
+                    yield entry
+
+    for g in range(shape.groups):
+        cn = 'group{0}'.format(g)
+        dn = 'cn={0},{1}'.format(cn, v4_dn)
+        yield ('group', (cn,), dn, {
+            'objectClass': ['dhcpGroup', 'top'],
+            'cn': [cn],
+            'dhcpStatements': ['ddns-updates on'],
+        })
+        host_parents.append((None, (cn,), dn))
+        if shape.group_depth > 0:
+            for entry in nested(cn, dn, shape.group_depth, (cn,)):
+                yield entry
+
+    # Hosts get the next address after the pools of a random subnet, or of
+    # the next subnet with room left. A host whose subnet group sits in a
+    # full subnet goes to the service container instead.
+    free = shape.subnets * (size - 1 - subnets[0][1]) if subnets else 0
+    if shape.hosts > free:
+        raise ValueError('{0} hosts do not fit, use more subnets or a shorter prefix'.format(shape.hosts))
+
+    for i in range(shape.hosts):
+        parent = None
+        if host_parents and rng.random() < shape.grouped:
+            parent = rng.choice(host_parents)
+        if parent is not None and parent[0] is not None:
+            s = parent[0]
+            if subnets[s][1] >= size - 1:
+                parent = None
+        if parent is None or parent[0] is None:
+            s = rng.randrange(len(subnets))
+            while subnets[s][1] >= size - 1:
+                s = (s + 1) % len(subnets)
+        (network, used) = subnets[s]
+        subnets[s][1] += 1
+
+        attrs = host_attrs(host_name(i), host_mac(i), ip4(network + used))
+        if parent is None:
+            keys = ()
+            parent_dn = v4_dn
+        else:
+            keys = parent[1]
+            parent_dn = parent[2]
+        yield ('host', keys, 'cn={0},{1}'.format(attrs['cn'][0], parent_dn), attrs)
+
+    for s in range(shape.subnets6):
+        prefix = 'fd00:0:0:{0:x}::'.format(s) if s else 'fd00::'
+        cn = '{0}/64'.format(prefix)
+        dn = 'cn={0},{1}'.format(cn, v6_dn)
+        yield ('subnet6', (cn,), dn, {
+            'objectClass': ['dhcpSubnet6', 'top'],
+            'cn': [cn],
+            'dhcpv6NetMask': ['64'],
+        })
+        pool = 'pool0'
+        yield ('pool6', (cn, pool), 'cn={0},{1}'.format(pool, dn), {
+            'objectClass': ['dhcpPool6', 'top'],
+            'cn': [pool],
+            'dhcpRange6': ['{0}1000 {0}1fff'.format(prefix)],
+        })
+
+
+#### Leases ###################################################################
+
+# Binding states of generated leases, weighted towards active ones.
+lease_states = ['active'] * 6 + ['free', 'expired', 'abandoned', 'backup']
+
+
+def leases(shape, count, seed=0, start=1546300800):
+    # Yield (address, mac, hostname, state, starts, ends) for count lease
+    # records in the IPv4 pools of topology(), one second apart from start.
+    # As in dhcpd.leases, a later record of an address supersedes the
+    # earlier ones. Clients have their own MAC addresses, apart from the
+    # ones of the generated hosts.
+    rng = random.Random(seed)
+    size = 1 << (32 - shape.prefix)
+    per_subnet = shape.pools * shape.pool_size
+    if not shape.subnets or not per_subnet:
+        return
+    for i in range(count):
+        (s, offset) = divmod(rng.randrange(shape.subnets * per_subnet), per_subnet)
+        client = rng.randrange(shape.subnets * per_subnet * 2)
+        starts = start + i
+        yield (
+            ip4((10 << 24) + s * size + 10 + offset),
+            host_mac((1 << 39) | client).lower(),
+            'client{0}'.format(client),
+            rng.choice(lease_states),
+            starts,
+            starts + 43200,
+        )
+
+
+def lease_time(seconds):
+    return time.strftime('%w %Y/%m/%d %H:%M:%S', time.gmtime(seconds))
+
+
+def write_leases(records, out):
+    # dhcpd.leases as dhcpd writes it.
+    out.write('# The format of this file is documented in the dhcpd.leases(5) manual page.\n')
+    out.write('# This lease file was written by dhcptopology.py\n\n')
+    out.write('authoring-byte-order little-endian;\n\n')
+    for (address, mac, hostname, state, starts, ends) in records:
+        out.write(
+            'lease {0} {{\n'
+            '  starts {1};\n'
+            '  ends {2};\n'
+            '  cltt {1};\n'
+            '  binding state {3};\n'
+            '  next binding state free;\n'
+            '  rewind binding state free;\n'
+            '  hardware ethernet {4};\n'
+            '  client-hostname "{5}";\n'
+            '}}\n'.format(address, lease_time(starts), lease_time(ends), state, mac, hostname)
+        )
+
+
+def lease_entries(base, records):
+    # The last state of every leased address as dhcpLeases entries below
+    # the v4 service, the way an LDAP backed dhcpd keeps them.
+    last = {}
+    for record in records:
+        last[record[0]] = record
+    v4_dn = 'cn=v4,cn=dhcp,{0}'.format(base)
+    for (address, mac, hostname, state, starts, ends) in last.values():
+        yield ('lease', (), 'cn={0},{1}'.format(address, v4_dn), {
+            'objectClass': ['dhcpLeases', 'top'],
+            'cn': [address],
+            'dhcpAddressState': [state.upper()],
+            'dhcpExpirationTime': [time.strftime('%Y%m%d%H%M%SZ', time.gmtime(ends))],
+            'dhcpHWAddress': ['ethernet {0}'.format(mac)],
+            'dhcpAssignedHostName': [hostname],
+        })
+
+
+#### Output ###################################################################
+
+def ldif_value(attr, value):
+    if value and (value[0] in ' :<' or value[-1] == ' ' or any(ord(c) < 32 or ord(c) > 126 for c in value)):
+        return '{0}:: {1}'.format(attr, base64.b64encode(value.encode('utf-8')).decode('ascii'))
+    return '{0}: {1}'.format(attr, value)
+
+
+def write_ldif(entries, out):
+    for (kind, keys, dn, attrs) in entries:
+        out.write(ldif_value('dn', dn) + '\n')
+        for attr in sorted(attrs, key=lambda attr: attr != 'objectClass'):
+            for value in attrs[attr]:
+                out.write(ldif_value(attr, value) + '\n')
+        out.write('\n')
+
+
+# The plugin command that creates each kind of entry, and the attributes
+# that are passed to it as parameters.
+commands = {
+    'subnet': ('dhcpsubnet_add', ['dhcpNetMask', 'dhcpStatements', 'dhcpOption']),
+    'pool': ('dhcppool_add', ['dhcpRange', 'dhcpPermitList', 'dhcpStatements', 'dhcpOption']),
+    'subnetgroup': ('dhcpsubnetgroup_add', ['dhcpStatements', 'dhcpOption']),
+    'poolgroup': ('dhcppoolgroup_add', ['dhcpStatements', 'dhcpOption']),
+    'group': ('dhcpgroup_add', ['dhcpStatements', 'dhcpOption']),
+    'groupgroup': ('dhcpgroupgroup_add', ['dhcpStatements', 'dhcpOption']),
+    'subnet6': ('dhcpv6subnet_add', ['dhcpv6NetMask', 'dhcpStatements', 'dhcpOption']),
+    'pool6': ('dhcpv6pool_add', ['dhcpRange6', 'dhcpPermitList', 'dhcpStatements', 'dhcpOption']),
+}
+
+
+def run_commands(api, entries, chunk=1000, out=sys.stderr):
+    # Hosts are collected and created with dhcphost-import; everything else
+    # goes through its own add command. Nested groups deeper than one level
+    # have no command and are skipped.
+    rows = []
+    skipped = 0
+
+    def flush():
+        if rows:
+            api.Command['dhcphost_import'](u'\n'.join(rows) + u'\n', format=u'csv')
+            del rows[:]
+
+    for (kind, keys, dn, attrs) in entries:
+        if kind == 'host':
+            hostname = attrs['dhcpOption'][0].split('"')[1]
+            mac = attrs['dhcpHWAddress'][0].split()[1]
+            address = attrs['dhcpStatements'][0].split()[1]
+            subnet = keys[0] if len(keys) == 2 else u''
+            group = keys[-1] if keys else u''
+            rows.append(u','.join([hostname, mac, address, subnet, group]))
+            if len(rows) >= chunk:
+                flush()
+            continue
+
+        if kind not in commands or not keys:
+            skipped += 1
+            continue
+
+        flush()
+        (command, params) = commands[kind]
+        options = {}
+        for attr in params:
+            if attr in attrs:
+                values = [u'{0}'.format(value) for value in attrs[attr]]
+                options[attr.lower()] = int(values[0]) if attr.lower().endswith('netmask') else values
+        api.Command[command](*[u'{0}'.format(key) for key in keys], **options)
+    flush()
+
+    if skipped:
+        print('skipped {0} entries that have no plugin command'.format(skipped), file=out)
+
+
+#### Main #####################################################################
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Generate a synthetic DHCP tree.')
+    parser.add_argument('--base', help='LDAP suffix; required for LDIF output')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--service', action='store_true', help='also emit cn=dhcp, cn=v4 and cn=v6')
+    parser.add_argument('--commands', action='store_true', help='create the tree through the IPA API')
+    parser.add_argument('--leases', type=int, metavar='COUNT',
+                        help='write a dhcpd.leases with COUNT records for the pools instead')
+    parser.add_argument('--lease-entries', type=int, default=0, metavar='COUNT',
+                        help='add dhcpLeases entries for COUNT lease records to the LDIF')
+    for name in sorted(vars(Shape)):
+        if name.startswith('_'):
+            continue
+        default = getattr(Shape, name)
+        parser.add_argument(
+            '--{0}'.format(name.replace('_', '-')), type=type(default), default=default,
+            dest=name, help='default {0}'.format(default)
+        )
+    args = parser.parse_args(argv)
+    if not args.commands and args.leases is None and not args.base:
+        parser.error('--base is required for LDIF output')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    shape = Shape(**dict(
+        (name, getattr(args, name)) for name in vars(Shape) if not name.startswith('_')
+    ))
+
+    if args.commands:
+        from ipalib import api
+        api.bootstrap(context='cli')
+        api.finalize()
+        api.Backend.rpcclient.connect()
+        entries = topology(api.env.basedn, shape, args.seed)
+        run_commands(api, (e for e in entries if e[0] != 'service'))
+    elif args.leases is not None:
+        write_leases(leases(shape, args.leases, args.seed), sys.stdout)
+    else:
+        entries = topology(args.base, shape, args.seed, args.service)
+        if args.lease_entries:
+            records = leases(shape, args.lease_entries, args.seed)
+            entries = itertools.chain(entries, lease_entries(args.base, records))
+        write_ldif(entries, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
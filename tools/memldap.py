@@ -0,0 +1,630 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# See file 'LICENSE' for use and warranty information.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# In-memory stand-in for the ldap2 backend, implementing the part of its API
+# the DHCP plugin uses: get_entry, get_entries, find_entries, add_entry,
+# update_entry, delete_entry, make_entry, make_filter and combine_filters,
+# and the sorted, size limited searches of dhcp_sorted_search() and the
+# whoami of dhcp_tombstones_visible() on the python-ldap connection, which
+# is bound as Directory Manager. Paged searches return all their entries at
+# once.
+# Entries are stored by normalized DN with an equality index over every
+# attribute value, so searches only evaluate their filter on the candidates
+# of their indexed equality terms. entryDN filters match the DN of the
+# entries, as in 389 Directory Server, and the root DSE carries the lastusn
+# of its USN plugin. Errors are the ipalib ones ldap2 raises.
+#
+# The callbacks of the plugin take the backend as an argument, so they can
+# be called with a MemoryLDAP directly:
+#
+#   ldap = MemoryLDAP()
+#   ldap.load(dhcptopology.topology(basedn, dhcptopology.Shape(hosts=1000)))
+#   command.pre_callback(ldap, dn, entry_attrs, [], **options)
+#
+# Run as a script it loads a synthetic tree and reports how many dhcpHost
+# lookups by MAC address it answers per second.
+
+from __future__ import print_function, division
+
+import collections
+import contextlib
+import itertools
+import re
+import sys
+import time
+
+import ldap
+
+from ipalib import errors
+from ipapython.dn import DN
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+
+#### Entries ##################################################################
+
+# Operational attributes are only returned when they are asked for by name.
+operational_attrs = set(['createtimestamp', 'modifytimestamp', 'entrycsn', 'nscpentrydn'])
+
+
+def to_text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return text_type(value)
+
+
+def to_value(value):
+    # Stored values are text, except binary ones (Octet String values such
+    # as a raw dhcpHashBucketAssignment), which stay bytes as in ldap2.
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return value
+    return to_text(value)
+
+
+def normalize(attr, value):
+    # Values are compared case-insensitively, and values of DN attributes
+    # as DNs.
+    if isinstance(value, bytes):
+        value = to_value(value)
+        if isinstance(value, bytes):
+            return value
+    value = to_text(value)
+    if attr.endswith('dn'):
+        try:
+            return text_type(DN(value)).lower()
+        except (ValueError, TypeError):
+            pass
+    return value.lower()
+
+
+class MemoryEntry(MutableMapping):
+    # A case-insensitive mapping of attribute names to lists of values, with
+    # a dn, like ipaldap.LDAPEntry.
+
+    def __init__(self, dn, attrs=None):
+        self.dn = DN(dn)
+        self._names = {}
+        self._values = {}
+        self._deleted = set()
+        for (attr, values) in (attrs or {}).items():
+            self[attr] = values
+
+    def __getitem__(self, attr):
+        return self._values[attr.lower()]
+
+    def __setitem__(self, attr, values):
+        key = attr.lower()
+        if values is None:
+            values = []
+        elif not isinstance(values, (list, tuple, set, frozenset)):
+            values = [values]
+        self._names[key] = attr
+        self._values[key] = [to_value(value) if isinstance(value, (bytes, DN)) else value for value in values]
+        self._deleted.discard(key)
+
+    def __delitem__(self, attr):
+        key = attr.lower()
+        del self._values[key]
+        del self._names[key]
+        self._deleted.add(key)
+
+    def __iter__(self):
+        return iter(list(self._names.values()))
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, attr):
+        return attr.lower() in self._values
+
+    def __repr__(self):
+        return 'MemoryEntry({0!r}, {1!r})'.format(text_type(self.dn), dict(self.items()))
+
+    def copy(self):
+        return MemoryEntry(self.dn, dict((self._names[k], list(v)) for (k, v) in self._values.items()))
+
+
+#### Filters ##################################################################
+
+class FilterError(ValueError):
+    pass
+
+
+def unescape(value):
+    return re.sub(r'\\([0-9a-fA-F]{2})', lambda m: chr(int(m.group(1), 16)), value)
+
+
+def escape(value):
+    value = to_text(value)
+    for (c, e) in (('\\', r'\5c'), ('*', r'\2a'), ('(', r'\28'), (')', r'\29'), ('\0', r'\00')):
+        value = value.replace(c, e)
+    return value
+
+
+def parse_filter(text):
+    # Parse an RFC 4515 filter into nested tuples:
+    #   ('&', [...]), ('|', [...]), ('!', node), ('pres', attr),
+    #   ('=', attr, value), ('>=', attr, value), ('<=', attr, value),
+    #   ('sub', attr, initial, [any...], final)
+    text = text.strip()
+    if not text.startswith('('):
+        text = '({0})'.format(text)
+    (node, pos) = _parse(text, 0)
+    if pos != len(text):
+        raise FilterError('trailing characters in filter {0!r}'.format(text))
+    return node
+
+
+def _parse(text, pos):
+    if text[pos] != '(':
+        raise FilterError('expected ( at {0} in {1!r}'.format(pos, text))
+    pos += 1
+    op = text[pos]
+    if op in '&|':
+        children = []
+        pos += 1
+        while text[pos] == '(':
+            (child, pos) = _parse(text, pos)
+            children.append(child)
+        node = (op, children)
+    elif op == '!':
+        (child, pos) = _parse(text, pos + 1)
+        node = ('!', child)
+    else:
+        end = text.index(')', pos)
+        item = text[pos:end]
+        match = re.match(r'^([^=<>~]+)(=|>=|<=|~=)(.*)$', item)
+        if match is None:
+            raise FilterError('invalid filter item {0!r}'.format(item))
+        (attr, op, value) = match.groups()
+        attr = attr.strip().lower()
+        if op == '~=':
+            op = '='
+        if op == '=' and value == '*':
+            node = ('pres', attr)
+        elif op == '=' and '*' in value:
+            parts = [unescape(part) for part in value.split('*')]
+            node = ('sub', attr, parts[0], parts[1:-1], parts[-1])
+        else:
+            node = (op, attr, unescape(value))
+        pos = end
+    if text[pos] != ')':
+        raise FilterError('expected ) at {0} in {1!r}'.format(pos, text))
+    return (node, pos + 1)
+
+
+def match_filter(node, entry):
+    op = node[0]
+    if op == '&':
+        return all(match_filter(child, entry) for child in node[1])
+    if op == '|':
+        return any(match_filter(child, entry) for child in node[1])
+    if op == '!':
+        return not match_filter(node[1], entry)
+
+    attr = node[1]
+    if attr == 'entrydn':
+        values = [normalize(attr, entry.dn)]
+    elif attr not in entry:
+        return False
+    else:
+        values = [normalize(attr, value) for value in entry[attr]]
+    if op == 'pres':
+        return True
+    if op == 'sub':
+        pattern = '.*'.join(re.escape(part.lower()) for part in [node[2]] + node[3] + [node[4]])
+        return any(re.match('^{0}$'.format(pattern), value, re.S) for value in values)
+    wanted = normalize(attr, node[2])
+    if op == '=':
+        return wanted in values
+    if op == '>=':
+        return any(value >= wanted for value in values)
+    return any(value <= wanted for value in values)
+
+
+#### Backend ##################################################################
+
+class MemoryConnection(object):
+    # The python-ldap connection methods the plugin calls: a search with the
+    # server side sort control and a size limit, whose entries are read one
+    # at a time, and whoami. Values come back as UTF-8 bytes.
+
+    sort_control_type = '1.2.840.113556.1.4.473'
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.results = {}
+        self.msgids = itertools.count(1)
+        self.authzid = 'dn: cn=directory manager'
+
+    def whoami_s(self):
+        return self.authzid
+
+    def search_ext(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0,
+                   serverctrls=None, clientctrls=None, timeout=-1, sizelimit=0):
+        entries = self.backend._search(DN(to_text(base)), scope, to_text(filterstr), attrlist)
+        for control in serverctrls or []:
+            if getattr(control, 'controlType', None) == self.sort_control_type:
+                # Sort on the first key only; "-cn" sorts in reverse order.
+                rule = control.ordering_rules[0].split(':')[0]
+                attr = rule.lstrip('-')
+                entries.sort(
+                    key=lambda entry: [normalize(attr, v) for v in entry.get(attr, [])][:1],
+                    reverse=rule.startswith('-')
+                )
+        exceeded = bool(sizelimit) and len(entries) > sizelimit
+        if exceeded:
+            entries = entries[:sizelimit]
+        msgid = next(self.msgids)
+        self.results[msgid] = (list(entries), exceeded)
+        return msgid
+
+    def result3(self, msgid, all=1, timeout=None):
+        (entries, exceeded) = self.results[msgid]
+        if entries and not all:
+            entry = entries.pop(0)
+            return (ldap.RES_SEARCH_ENTRY, [self._raw(entry)], msgid, [])
+        del self.results[msgid]
+        if exceeded:
+            raise ldap.SIZELIMIT_EXCEEDED({'desc': 'Size limit exceeded'})
+        return (ldap.RES_SEARCH_RESULT, [self._raw(entry) for entry in entries], msgid, [])
+
+    @staticmethod
+    def _raw(entry):
+        return (
+            text_type(entry.dn).encode('utf-8'),
+            dict((attr, [v if isinstance(v, bytes) else v.encode('utf-8') for v in entry[attr]]) for attr in entry)
+        )
+
+
+class MemoryLDAP(object):
+
+    SCOPE_BASE = 0
+    SCOPE_ONELEVEL = 1
+    SCOPE_SUBTREE = 2
+
+    MATCH_ALL = '&'
+    MATCH_ANY = '|'
+    MATCH_NONE = '!'
+
+    def __init__(self):
+        self.entries = {}
+        self.children = collections.defaultdict(set)
+        self.index = collections.defaultdict(lambda: collections.defaultdict(set))
+        self.tombstones = {}
+        self.csn = itertools.count(1)
+        self.lastusn = 0
+        self.conn = MemoryConnection(self)
+
+    #### storage ####
+
+    @staticmethod
+    def key(dn):
+        return text_type(DN(dn)).lower()
+
+    def _stamp(self, entry, created=False):
+        self.lastusn += 1
+        now = time.time()
+        stamp = text_type(time.strftime('%Y%m%d%H%M%SZ', time.gmtime(now)))
+        entry['modifytimestamp'] = [stamp]
+        entry['entrycsn'] = [u'{0:08x}{1:04x}00010000'.format(int(now), next(self.csn) & 0xffff)]
+        if created:
+            entry['createtimestamp'] = [stamp]
+
+    def _index(self, key, entry, add=True):
+        for attr in entry:
+            values = self.index[attr.lower()]
+            for value in entry[attr]:
+                value = normalize(attr.lower(), value)
+                if add:
+                    values[value].add(key)
+                else:
+                    values[value].discard(key)
+                    if not values[value]:
+                        del values[value]
+
+    def _store(self, entry):
+        key = self.key(entry.dn)
+        old = self.entries.get(key)
+        if old is not None:
+            self._index(key, old, add=False)
+        stored = entry.copy()
+        stored._deleted = set()
+        self.entries[key] = stored
+        self._index(key, stored)
+
+    def _project(self, entry, attrs_list):
+        if attrs_list is None:
+            attrs_list = ['*']
+        wanted = set(attr.lower() for attr in attrs_list)
+        result = MemoryEntry(entry.dn)
+        for attr in entry:
+            lower = attr.lower()
+            if lower in wanted or ('+' in wanted and lower in operational_attrs) or (
+                    '*' in wanted and lower not in operational_attrs):
+                result[attr] = list(entry[attr])
+        result._deleted = set()
+        return result
+
+    def load(self, entries):
+        # Add (dn, attrs) pairs, or the (kind, keys, dn, attrs) tuples of
+        # dhcptopology.topology(); missing parents are created on the way.
+        for item in entries:
+            (dn, attrs) = item[-2:]
+            dn = DN(dn)
+            for i in range(len(dn) - 1, 0, -1):
+                if self.key(dn[i:]) not in self.entries:
+                    self.add_entry(MemoryEntry(dn[i:], {'objectclass': ['top', 'nsContainer']}))
+            self.add_entry(MemoryEntry(dn, attrs))
+
+    #### ldap2 API ####
+
+    def make_entry(self, _dn=None, _obj=None, **kwargs):
+        attrs = dict(_obj or {})
+        attrs.update(kwargs)
+        return MemoryEntry(_dn, attrs)
+
+    def get_entry(self, dn, attrs_list=None, **kwargs):
+        if not DN(dn):
+            # The root DSE, with the lastusn of the USN plugin.
+            return self._project(MemoryEntry(DN(), {'lastusn': [text_type(self.lastusn)]}), attrs_list)
+        entry = self.entries.get(self.key(dn))
+        if entry is None:
+            raise errors.NotFound(reason=u'{0}: entry not found'.format(dn))
+        return self._project(entry, attrs_list)
+
+    def add_entry(self, entry):
+        key = self.key(entry.dn)
+        if key in self.entries:
+            raise errors.DuplicateEntry()
+        parent = self.key(entry.dn[1:]) if len(entry.dn) > 1 else None
+        if parent is not None and parent not in self.entries and self.entries:
+            raise errors.NotFound(reason=u'{0}: parent entry not found'.format(entry.dn))
+        entry = entry.copy()
+        self._stamp(entry, created=True)
+        self._store(entry)
+        if parent is not None:
+            self.children[parent].add(key)
+
+    def update_entry(self, entry):
+        key = self.key(entry.dn)
+        stored = self.entries.get(key)
+        if stored is None:
+            raise errors.NotFound(reason=u'{0}: entry not found'.format(entry.dn))
+
+        updated = stored.copy()
+        for attr in entry:
+            if attr.lower() in operational_attrs:
+                continue
+            if entry[attr]:
+                updated[attr] = list(entry[attr])
+            elif attr in updated:
+                del updated[attr]
+        for attr in entry._deleted:
+            if attr in updated:
+                del updated[attr]
+
+        def content(e):
+            return dict(
+                (attr.lower(), sorted(normalize(attr.lower(), v) for v in e[attr]))
+                for attr in e if attr.lower() not in operational_attrs
+            )
+        if content(updated) == content(stored):
+            raise errors.EmptyModlist()
+
+        self._stamp(updated)
+        self._store(updated)
+        entry._deleted = set()
+
+    def delete_entry(self, entry_or_dn):
+        dn = getattr(entry_or_dn, 'dn', entry_or_dn)
+        key = self.key(dn)
+        entry = self.entries.get(key)
+        if entry is None:
+            raise errors.NotFound(reason=u'{0}: entry not found'.format(dn))
+        if self.children.get(key):
+            raise errors.NotAllowedOnNonLeaf()
+
+        self._index(key, entry, add=False)
+        del self.entries[key]
+        if len(entry.dn) > 1:
+            self.children[self.key(entry.dn[1:])].discard(key)
+        self.children.pop(key, None)
+
+        # Keep a tombstone like the replication plugin does.
+        tombstone = entry.copy()
+        uniqueid = u'{0:08x}'.format(next(self.csn))
+        tombstone.dn = DN(('nsuniqueid', uniqueid), *entry.dn[1:]) if len(entry.dn) > 1 else DN(('nsuniqueid', uniqueid))
+        tombstone['objectclass'] = list(entry.get('objectclass', [])) + [u'nsTombstone']
+        tombstone['nscpentrydn'] = [text_type(entry.dn)]
+        self._stamp(tombstone)
+        self.tombstones[self.key(tombstone.dn)] = tombstone
+
+    def get_entries(self, base_dn, scope=SCOPE_SUBTREE, filter=None, attrs_list=None, **kwargs):
+        entries = self._search(DN(base_dn), scope, filter, attrs_list)
+        if not entries:
+            raise errors.NotFound(reason=u'no such entry')
+        return entries
+
+    def find_entries(self, filter=None, attrs_list=None, base_dn=None, scope=SCOPE_SUBTREE,
+                     time_limit=None, size_limit=None, **kwargs):
+        entries = self._search(DN(base_dn or ''), scope, filter, attrs_list)
+        if not entries:
+            raise errors.NotFound(reason=u'no such entry')
+        truncated = False
+        if size_limit and len(entries) > size_limit:
+            entries = entries[:size_limit]
+            truncated = True
+        return (entries, truncated)
+
+    def make_filter_from_attr(self, attr, value, rules='|', exact=True,
+                              leading_wildcard=True, trailing_wildcard=True):
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return self.combine_filters(
+                [self.make_filter_from_attr(attr, v, rules, exact, leading_wildcard, trailing_wildcard) for v in value],
+                rules
+            )
+        value = escape(value)
+        if not exact:
+            value = u'{0}{1}{2}'.format(
+                u'*' if leading_wildcard else u'', value, u'*' if trailing_wildcard else u''
+            )
+        if rules == self.MATCH_NONE:
+            return u'(!({0}={1}))'.format(attr, value)
+        return u'({0}={1})'.format(attr, value)
+
+    def make_filter(self, entry_attrs, attrs_list=None, rules='|', exact=True,
+                    leading_wildcard=True, trailing_wildcard=True):
+        filters = []
+        for (attr, value) in entry_attrs.items():
+            if attrs_list is not None and attr not in attrs_list:
+                continue
+            filters.append(self.make_filter_from_attr(
+                attr, value, rules, exact, leading_wildcard, trailing_wildcard
+            ))
+        return self.combine_filters(filters, rules)
+
+    def combine_filters(self, filters, rules='|'):
+        filters = [f for f in filters if f]
+        if rules == self.MATCH_NONE:
+            rules = self.MATCH_ALL
+        if not filters:
+            return u''
+        if len(filters) == 1:
+            return filters[0]
+        return u'({0}{1})'.format(rules, u''.join(filters))
+
+    @contextlib.contextmanager
+    def error_handler(self, arg_desc=None):
+        yield
+
+    #### search ####
+
+    def _candidates(self, node):
+        # The keys of the entries a filter can match according to the
+        # equality index, or None when any entry can.
+        op = node[0]
+        if op == '=' and node[1] == 'entrydn':
+            return set([self.key(node[2])])
+        if op == '=':
+            return self.index.get(node[1], {}).get(normalize(node[1], node[2]), set())
+        if op == '&':
+            sets = [s for s in (self._candidates(child) for child in node[1]) if s is not None]
+            if not sets:
+                return None
+            sets.sort(key=len)
+            result = set(sets[0])
+            for s in sets[1:]:
+                result &= s
+            return result
+        if op == '|':
+            result = set()
+            for child in node[1]:
+                s = self._candidates(child)
+                if s is None:
+                    return None
+                result |= s
+            return result
+        return None
+
+    def _in_scope(self, key, base, scope):
+        if scope == self.SCOPE_BASE:
+            return key == base
+        if scope == self.SCOPE_ONELEVEL:
+            return key.endswith(u',' + base) and key.count(u',') == base.count(u',') + 1 if base else key.count(u',') == 0
+        return key == base or key.endswith(u',' + base) or not base
+
+    def _search(self, base_dn, scope, filter, attrs_list):
+        node = parse_filter(filter or u'(objectclass=*)')
+        base = self.key(base_dn) if len(base_dn) else u''
+
+        if base and base not in self.entries:
+            raise errors.NotFound(reason=u'{0}: entry not found'.format(base_dn))
+
+        if 'nstombstone' in (filter or u'').lower():
+            pool = self.tombstones
+            keys = list(pool)
+        else:
+            pool = self.entries
+            keys = self._candidates(node)
+            if keys is None:
+                if scope == self.SCOPE_BASE:
+                    keys = [base]
+                elif scope == self.SCOPE_ONELEVEL:
+                    keys = self.children.get(base, ())
+                else:
+                    keys = pool
+
+        result = []
+        for key in sorted(keys):
+            entry = pool.get(key)
+            if entry is None or not self._in_scope(key, base, scope):
+                continue
+            if match_filter(node, entry):
+                result.append(self._project(entry, attrs_list))
+        return result
+
+
+#### Main #####################################################################
+
+def main(argv=None):
+    import argparse
+    import random
+
+    import dhcptopology
+
+    parser = argparse.ArgumentParser(description='Time dhcpHost lookups on the in-memory backend.')
+    parser.add_argument('--hosts', type=int, default=10000)
+    parser.add_argument('--subnets', type=int, default=100)
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    base = DN('dc=example,dc=test')
+    ldap = MemoryLDAP()
+    start = time.time()
+    ldap.load(dhcptopology.topology(base, dhcptopology.Shape(hosts=args.hosts, subnets=args.subnets), args.seed))
+    print('loaded {0} entries in {1:.2f}s'.format(len(ldap.entries), time.time() - start))
+
+    rng = random.Random(args.seed)
+    service_dn = DN(('cn', 'v4'), ('cn', 'dhcp'), base)
+    start = time.time()
+    for i in range(args.lookups):
+        mac = dhcptopology.host_mac(rng.randrange(args.hosts))
+        filter = ldap.combine_filters([
+            ldap.make_filter({'objectclass': 'dhcphost'}),
+            ldap.make_filter({'dhcphwaddress': u'ethernet {0}'.format(mac)}),
+        ], ldap.MATCH_ALL)
+        ldap.get_entries(service_dn, ldap.SCOPE_SUBTREE, filter, ['cn', 'dhcpstatements'])
+    elapsed = time.time() - start
+    print('{0} lookups in {1:.2f}s, {2:.0f} lookups/s'.format(args.lookups, elapsed, args.lookups / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+// See file 'LICENSE' for use and warranty information.
+//
+// This program is free software; you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// This program is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+// UI parts shared by the dhcpv4 and dhcpv6 plugins.
+
+define(
+    ['freeipa/ipa', 'freeipa/phases', 'freeipa/reg'],
+    function(IPA, phases, reg) {
+
+
+        var exp = IPA.dhcpcommon = {};
+
+
+//// Factories ////////////////////////////////////////////////////////////////
+
+
+        // A nested search facet for DHCP hosts that loads one server side
+        // page at a time. The cursor handed back with a page is only
+        // followed when the user asks for the next page; the cursors of the
+        // pages before the current one are kept for going back.
+        exp.dhcphost_nested_search_facet = function(spec) {
+            spec = spec || {};
+
+            spec.actions = (spec.actions || []).concat([
+                {
+                    name: 'dhcphost_previous_page',
+                    label: 'Previous',
+                    enabled: false,
+                    handler: function(facet) {
+                        facet.previous_page();
+                    }
+                },
+                {
+                    name: 'dhcphost_next_page',
+                    label: 'Next',
+                    enabled: false,
+                    handler: function(facet) {
+                        facet.next_page();
+                    }
+                }
+            ]);
+            spec.control_buttons = (spec.control_buttons || []).concat([
+                {
+                    name: 'dhcphost_previous_page',
+                    label: 'Previous',
+                    icon: 'fa-chevron-left'
+                },
+                {
+                    name: 'dhcphost_next_page',
+                    label: 'Next',
+                    icon: 'fa-chevron-right'
+                }
+            ]);
+
+            var that = IPA.nested_search_facet(spec);
+
+            that.page_size = spec.page_size || 100;
+            that.refresh_id = 0;
+
+            that.cursor = null;
+            that.next_cursor = null;
+            that.previous_cursors = [];
+            that.paged_search = null;
+
+            that.update_page_actions = function() {
+                that.actions.get('dhcphost_previous_page').set_enabled(that.previous_cursors.length > 0);
+                that.actions.get('dhcphost_next_page').set_enabled(!!that.next_cursor);
+            };
+
+            that.next_page = function() {
+                if (!that.next_cursor) return;
+                that.previous_cursors.push(that.cursor);
+                that.cursor = that.next_cursor;
+                that.refresh();
+            };
+
+            that.previous_page = function() {
+                if (!that.previous_cursors.length) return;
+                that.cursor = that.previous_cursors.pop();
+                that.refresh();
+            };
+
+            that.refresh = function() {
+                // Another parent entry or search filter starts at the first
+                // page again.
+                var search = that.get_pkeys().join('/') + '?' + (that.state.filter || '');
+                if (search !== that.paged_search) {
+                    that.paged_search = search;
+                    that.cursor = null;
+                    that.previous_cursors = [];
+                }
+
+                var refresh_id = ++that.refresh_id;
+                var command = that.create_refresh_command();
+                command.set_option('pagesize', that.page_size);
+                if (that.cursor) {
+                    command.set_option('cursor', that.cursor);
+                }
+
+                command.on_success = function(data, text_status, xhr) {
+                    if (refresh_id != that.refresh_id) return;
+                    that.next_cursor = data.result.cursor || null;
+                    that.update_page_actions();
+                    that.load(data);
+                    that.show_content();
+                };
+
+                command.on_error = function(xhr, text_status, error_thrown) {
+                    if (refresh_id != that.refresh_id) return;
+                    that.report_error(error_thrown);
+                };
+
+                command.execute();
+            };
+
+            return that;
+        };
+
+
+//// exp.register /////////////////////////////////////////////////////////////
+
+
+        exp.register = function() {
+            var f = reg.facet;
+            f.copy('nested_search', 'dhcphost_nested_search', {
+                factory: exp.dhcphost_nested_search_facet
+            });
+        };
+
+
+//// phases ///////////////////////////////////////////////////////////////////
+
+
+        phases.on('registration', exp.register);
+
+        return exp;
+
+    }
+);
@@ -15,8 +15,9 @@
 // along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 define(
-    ['freeipa/ipa', 'freeipa/menu', 'freeipa/phases', 'freeipa/reg', 'freeipa/rpc', 'freeipa/net'],
-    function(IPA, menu, phases, reg, rpc, NET) {
+    ['freeipa/ipa', 'freeipa/menu', 'freeipa/phases', 'freeipa/reg', 'freeipa/rpc', 'freeipa/net',
+     'plugins/dhcpcommon/dhcpcommon'],
+    function(IPA, menu, phases, reg, rpc, NET, dhcpcommon) {
 
 
         var exp = IPA.dhcp = {};
@@ -318,7 +319,7 @@ define(
                         ]
                     },
                     {
-                        $type: 'nested_search',
+                        $type: 'dhcphost_nested_search',
                         facet_group: 'dhcphostfacetgroup',
                         nested_entity: 'dhcpsubnethost',
                         search_all_entries: true,
@@ -434,7 +435,7 @@ define(
                         ]
                     },
                     {
-                        $type: 'nested_search',
+                        $type: 'dhcphost_nested_search',
                         facet_group: 'dhcppoolhostfacetgroup',
                         nested_entity: 'dhcppoolhost',
                         search_all_entries: true,
@@ -556,7 +557,7 @@ define(
                         ]
                     },
                     {
-                        $type: 'nested_search',
+                        $type: 'dhcphost_nested_search',
                         facet_group: element_name + 'hostfacetgroup',
                         nested_entity: element_name + 'host',
                         search_all_entries: true,
@@ -15,8 +15,9 @@
 // along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 define(
-    ['freeipa/ipa', 'freeipa/menu', 'freeipa/phases', 'freeipa/reg', 'freeipa/rpc', 'freeipa/net'],
-    function(IPA, menu, phases, reg, rpc, NET) {
+    ['freeipa/ipa', 'freeipa/menu', 'freeipa/phases', 'freeipa/reg', 'freeipa/rpc', 'freeipa/net',
+     'plugins/dhcpcommon/dhcpcommon'],
+    function(IPA, menu, phases, reg, rpc, NET, dhcpcommon) {
 
 
         var exp = IPA.dhcpv6 = {};
@@ -332,7 +333,7 @@ define(
                         ]
                     },
                     {
-                        $type: 'nested_search',
+                        $type: 'dhcphost_nested_search',
                         facet_group: 'dhcpv6hostfacetgroup',
                         nested_entity: 'dhcpv6subnethost',
                         search_all_entries: true,
@@ -436,7 +437,7 @@ define(
                         ]
                     },
                     {
-                        $type: 'nested_search',
+                        $type: 'dhcphost_nested_search',
                         facet_group: 'dhcpv6poolhostfacetgroup',
                         nested_entity: 'dhcpv6poolhost',
                         search_all_entries: true,
@@ -557,7 +558,7 @@ define(
                         ]
                     },
                     {
-                        $type: 'nested_search',
+                        $type: 'dhcphost_nested_search',
                         facet_group: element_name + 'hostfacetgroup',
                         nested_entity: element_name + 'host',
                         search_all_entries: true,